@@ -1,65 +1,93 @@
 import sys
-from datetime import timedelta, datetime
-from utils.check_new import check_mail_and_download_attachments
-from utils.constants import CHECK_INTERVAL, DISPLAY_PHOTO_INTERVAL
-from utils.display_next import display_next_image
-from utils.eink import send_to_eink
+import threading
+import time
+from utils.constants import DISPLAY_PHOTO_INTERVAL
+from utils.display_next import get_current_photo, schedule_rotation
+from utils.display_worker import request_display
 from utils.email import tell_sender, tell_owner
-from utils.image_manipulation import process_new_image
-from utils.led import stop_blinking_led, start_blinking_led
+from utils.ingest import process_new_mail, add_new_photos, prepare_frames
+from utils.led import stop_blinking_led, start_blinking_led, show_error_code, ERROR_MAILBOX
+from utils.mailbox import wait_for_new_mail, close_mailbox, next_check_interval
+from utils.scheduler import post, run
 from utils.utils import *
+from utils.workers import start_workers, stop_workers
+
+if __name__ == "__main__":
+    # Image workers are forked : before the buttons start their threads (gpiozero), see utils/workers.py
+    start_workers()
 
 if sys.platform != "win32":
     from utils.buttons import *
 
 
 def run_app():
-    last_display_time = datetime.min
-    min_display_duration = timedelta(seconds=DISPLAY_PHOTO_INTERVAL)
-    debug_log(f"Starting application - {last_display_time} ; display {min_display_duration}", 'info')
-
-    while True :
-        start_blinking_led()
-
-        now = datetime.now()
-        debug_log(f"(re)starting loop -- {now}", 'info')
-
-        # Case 1 : we have a new mail with an image attachment
-        if mail_image := check_mail_and_download_attachments():
-            # mail_image is a tuple (sender_email, attachment_path)
-            sender_email, attachment_path = mail_image
-            debug_log(f"Sender : {sender_email}", 'info')
-            debug_log(f"Attachment : {attachment_path}", 'info')
-
-            image_name = process_new_image(attachment_path)
-
-            # Display new image on Pimoroni, tell sender and tell recipient
-            send_to_eink(image_name)
-            tell_sender(sender_email)
-            tell_owner(sender_email)
-
-            last_display_time = now
-
-        # Case 2 : no new image, but it's been more than 1 hour since the last display
-        elif now - last_display_time >= min_display_duration:
-            debug_log("Displaying next image", 'info')
-            display_next_image()
-            last_display_time = now
-
-        # Case 3 : no new mail, and it's been less than {min_display_duration} since the last display
-        else:
-            # nothing to do
-            debug_log(f"No new mail, and it's been less than {min_display_duration} since the last display", 'info')
-            pass
-
-        # Wait for CHECK_INTERVAL minutes before checking again
-        debug_log(f"Sleeping for {CHECK_INTERVAL} seconds", 'info')
+    debug_log(f"Starting application ; display each photo {DISPLAY_PHOTO_INTERVAL}s", 'info')
+
+    # (Re)start : the panel most likely still shows the current photo, no need to refresh it
+    if (current_photo := get_current_photo()) and request_display(current_photo).result():
+        schedule_rotation()
+    else:
+        schedule_rotation(0)
+
+    threading.Thread(target=watch_mailbox, name='mail watcher', daemon=True).start()
+
+    # Mail checks, photo rotation and buttons : one at a time, in order, in this thread
+    run()
+
+
+def watch_mailbox():
+    """
+    Mail watcher thread : check mail now, then again after next_check_interval() seconds (often right after
+    a photo arrived, less and less often while the mailbox is quiet), or as soon as the IMAP server tells us
+    about new mail. The check runs in this thread, the mailbox is left alone until it's done.
+    """
+    while True:
+        try:
+            new_photos = check_new_mail()
+        except Exception as e:
+            debug_log(f"❌ Error checking new mail : {e!r}", 'critical')
+            new_photos = []
+        interval = next_check_interval(len(new_photos))
+        debug_log(f"Waiting for new mail for {interval} seconds", 'info')
+        try:
+            wait_for_new_mail(interval)
+        except Exception as e:
+            debug_log(f"❌ Error waiting for new mail : {e!r}", 'critical')
+            show_error_code(ERROR_MAILBOX)
+            time.sleep(interval)
+
+
+def check_new_mail():
+    """
+    In the mail watcher thread : download new photos, display the newest one, and tell senders.
+    Downloads, photo processing and emails run here and in the workers : only adding the photos and
+    displaying the newest one run in the event loop, a few milliseconds, buttons and rotation don't wait.
+
+    :return: list of (sender_email, image_name)
+    """
+    start_blinking_led()
+    try:
+        # new_photos is a list of tuples (sender_email, image_name)
+        if new_photos := post(add_new_photos, process_new_mail()).result():
+            for sender_email, image_name in new_photos:
+                debug_log(f"Sender : {sender_email} -- Image : {image_name}", 'info')
+
+            prepare_frames(image_name for _, image_name in new_photos)
+            post(display_new_photo, new_photos[-1][1])
+
+            # Tell each sender and tell recipient, once per sender
+            for sender_email in dict.fromkeys(sender_email for sender_email, _ in new_photos):
+                tell_sender(sender_email)
+                tell_owner(sender_email)
+        return new_photos
+    finally:
         stop_blinking_led()
-        time.sleep(CHECK_INTERVAL)
 
-        # Disclaimer (and room for improvement): pressing a button during the sleep time will not interrupt the sleep.
-        # This might lead to conflict, ie pressing a button to display next image while app is downloading a new image to display
-        # ¯\_(ツ)_/¯
+
+def display_new_photo(image_name):
+    # Display newest image on Pimoroni, for a whole DISPLAY_PHOTO_INTERVAL
+    request_display(image_name)
+    schedule_rotation()
 
 
 if __name__ == "__main__":
@@ -68,6 +96,8 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         debug_log("Ctrl^C -> Exiting application.", "critical")
         stop_blinking_led()
+        close_mailbox()
+        stop_workers(kill=True)
         exit_program(0)
     except Exception as e:
         debug_log(f"An error occurred trying to run_app(): {e}", "critical")
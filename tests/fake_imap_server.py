@@ -0,0 +1,340 @@
+"""
+Local stand-in IMAP server, for tests only.
+
+Speaks just enough IMAP4rev1 (plain text, no SSL) for the app : LOGIN, SELECT, SEARCH,
+FETCH, STORE, EXPUNGE, NOOP, IDLE, LOGOUT. Messages are kept in memory.
+
+    server = FakeImapServer()
+    server.start()
+    server.deliver(raw_email_bytes)   # idling clients are notified right away
+    ...
+    server.stop()
+"""
+import email
+import email.utils
+import re
+import socket
+import socketserver
+import threading
+import time
+
+
+class FakeImapServer:
+
+    def __init__(self, idle=True, latency=0):
+        self.idle = idle          # advertise IDLE capability
+        self.latency = latency    # seconds to wait before answering each command, to simulate a slow network
+        self.messages = []        # list of {'uid': int, 'data': bytes, 'flags': set}
+        self.next_uid = 1
+        self.connections = 0      # number of successful logins, to check reconnections
+        self.commands = []        # every command received, eg to count round trips
+        self.unsolicited = []     # untagged responses sent before each FETCH answer, as if another client was at work
+        self.lock = threading.Lock()
+        self.idlers = set()       # handlers currently in IDLE
+        self.handlers = set()
+
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                server.handlers.add(self)
+                try:
+                    _Session(server, self).run()
+                except (ConnectionError, OSError):
+                    pass
+                finally:
+                    server.handlers.discard(self)
+                    server.idlers.discard(self)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self.tcp_server = socketserver.ThreadingTCPServer(('127.0.0.1', 0), Handler)
+        self.tcp_server.daemon_threads = True
+        self.port = self.tcp_server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self.tcp_server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.drop_connections()
+        self.tcp_server.shutdown()
+        self.tcp_server.server_close()
+
+    def drop_connections(self):
+        """Simulate a network failure : close all client connections"""
+        for handler in list(self.handlers):
+            try:
+                handler.request.shutdown(2)
+            except OSError:
+                pass
+
+    def deliver(self, data):
+        """Add a message to INBOX and notify idling clients"""
+        with self.lock:
+            self.messages.append({'uid': self.next_uid, 'data': data, 'flags': set()})
+            self.next_uid += 1
+            count = len(self.messages)
+            for handler in list(self.idlers):
+                try:
+                    handler.wfile.write(f"* {count} EXISTS\r\n".encode())
+                    handler.session.exists = count
+                except OSError:
+                    pass
+        return self.next_uid - 1
+
+
+class _Session:
+
+    def __init__(self, server, handler):
+        self.server = server
+        self.handler = handler
+        handler.session = self
+        self.exists = 0           # message count last reported to the client
+
+    def send(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        with self.server.lock:
+            self.handler.wfile.write(data)
+
+    def capabilities(self):
+        return "IMAP4rev1 IDLE UIDPLUS" if self.server.idle else "IMAP4rev1 UIDPLUS"
+
+    def run(self):
+        self.send(f"* OK [CAPABILITY {self.capabilities()}] Fake IMAP server ready\r\n")
+        while line := self.handler.rfile.readline():
+            tag, _, rest = line.decode().rstrip('\r\n').partition(' ')
+            command, _, args = rest.partition(' ')
+            command = command.upper()
+            self.server.commands.append(rest)
+            if self.server.latency:
+                time.sleep(self.server.latency)
+            if command == 'UID':
+                command, _, args = args.partition(' ')
+                command = 'UID ' + command.upper()
+            method = getattr(self, 'do_' + command.replace(' ', '_').lower(), None)
+            if method is None:
+                self.send(f"{tag} BAD unknown command\r\n")
+                continue
+            if method(tag, args) == 'bye':
+                return
+
+    def do_capability(self, tag, args):
+        self.send(f"* CAPABILITY {self.capabilities()}\r\n{tag} OK completed\r\n")
+
+    def do_login(self, tag, args):
+        self.server.connections += 1
+        self.send(f"{tag} OK logged in\r\n")
+
+    def do_select(self, tag, args):
+        self.exists = len(self.server.messages)
+        self.send(f"* {self.exists} EXISTS\r\n"
+                  f"* OK [UIDVALIDITY 1]\r\n"
+                  f"* OK [UIDNEXT {self.server.next_uid}]\r\n"
+                  f"{tag} OK [READ-WRITE] SELECT completed\r\n")
+
+    def do_noop(self, tag, args):
+        if len(self.server.messages) > self.exists:
+            self.exists = len(self.server.messages)
+            self.send(f"* {self.exists} EXISTS\r\n")
+        self.send(f"{tag} OK completed\r\n")
+
+    def do_logout(self, tag, args):
+        self.send(f"* BYE\r\n{tag} OK completed\r\n")
+        return 'bye'
+
+    def do_close(self, tag, args):
+        self.send(f"{tag} OK completed\r\n")
+
+    def do_idle(self, tag, args):
+        if not self.server.idle:
+            self.send(f"{tag} BAD IDLE not supported\r\n")
+            return
+        with self.server.lock:
+            # mail that arrived before IDLE : announced in the same packet as the continuation, like most servers
+            pending = len(self.server.messages) > self.exists
+            self.exists = len(self.server.messages)
+            self.handler.wfile.write(b"+ idling\r\n" + (f"* {self.exists} EXISTS\r\n".encode() if pending else b""))
+            self.server.idlers.add(self.handler)
+        line = self.handler.rfile.readline()
+        self.server.idlers.discard(self.handler)
+        if not line:
+            return 'bye'
+        self.send(f"{tag} OK IDLE terminated\r\n")
+
+    def do_search(self, tag, args, by_uid=False):
+        criteria = args.upper().split()
+        found = range(1, len(self.server.messages) + 1)
+        if 'UNSEEN' in criteria:
+            found = [seq for seq in found if '\\Seen' not in self.server.messages[seq - 1]['flags']]
+        if 'UID' in criteria:
+            uids = self.uid_sequence_numbers(criteria[criteria.index('UID') + 1])
+            found = [seq for seq in found if seq in uids]
+        if by_uid:
+            found = [self.server.messages[seq - 1]['uid'] for seq in found]
+        self.send(f"* SEARCH {' '.join(map(str, found))}\r\n{tag} OK completed\r\n")
+
+    def do_uid_search(self, tag, args):
+        self.do_search(tag, args, by_uid=True)
+
+    def do_fetch(self, tag, args, by_uid=False):
+        sequence_set, _, items = args.partition(' ')
+        sequence_numbers = self.uid_sequence_numbers(sequence_set) if by_uid else self.sequence_numbers(sequence_set)
+        for response in self.server.unsolicited:
+            self.send(response + b"\r\n")
+        for seq in sequence_numbers:
+            message = self.server.messages[seq - 1]
+            answer = [f"UID {message['uid']}".encode()] if by_uid and 'UID' not in items.upper().split() else []
+            for item in re.findall(r'[A-Z0-9.]+(?:\[[^\]]*\](?:<[0-9.]+>)?)?', items.upper()):
+                answer.append(self.fetch_item(message, item))
+                if item.startswith(('RFC822', 'BODY[')) and item != 'RFC822.SIZE':
+                    message['flags'].add('\\Seen')
+            self.send(f"* {seq} FETCH (".encode() + b' '.join(answer) + b")\r\n")
+        self.send(f"{tag} OK FETCH completed\r\n")
+
+    def do_uid_fetch(self, tag, args):
+        self.do_fetch(tag, args, by_uid=True)
+
+    def fetch_item(self, message, item):
+        if item in ('RFC822', 'BODY[]', 'BODY.PEEK[]'):
+            return f"{item.replace('.PEEK', '')} {{{len(message['data'])}}}\r\n".encode() + message['data']
+        if item == 'FLAGS':
+            return f"FLAGS ({' '.join(message['flags'])})".encode()
+        if item == 'UID':
+            return f"UID {message['uid']}".encode()
+        if item == 'RFC822.SIZE':
+            return f"RFC822.SIZE {len(message['data'])}".encode()
+        parsed = message.setdefault('parsed', email.message_from_bytes(message['data']))
+        if item == 'ENVELOPE':
+            return f"ENVELOPE {envelope(parsed)}".encode()
+        if item == 'BODYSTRUCTURE':
+            return f"BODYSTRUCTURE {bodystructure(parsed)}".encode()
+        if match := re.fullmatch(r'BODY(?:\.PEEK)?\[([0-9.]+)\](?:<(\d+)\.(\d+)>)?', item):
+            section, offset, length = match.groups()
+            part = find_section(parsed, section)
+            payload = raw_payload(part) if part is not None else b''
+            if offset is None:
+                return f"BODY[{section}] {{{len(payload)}}}\r\n".encode() + payload
+            payload = payload[int(offset):int(offset) + int(length)]
+            return f"BODY[{section}]<{offset}> {{{len(payload)}}}\r\n".encode() + payload
+        return b'NIL'
+
+    def do_store(self, tag, args, by_uid=False):
+        sequence_set, _, flags = args.partition(' ')
+        sequence_numbers = self.uid_sequence_numbers(sequence_set) if by_uid else self.sequence_numbers(sequence_set)
+        for response in self.server.unsolicited:
+            self.send(response + b"\r\n")
+        for seq in sequence_numbers:
+            message = self.server.messages[seq - 1]
+            if '\\Deleted' in flags:
+                message['flags'].add('\\Deleted')
+            if '.SILENT' not in flags.upper():
+                self.send(f"* {seq} FETCH (FLAGS ({' '.join(message['flags'])}))\r\n")
+        self.send(f"{tag} OK STORE completed\r\n")
+
+    def do_uid_store(self, tag, args):
+        self.do_store(tag, args, by_uid=True)
+
+    def do_uid_expunge(self, tag, args):
+        self.do_expunge(tag, args, by_uid=True)
+
+    def do_expunge(self, tag, args, by_uid=False):
+        only = self.uid_sequence_numbers(args) if by_uid else None
+        with self.server.lock:
+            for seq in range(len(self.server.messages), 0, -1):
+                if '\\Deleted' in self.server.messages[seq - 1]['flags'] and (only is None or seq in only):
+                    del self.server.messages[seq - 1]
+                    self.exists -= 1
+                    self.handler.wfile.write(f"* {seq} EXPUNGE\r\n".encode())
+        self.send(f"{tag} OK EXPUNGE completed\r\n")
+
+    def uid_sequence_numbers(self, uid_set):
+        """Sequence numbers of the messages in a UID set"""
+        uids = set()
+        last = self.server.messages[-1]['uid'] if self.server.messages else 0
+        for part in uid_set.split(','):
+            start, _, end = part.partition(':')
+            start = last if start == '*' else int(start)
+            end = start if not end else (last if end == '*' else int(end))
+            uids.update(range(min(start, end), max(start, end) + 1))
+        return [seq for seq, message in enumerate(self.server.messages, start=1) if message['uid'] in uids]
+
+    def sequence_numbers(self, sequence_set):
+        numbers = []
+        last = len(self.server.messages)
+        for part in sequence_set.split(','):
+            start, _, end = part.partition(':')
+            start = last if start == '*' else int(start)
+            end = start if not end else (last if end == '*' else int(end))
+            numbers += range(min(start, end), max(start, end) + 1)
+        return [n for n in numbers if 1 <= n <= last]
+
+
+def quote(value):
+    if value is None:
+        return 'NIL'
+    value = str(value).replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{value}"'
+
+
+def envelope(msg):
+    """ENVELOPE structure (RFC 3501) of a message"""
+    def addresses(header):
+        found = email.utils.getaddresses(msg.get_all(header, []))
+        if not found:
+            return 'NIL'
+        items = []
+        for name, address in found:
+            mailbox, _, host = address.partition('@')
+            items.append(f"({quote(name or None)} NIL {quote(mailbox)} {quote(host)})")
+        return '(' + ''.join(items) + ')'
+
+    return (f"({quote(msg.get('Date'))} {quote(msg.get('Subject'))} {addresses('From')} {addresses('From')} "
+            f"{addresses('From')} {addresses('To')} NIL NIL NIL {quote(msg.get('Message-ID'))})")
+
+
+def bodystructure(msg):
+    """BODYSTRUCTURE (RFC 3501) of a message or body part"""
+    if msg.get_content_maintype() == 'multipart':
+        return '(' + ''.join(bodystructure(part) for part in msg.get_payload()) + f' {quote(msg.get_content_subtype())})'
+
+    params = [(key, email.utils.collapse_rfc2231_value(value)) for key, value in msg.get_params()[1:]]
+    params = '(' + ' '.join(f"{quote(key)} {quote(value)}" for key, value in params) + ')' if params else 'NIL'
+    payload = raw_payload(msg)
+    lines = payload.count(b'\n')
+    fields = (f"{quote(msg.get_content_maintype())} {quote(msg.get_content_subtype())} {params} NIL NIL "
+              f"{quote(msg.get('Content-Transfer-Encoding', '7bit'))} {len(payload)}")
+    if msg.get_content_maintype() == 'text':
+        fields += f" {lines}"
+    if msg.get_content_type() == 'message/rfc822':
+        inner = msg.get_payload()[0]
+        fields += f" {envelope(inner)} {bodystructure(inner)} {lines}"
+
+    if disposition := msg.get_content_disposition():
+        filename = msg.get_filename()
+        disposition_params = f'("filename" {quote(filename)})' if filename else 'NIL'
+        fields += f" NIL ({quote(disposition.upper())} {disposition_params})"
+    return f"({fields})"
+
+
+def find_section(msg, section):
+    """Body part of a message, from its section number (eg "2.1")"""
+    part = msg
+    for number in map(int, section.split('.')):
+        if part.get_content_type() == 'message/rfc822':
+            part = part.get_payload()[0]
+        if part.is_multipart():
+            if number > len(part.get_payload()):
+                return None
+            part = part.get_payload()[number - 1]
+        elif number != 1:
+            return None
+    return part
+
+
+def raw_payload(part):
+    """Body of a part, still transfer-encoded, as sent over the wire"""
+    if part.get_content_type() == 'message/rfc822':
+        return part.get_payload()[0].as_bytes()
+    return part.get_payload().encode('utf-8', errors='surrogateescape')
@@ -0,0 +1,74 @@
+"""
+Benchmark : decode a big base64 attachment to disk, all at once (old way) vs chunk by chunk (spool_attachment()).
+Reports time and peak memory (tracemalloc) for a 50 MB attachment.
+"""
+import base64
+import hashlib
+import os
+import time
+import tracemalloc
+
+from utils.attachments import spool_attachment
+from utils.check_new import FETCH_CHUNK_SIZE
+from utils.constants import TMP_DOWNLOAD_FOLDER
+
+SIZE_MB = 50
+encoded_path = os.path.join(TMP_DOWNLOAD_FOLDER, 'benchmark_attachment.b64')
+decoded_path = os.path.join(TMP_DOWNLOAD_FOLDER, 'benchmark_attachment.bin')
+
+print(f"Creating a {SIZE_MB} MB base64 encoded attachment...")
+original_hash = hashlib.sha256()
+with open(encoded_path, 'wb') as f:
+    for _ in range(SIZE_MB):
+        block = os.urandom(1024 * 1024 - 1024 * 1024 % 57)
+        original_hash.update(block)
+        # MIME style : lines of 76 chars
+        f.write(base64.encodebytes(block))
+
+
+def read_chunks(path):
+    with open(path, 'rb') as f:
+        while chunk := f.read(FETCH_CHUNK_SIZE):
+            yield chunk
+
+
+def decode_all_at_once():
+    with open(encoded_path, 'rb') as f:
+        payload = f.read()
+    with open(decoded_path, 'wb') as f:
+        f.write(base64.b64decode(payload))
+    return open(decoded_path, 'rb')
+
+
+def decode_streaming():
+    return spool_attachment(read_chunks(encoded_path), 'base64', (SIZE_MB + 1) * 1024 * 1024)
+
+
+def file_hash(f):
+    digest = hashlib.sha256()
+    while chunk := f.read(FETCH_CHUNK_SIZE):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+for name, decode in (('chunk by chunk', decode_streaming), ('all at once', decode_all_at_once)):
+    tracemalloc.start()
+    start = time.perf_counter()
+    decoded = decode()
+    duration = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    with decoded:
+        ok = file_hash(decoded) == original_hash.hexdigest()
+    print(f"{name:>15} : {duration:.2f}s, peak memory {peak / 1024 / 1024:.1f} MB, output {'OK' if ok else 'CORRUPTED'}")
+
+print("Size cap : decoding with a 10 MB limit...")
+files_before = set(os.listdir(TMP_DOWNLOAD_FOLDER))
+print(f"Result : {spool_attachment(read_chunks(encoded_path), 'base64', 10 * 1024 * 1024)} "
+      f"(should be False), temp file removed : {set(os.listdir(TMP_DOWNLOAD_FOLDER)) == files_before}")
+
+for path in (encoded_path, decoded_path):
+    if os.path.exists(path):
+        os.remove(path)
+
+print("End")
@@ -0,0 +1,69 @@
+"""
+Benchmark : colour correction of an 800x480 frame (saturation, contrast, gamma, panel gamut),
+computed pixel by pixel with NumPy vs with the precomputed 3D lookup table (see utils/colour_lut.py).
+
+    python -um tests.test_colour_lut [photo.jpg]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+import utils.colour_lut as colour_lut
+from utils.constants import COLOUR_SATURATION, COLOUR_CONTRAST, COLOUR_GAMMA
+
+ROUNDS = 10
+
+# Inky Impression Spectra 6 colours, saturation 0.5
+PANEL = {'model': 'InkyE673', 'resolution': [800, 480],
+         'palette': [0, 0, 0, 208, 209, 210, 231, 222, 35, 205, 36, 37, 30, 29, 174, 29, 173, 35]}
+
+
+def correct_per_pixel(image, black, white):
+    # same maths as build_lut(), on every pixel instead of the 33x33x33 points of the table
+    rgb = np.asarray(image, dtype=np.float32) / 255
+    rgb = np.clip((rgb - 0.5) * COLOUR_CONTRAST + 0.5, 0, 1) ** (1 / COLOUR_GAMMA)
+    luma = (rgb @ colour_lut.LUMA_WEIGHTS)[..., np.newaxis]
+    rgb = np.clip(luma + (rgb - luma) * COLOUR_SATURATION, 0, 1)
+    rgb = np.array(black) / 255 + (np.array(white) - np.array(black)) / 255 * rgb
+    return Image.fromarray((rgb * 255 + 0.5).astype(np.uint8))
+
+
+def timed(function, rounds=ROUNDS):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = function()
+    return result, (time.perf_counter() - start) / rounds
+
+
+photo = sys.argv[1] if len(sys.argv) > 1 else 'assets/samples/sample_photo.jpg'
+image = Image.open(photo).convert('RGB').resize((800, 480))
+print(f"Saturation {COLOUR_SATURATION}, contrast {COLOUR_CONTRAST}, gamma {COLOUR_GAMMA}")
+
+with tempfile.TemporaryDirectory() as frames_folder:
+    colour_lut.FRAME_CACHE_FOLDER = frames_folder
+
+    _, duration = timed(lambda: colour_lut.get_colour_lut(PANEL), rounds=1)
+    print(f"Lookup table built and saved : {duration * 1000:.0f} ms, {os.listdir(frames_folder)}")
+    colour_lut.luts.clear()
+    _, duration = timed(lambda: colour_lut.get_colour_lut(PANEL), rounds=1)
+    print(f"Lookup table loaded from disk : {duration * 1000:.0f} ms")
+
+    with_lut, duration = timed(lambda: colour_lut.apply_colour_lut(image, PANEL))
+    print(f"Lookup table : {duration * 1000:.1f} ms per frame")
+
+    black, white = (0, 0, 0), (208, 209, 210)
+    per_pixel, duration = timed(lambda: correct_per_pixel(image, black, white))
+    print(f"Pixel by pixel (NumPy) : {duration * 1000:.1f} ms per frame")
+
+    difference = np.abs(np.asarray(with_lut, dtype=np.int16) - np.asarray(per_pixel, dtype=np.int16))
+    print(f"Difference between both : mean {difference.mean():.2f}, max {difference.max()} (0 - 255)")
+
+    identity = colour_lut.build_lut((0, 0, 0), (255, 255, 255))
+    unchanged = image.filter(colour_lut.ImageFilter.Color3DLUT(colour_lut.LUT_SIZE, identity.ravel()))
+    print(f"Neutral settings leave the photo unchanged : {np.abs(np.asarray(unchanged, dtype=np.int16) - np.asarray(image)).max() <= 1}")
+
+print("End")
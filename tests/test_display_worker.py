@@ -0,0 +1,91 @@
+"""
+Check the display worker (utils/display_worker.py) with a stand-in driver whose refresh takes REFRESH_TIME :
+callers don't wait, requests made during a refresh collapse to the latest one, debug and shutdown screens
+go first, nothing is displayed after the shutdown screen.
+
+    python -um tests.test_display_worker
+"""
+import os
+import tempfile
+import time
+
+from PIL import Image
+
+import utils.eink as eink
+import utils.state_store as state_store
+from utils.display_worker import request_display, PRIORITY_DEBUG, PRIORITY_SHUTDOWN
+
+# A full refresh of an Inky Impression takes ~30 s, shortened here
+REFRESH_TIME = 0.5
+
+
+class StandInInky:
+    """ Just enough of an Inky driver for send_to_eink() : remembers what was displayed """
+    resolution = (800, 480)
+    displayed = []
+
+    def set_image(self, image):
+        self.image = image
+
+    def show(self):
+        time.sleep(REFRESH_TIME)
+        StandInInky.displayed.append(self.image.filename)
+
+
+def screen(name):
+    return os.path.basename(name)
+
+
+def request(name, **kwargs):
+    start = time.perf_counter()
+    job = request_display(name, is_debug=True, **kwargs)
+    waited.append(time.perf_counter() - start)
+    return job
+
+
+def check(step, expected):
+    displayed = [screen(name) for name in StandInInky.displayed]
+    StandInInky.displayed.clear()
+    print(f"  {step:<48} : {' '.join(displayed) or '-':<30} {'ok' if displayed == expected else 'WRONG'}")
+
+
+waited = []
+
+with tempfile.TemporaryDirectory() as folder:
+    eink.TMP_DOWNLOAD_FOLDER = folder
+    state_store.STATE_FILE = os.path.join(folder, 'state.json')
+    eink.auto = StandInInky
+    for number, colour in enumerate(['white', 'black', 'red', 'green', 'blue', 'yellow', 'orange']):
+        Image.new('RGB', StandInInky.resolution, colour).save(os.path.join(folder, f"{number}.png"))
+
+    print(f"Stand-in refresh : {REFRESH_TIME * 1000:.0f} ms")
+
+    # "next" pressed 3 times while a refresh is running
+    first = request('0.png')
+    time.sleep(0.1)
+    jobs = [request(name) for name in ('1.png', '2.png', '3.png')]
+    results = [job.result() for job in [first] + jobs]
+    check("3 requests during a refresh", ['0.png', '3.png'])
+    print(f"  {'every request answered':<48} : {results}")
+
+    # photo and debug screen waiting : debug screen first
+    request('4.png')
+    time.sleep(0.1)
+    last = request('5.png')
+    request('6.png', priority=PRIORITY_DEBUG)
+    last.result()
+    check("photo and debug screen waiting", ['4.png', '6.png', '5.png'])
+
+    # shutdown : photos waiting are dropped, and nothing after it
+    request('1.png')
+    time.sleep(0.1)
+    dropped = request('2.png')
+    done = request('3.png', priority=PRIORITY_SHUTDOWN)
+    after = request('4.png')
+    done.result()
+    check("shutdown screen requested", ['1.png', '3.png'])
+    print(f"  {'dropped requests answered':<48} : {dropped.result()} {after.result()}")
+
+    print(f"  longest wait of a caller : {max(waited) * 1000:.1f} ms")
+
+print("End")
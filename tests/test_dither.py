@@ -0,0 +1,51 @@
+"""
+Benchmark : convert an 800x480 photo to the eink panel colours with each dither mode (see utils/dither.py).
+Reports time per frame and error (RMSE between original and frame, both slightly blurred : lower looks closer).
+Run it on the Pi itself to choose INKY_DITHER.
+
+    python -um tests.test_dither [photo.jpg]
+"""
+import sys
+import time
+
+from PIL import Image
+
+from utils.constants import INKY_SATURATION
+from utils.dither import DITHER_MODES, dither_image, dither_error
+
+ROUNDS = 5
+
+# Saturated and desaturated palettes of Inky panels, blended like Inky's _palette_blend()
+PANELS = {
+    'Impression 7 colours (UC8159, AC073TC1A)': (
+        [[57, 48, 57], [255, 255, 255], [58, 91, 70], [61, 59, 94], [156, 72, 75], [208, 190, 71], [177, 106, 73]],
+        [[0, 0, 0], [255, 255, 255], [0, 255, 0], [0, 0, 255], [255, 0, 0], [255, 255, 0], [255, 140, 0]],
+    ),
+    'Impression Spectra 6 colours (E673)': (
+        [[0, 0, 0], [161, 164, 165], [208, 190, 71], [156, 72, 75], [61, 59, 94], [58, 91, 70]],
+        [[0, 0, 0], [255, 255, 255], [255, 255, 0], [255, 0, 0], [0, 0, 255], [0, 255, 0]],
+    ),
+}
+
+
+def blend(saturated_palette, desaturated_palette, saturation):
+    palette = []
+    for saturated, desaturated in zip(saturated_palette, desaturated_palette):
+        palette += [int(s * saturation + d * (1.0 - saturation)) for s, d in zip(saturated, desaturated)]
+    return palette
+
+
+photo = sys.argv[1] if len(sys.argv) > 1 else 'assets/samples/sample_photo.jpg'
+image = Image.open(photo).convert('RGB').resize((800, 480))
+
+for name, palettes in PANELS.items():
+    palette = blend(*palettes, INKY_SATURATION)
+    print(f"{name}, saturation {INKY_SATURATION}")
+    for mode in DITHER_MODES:
+        start = time.perf_counter()
+        for _ in range(ROUNDS):
+            frame = dither_image(image, palette, mode)
+        duration = (time.perf_counter() - start) / ROUNDS
+        print(f"  {mode:>15} : {duration * 1000:4.0f} ms per frame, error {dither_error(image, frame):5.1f}")
+
+print("End")
@@ -0,0 +1,108 @@
+"""
+Benchmark : time from a display request (button press, hourly rotation) to the start of the screen refresh,
+with the photo converted to the panel palette on the fly (old way) vs from the frame cache.
+Uses a stand-in panel that behaves like an Inky Impression 7.3" (800x480, 6 colours), without refreshing anything.
+Photos and frames are written to temporary folders.
+
+    python -um tests.test_frame_cache
+"""
+import os
+import shutil
+import tempfile
+import time
+
+import numpy
+from PIL import Image
+
+import utils.colour_lut as colour_lut
+import utils.eink as eink
+import utils.frame_cache as frame_cache
+import utils.image_manipulation as image_manipulation
+import utils.ingest as ingest
+import utils.photo_index as photo_index
+import utils.photo_library as photo_library
+import utils.state_store as state_store
+from utils.colour_lut import apply_colour_lut
+from utils.ingest import submit_new_image, wait_new_image, add_new_photos, prepare_frames
+
+ROUNDS = 5
+
+
+class StandInPanel:
+    """ Same palette, resolution and set_image() as inky.inky_e673.InkyE673 """
+    SATURATED_PALETTE = [[0, 0, 0], [161, 164, 165], [208, 190, 71], [156, 72, 75], [61, 59, 94], [58, 91, 70]]
+    DESATURATED_PALETTE = [[0, 0, 0], [255, 255, 255], [255, 255, 0], [255, 0, 0], [0, 0, 255], [0, 255, 0]]
+
+    resolution = width, height = (800, 480)
+    refresh_requested_at = None
+
+    def _palette_blend(self, saturation):
+        palette = []
+        for saturated, desaturated in zip(self.SATURATED_PALETTE, self.DESATURATED_PALETTE):
+            palette += [int(s * saturation + d * (1.0 - saturation)) for s, d in zip(saturated, desaturated)]
+        return palette
+
+    def set_image(self, image, saturation=0.5):
+        if not image.mode == "P":
+            palette_image = Image.new("P", (1, 1))
+            palette_image.putpalette(self._palette_blend(saturation) + [0, 0, 0] * 248)
+            image.load()
+            image = image.im.convert("P", True, palette_image.im)
+        self.buf = numpy.array(image, dtype=numpy.uint8).reshape((self.height, self.width))
+
+    def show(self):
+        StandInPanel.refresh_requested_at = time.perf_counter()
+
+
+def time_to_refresh(image_name):
+    start = time.perf_counter()
+    # forced : displaying the same photo again would be skipped otherwise
+    eink.send_to_eink(image_name, force=True)
+    return StandInPanel.refresh_requested_at - start
+
+
+with tempfile.TemporaryDirectory() as output_folder, tempfile.TemporaryDirectory() as frames_folder:
+    eink.OUTPUT_FOLDER = frame_cache.OUTPUT_FOLDER = output_folder
+    image_manipulation.OUTPUT_FOLDER = ingest.OUTPUT_FOLDER = photo_index.OUTPUT_FOLDER = output_folder
+    photo_index.PHOTO_INDEX = os.path.join(output_folder, 'photo_index.json')
+    frame_cache.FRAME_CACHE_FOLDER = colour_lut.FRAME_CACHE_FOLDER = frames_folder
+    frame_cache.PANEL_FILE = os.path.join(frames_folder, 'panel.json')
+    photo_library.OUTPUT_FOLDER = output_folder
+    photo_library.PHOTO_LIBRARY = os.path.join(frames_folder, 'photo_library.db')
+    state_store.STATE_FILE = os.path.join(frames_folder, 'state.json')
+    eink.auto = StandInPanel
+
+    image_name = 'sample_photo.jpg'
+    shutil.copy('assets/samples/sample_photo.jpg', output_folder)
+    # a different photo, or it would be spotted as a duplicate of the first one
+    new_photo = os.path.join(output_folder, 'new_photo.png')
+    Image.open('assets/samples/sample_photo.jpg').transpose(Image.Transpose.FLIP_LEFT_RIGHT).save(new_photo)
+
+    remember_panel = frame_cache.remember_panel
+    frame_cache_off = lambda inky: None
+    eink.remember_panel = frame_cache_off
+    duration = sum(time_to_refresh(image_name) for _ in range(ROUNDS)) / ROUNDS
+    print(f"Converted on display : {duration * 1000:.0f} ms to refresh start")
+
+    eink.remember_panel = remember_panel
+    print(f"First display, frame rendered and cached : {time_to_refresh(image_name) * 1000:.0f} ms to refresh start")
+    duration = sum(time_to_refresh(image_name) for _ in range(ROUNDS)) / ROUNDS
+    print(f"Cached frame : {duration * 1000:.0f} ms to refresh start")
+
+    # as the app does it, see app.py check_new_mail()
+    with open(new_photo, 'rb') as attachment:
+        job = submit_new_image('new_photo.png', attachment)
+    [(_, new_image)] = add_new_photos([(None, 'new_photo.png', wait_new_image('new_photo.png', job))])
+    prepare_frames([new_image])
+    print(f"New photo, frame prepared at ingest : {time_to_refresh(new_image) * 1000:.0f} ms to refresh start")
+
+    same = StandInPanel()
+    resized = Image.open(os.path.join(output_folder, image_name)).resize(StandInPanel.resolution)
+    same.set_image(apply_colour_lut(resized, frame_cache.load_panel()))
+    cached = StandInPanel()
+    cached.set_image(frame_cache.get_frame(image_name, frame_cache.load_panel()))
+    print(f"Cached frame identical to Inky's own conversion (after colour correction) : "
+          f"{numpy.array_equal(same.buf, cached.buf)}")
+    print(f"Frames in cache : {sorted(os.listdir(frames_folder))}")
+
+print("End")
@@ -0,0 +1,92 @@
+"""
+Benchmark of the whole display path (display worker, frame cache, panel) on the headless display
+(utils/headless_display.py) : runs anywhere, no Raspberry Pi or screen needed.
+Measures the end-to-end latency of a display request, the overhead on top of the panel refresh,
+and how a burst of requests is coalesced. Photos, frames and recorded frames go to temporary folders.
+
+    python -um tests.test_headless_display [refresh_time_in_seconds]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageOps
+
+import utils.colour_lut as colour_lut
+import utils.eink as eink
+import utils.frame_cache as frame_cache
+import utils.headless_display as headless_display
+import utils.photo_library as photo_library
+import utils.state_store as state_store
+from utils.display_worker import request_display
+from utils.eink import get_display
+
+# The real panel takes ~25 s, shortened here
+REFRESH_TIME = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+BURST = 20
+
+
+def display(image_name):
+    requested = time.monotonic()
+    job = request_display(image_name)
+    job.result()
+    start, end, _ = get_display().frames[-1]
+    return start - requested, time.monotonic() - requested
+
+
+with tempfile.TemporaryDirectory() as output_folder, tempfile.TemporaryDirectory() as frames_folder, \
+        tempfile.TemporaryDirectory() as recorded_folder:
+    eink.OUTPUT_FOLDER = frame_cache.OUTPUT_FOLDER = output_folder
+    frame_cache.FRAME_CACHE_FOLDER = colour_lut.FRAME_CACHE_FOLDER = frames_folder
+    frame_cache.PANEL_FILE = os.path.join(frames_folder, 'panel.json')
+    photo_library.OUTPUT_FOLDER = output_folder
+    photo_library.PHOTO_LIBRARY = os.path.join(frames_folder, 'photo_library.db')
+    state_store.STATE_FILE = os.path.join(frames_folder, 'state.json')
+    eink.DISPLAY_BACKEND = 'headless'
+    headless_display.HEADLESS_REFRESH_TIME = REFRESH_TIME
+    headless_display.HEADLESS_FRAMES_FOLDER = recorded_folder
+
+    sample = Image.open('assets/samples/sample_photo.jpg')
+    photos = []
+    for number, transpose in enumerate([None, Image.Transpose.FLIP_LEFT_RIGHT, Image.Transpose.FLIP_TOP_BOTTOM,
+                                        Image.Transpose.ROTATE_180]):
+        photo = sample.transpose(transpose) if transpose is not None else sample
+        photos.append(f"photo-{number}.jpg")
+        ImageOps.fit(photo, (800, 480)).save(os.path.join(output_folder, photos[-1]))
+
+    print(f"Headless display, {REFRESH_TIME * 1000:.0f} ms per refresh")
+
+    # first display : panel detected, colour table built, frame rendered
+    to_start, to_end = display(photos[0])
+    print(f"  first display        : refresh starts {to_start * 1000:.0f} ms after the request")
+
+    latencies = [display(photo) for photo in photos[1:]]
+    to_start = max(latency[0] for latency in latencies)
+    overhead = max(latency[1] for latency in latencies) - REFRESH_TIME
+    print(f"  next displays        : refresh starts {to_start * 1000:.0f} ms after the request, "
+          f"{overhead * 1000:.0f} ms on top of the refresh")
+
+    before = get_display().stats()
+    display(photos[-1])
+    print(f"  same photo again     : {get_display().stats()['refreshes'] - before['refreshes']} refresh")
+
+    # "next" pressed BURST times, as fast as possible
+    before = get_display().stats()
+    requested = time.monotonic()
+    jobs = [request_display(photos[number % len(photos)], force=True) for number in range(BURST)]
+    for job in jobs:
+        job.result()
+    duration = time.monotonic() - requested
+    refreshes = get_display().stats()['refreshes'] - before['refreshes']
+    dropped = get_display().stats()['frames_dropped'] - before['frames_dropped']
+    print(f"  burst of {BURST} requests : {refreshes} refreshes, last one displayed {duration * 1000:.0f} ms "
+          f"after the first request ({BURST * REFRESH_TIME * 1000:.0f} ms without coalescing), "
+          f"{dropped} dropped ({'ok' if refreshes + dropped == BURST else 'WRONG'})")
+
+    stats = get_display().stats()
+    print(f"  counters             : {stats['refreshes']} refreshes, busy {stats['busy_time']:.1f}s, "
+          f"{stats['frames_dropped']} frame(s) dropped")
+    print(f"  frames recorded      : {len(os.listdir(recorded_folder))} in {recorded_folder}")
+
+print("End")
@@ -0,0 +1,66 @@
+"""
+Benchmark : process phone photos with a full-size decode (old way) vs a reduced-resolution decode.
+Reports time per image and peak memory (RSS of a fresh process) for each photo.
+
+    python -um tests.test_image_decode [photo.jpg photo.heic ...]
+
+Without arguments, a 12 MP JPEG is generated from the sample photo. Real phone photos are better.
+"""
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageOps
+
+from utils.image_manipulation import fix_image_orientation, resize_and_crop_image
+
+ROUNDS = 5
+
+
+def process_full_decode(path):
+    image = ImageOps.exif_transpose(Image.open(path))
+    return resize_and_crop_image(image)
+
+
+def process_reduced_decode(path):
+    return resize_and_crop_image(fix_image_orientation(path))
+
+
+def measure(process, path, results):
+    # runs in a fresh process, so that peak RSS is about this photo only
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        process(path)
+    duration = (time.perf_counter() - start) / ROUNDS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    results.put((duration, peak))
+
+
+def run(process, path):
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(target=measure, args=(process, path, results))
+    child.start()
+    duration, peak = results.get()
+    child.join()
+    return duration, peak
+
+
+if __name__ == '__main__':
+    photos = sys.argv[1:]
+    if not photos:
+        sample = os.path.join(tempfile.gettempdir(), 'cadrephoto_12mp_sample.jpg')
+        Image.open('assets/samples/sample_photo.jpg').resize((4032, 3024)).save(sample, quality=90)
+        photos = [sample]
+
+    for path in photos:
+        with Image.open(path) as image:
+            print(f"{os.path.basename(path)} : {image.format} {image.size[0]}x{image.size[1]}")
+        for name, process in (('full decode', process_full_decode), ('reduced decode', process_reduced_decode)):
+            duration, peak = run(process, path)
+            print(f"  {name:>14} : {duration * 1000:.0f} ms per image, peak memory +{peak / 1024:.1f} MB")
+
+    print("End")
@@ -0,0 +1,104 @@
+"""
+Benchmark : process a batch of 12 MP photos with 1 to 4 worker processes (see utils/workers.py).
+Also measures how late a 10 ms timer in the main process gets while photos are processed
+(that's what button presses feel), and checks that a job taking too long is given up, without losing
+the other jobs.
+Photos are written to a temporary folder.
+
+    python -um tests.test_image_workers [number_of_photos]
+"""
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+import utils.image_manipulation as image_manipulation
+import utils.ingest as ingest
+import utils.photo_index as photo_index
+import utils.photo_library as photo_library
+import utils.workers as workers
+from utils.ingest import submit_new_image, wait_new_image, add_new_image
+
+NUMBER_OF_PHOTOS = int(sys.argv[1]) if len(sys.argv) > 1 else 12
+
+
+class MainLoopLatency(threading.Thread):
+    """ Worst delay of a 10 ms timer in the main process """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.worst = 0
+        self.running = True
+
+    def run(self):
+        while self.running:
+            start = time.perf_counter()
+            time.sleep(0.01)
+            self.worst = max(self.worst, time.perf_counter() - start - 0.01)
+
+
+def slow_job(duration):
+    time.sleep(duration)
+    return True
+
+
+def process_batch(photo):
+    latency = MainLoopLatency()
+    latency.start()
+    start = time.perf_counter()
+    jobs = [submit_new_image('IMG_0001.JPG', io.BytesIO(photo)) for _ in range(NUMBER_OF_PHOTOS)]
+    processed = [wait_new_image('IMG_0001.JPG', job) for job in jobs]
+    image_names = [add_new_image('IMG_0001.JPG', done) for done in processed if done]
+    duration = time.perf_counter() - start
+    latency.running = False
+    return len([name for name in image_names if name]), duration, latency.worst
+
+
+buffer = io.BytesIO()
+Image.open('assets/samples/sample_photo.jpg').resize((4032, 3024)).save(buffer, format='JPEG', quality=90)
+photo = buffer.getvalue()
+
+with tempfile.TemporaryDirectory() as output_folder:
+    image_manipulation.OUTPUT_FOLDER = ingest.OUTPUT_FOLDER = photo_index.OUTPUT_FOLDER = output_folder
+    photo_index.PHOTO_INDEX = os.path.join(output_folder, 'photo_index.json')
+    photo_library.OUTPUT_FOLDER = output_folder
+    photo_library.PHOTO_LIBRARY = os.path.join(output_folder, 'photo_library.db')
+    # the same photo is processed again and again : don't let duplicate detection skip it
+    ingest.find_duplicate = ingest.photo_by_sha256 = lambda fingerprint: None
+    ingest.dhashes = list
+
+    print(f"{NUMBER_OF_PHOTOS} photos, 4032x3024, {len(photo) // 1024} KB, {os.cpu_count()} CPU core(s)")
+    for number_of_workers in range(1, 5):
+        workers.stop_workers()
+        workers.IMAGE_WORKERS = number_of_workers
+        workers.get_executor()
+        processed, duration, worst_latency = process_batch(photo)
+        print(f"  {number_of_workers} worker(s) : {processed} photos in {duration:.1f}s, "
+              f"{processed / duration:.1f} photos/s, main loop late by {worst_latency * 1000:.0f} ms at worst")
+
+    # Timeouts count from the start of each job : jobs waiting for the only worker aren't given up
+    workers.stop_workers()
+    workers.IMAGE_WORKERS = 1
+    start = time.perf_counter()
+    jobs = [workers.submit(slow_job, 0.6) for _ in range(3)]
+    print(f"3 jobs of 0.6s, 1 worker, timeout of 1s : {'ok' if workers.result(jobs[-1], timeout=1) else 'WRONG'} "
+          f"(last one done after {time.perf_counter() - start:.1f}s)")
+
+    # A job taking too long : the workers are killed, the other job running is submitted again
+    workers.stop_workers()
+    workers.IMAGE_WORKERS = 2
+    job, other_job = workers.submit(slow_job, 5), workers.submit(slow_job, 2)
+    try:
+        workers.result(job, timeout=1)
+    except TimeoutError:
+        print("Job longer than its timeout : given up after 1s, workers restarted")
+    print(f"Other job killed with the workers, submitted again : {'ok' if workers.result(other_job) else 'WRONG'}")
+    job = submit_new_image('IMG_0001.JPG', io.BytesIO(photo))
+    print(f"Next job after restart : {add_new_image('IMG_0001.JPG', wait_new_image('IMG_0001.JPG', job))}")
+
+    workers.stop_workers()
+
+print("End")
@@ -0,0 +1,78 @@
+"""
+Test the persistent IMAP connection (IDLE push, NOOP fallback, reconnection)
+against a local stand-in IMAP server. No real mail account needed.
+"""
+import os
+import tempfile
+import threading
+import time
+from email.message import EmailMessage
+
+import utils.mailbox as mailbox
+import utils.state_store as state_store
+from tests.fake_imap_server import FakeImapServer
+from utils.check_new import check_mail_and_download_attachments
+
+
+def downloaded_attachments():
+    attachments = check_mail_and_download_attachments()
+    for _, _, attachment in attachments:
+        attachment.close()
+    return [(from_email, filename) for from_email, filename, _ in attachments]
+
+
+def photo_mail():
+    msg = EmailMessage()
+    msg['From'] = 'grandson@test-email.null'
+    msg['Subject'] = 'Test photo'
+    msg.set_content('Hello Grandma')
+    with open('assets/samples/sample_photo.jpg', 'rb') as f:
+        msg.add_attachment(f.read(), maintype='image', subtype='jpeg', filename='sample_photo.jpg')
+    return msg.as_bytes()
+
+
+def time_new_mail_notification(server, delay=2):
+    threading.Timer(delay, server.deliver, [photo_mail()]).start()
+    start = time.monotonic()
+    has_new_mail = mailbox.wait_for_new_mail(60)
+    return has_new_mail, time.monotonic() - start - delay
+
+
+server = FakeImapServer().start()
+mailbox.IMAP_SERVER, mailbox.IMAP_PORT, mailbox.IMAP_SSL = '127.0.0.1', server.port, False
+mailbox.IMAP_USER, mailbox.IMAP_PASSWORD, mailbox.IMAP_KEEPALIVE = 'test', 'test', True
+state_store.STATE_FILE = os.path.join(tempfile.gettempdir(), 'cadrephoto_test_state.json')
+if os.path.exists(state_store.STATE_FILE):
+    os.remove(state_store.STATE_FILE)
+
+print("IDLE : waiting for new mail...")
+has_new_mail, latency = time_new_mail_notification(server)
+print(f"New mail : {has_new_mail}, noticed {latency:.3f}s after delivery")
+print(f"Downloaded : {downloaded_attachments()}")
+print(f"Logins so far : {server.connections} (should be 1)")
+
+print("Mail arrives between two IDLE commands...")
+server.deliver(photo_mail())
+start = time.monotonic()
+has_new_mail = mailbox.wait_for_new_mail(10)
+print(f"New mail : {has_new_mail}, noticed {time.monotonic() - start:.3f}s after IDLE started")
+print(f"Downloaded : {downloaded_attachments()}")
+
+print("Server connection drops...")
+server.drop_connections()
+has_new_mail, latency = time_new_mail_notification(server)
+print(f"New mail : {has_new_mail}, noticed {latency:.3f}s after delivery")
+print(f"Downloaded : {downloaded_attachments()}")
+print(f"Logins so far : {server.connections} (should be 2)")
+
+print(f"NOOP polling (no IDLE support, poll every {mailbox.NOOP_POLL_INTERVAL}s)...")
+server.idle = False
+mailbox.close_mailbox()
+print(f"NOOP right after connecting, no new mail : {'ok' if not mailbox._noop(mailbox.get_mailbox()) else 'WRONG'}")
+has_new_mail, latency = time_new_mail_notification(server)
+print(f"New mail : {has_new_mail}, noticed {latency:.3f}s after delivery")
+print(f"Downloaded : {downloaded_attachments()}")
+
+mailbox.close_mailbox()
+server.stop()
+print("End")
@@ -0,0 +1,158 @@
+"""
+Benchmark : ingest a backlog of a few hundred mails with photos, from a local stand-in IMAP server.
+Compares "download everything, then process" with the pipelined ingest (processing overlaps downloads).
+Photos are written to a temporary folder, not to the real photos folder.
+
+    python -um tests.test_ingest_backlog [number_of_mails]
+"""
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from email.message import EmailMessage
+
+from PIL import Image
+
+import utils.image_manipulation as image_manipulation
+import utils.ingest as ingest
+import utils.mailbox as mailbox
+import utils.photo_index as photo_index
+import utils.photo_library as photo_library
+import utils.state_store as state_store
+from tests.fake_imap_server import FakeImapServer
+from utils.check_new import check_mail_and_download_attachments
+from utils.retention import apply_retention
+
+NUMBER_OF_MAILS = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+NETWORK_LATENCY = 0.01  # seconds per IMAP command
+
+
+def photo_mail(index, photo):
+    msg = EmailMessage()
+    msg['From'] = f'relative{index % 7}@test-email.null'
+    msg['Subject'] = f'Photo {index}'
+    msg.set_content('Hello Grandma')
+    msg.add_attachment(photo, maintype='image', subtype='jpeg', filename='IMG_0001.JPG')
+    return msg.as_bytes()
+
+
+def fill_mailbox(server, photo):
+    for index in range(NUMBER_OF_MAILS):
+        server.deliver(photo_mail(index, photo))
+
+
+def ingest_new_mail():
+    # as the app does it, see app.py check_new_mail()
+    new_photos = ingest.add_new_photos(ingest.process_new_mail())
+    ingest.prepare_frames(image_name for _, image_name in new_photos)
+    return new_photos
+
+
+def ingest_one_by_one(attachments):
+    # each photo processed to the end before the next one
+    new_photos = []
+    for sender_email, filename, attachment in attachments:
+        with attachment:
+            job = ingest.submit_new_image(filename, attachment)
+        if job and (processed := ingest.wait_new_image(filename, job)):
+            added = ingest.add_new_photos([(sender_email, filename, processed)])
+            ingest.prepare_frames(image_name for _, image_name in added)
+            new_photos += added
+    return new_photos
+
+
+# A phone-like photo : bigger than the screen
+buffer = io.BytesIO()
+Image.open('assets/samples/sample_photo.jpg').resize((2000, 1500)).save(buffer, format='JPEG', quality=90)
+photo = buffer.getvalue()
+
+server = FakeImapServer(latency=NETWORK_LATENCY).start()
+mailbox.IMAP_SERVER, mailbox.IMAP_PORT, mailbox.IMAP_SSL = '127.0.0.1', server.port, False
+mailbox.IMAP_USER, mailbox.IMAP_PASSWORD, mailbox.IMAP_KEEPALIVE = 'test', 'test', True
+state_store.STATE_FILE = os.path.join(tempfile.gettempdir(), 'cadrephoto_test_state.json')
+if os.path.exists(state_store.STATE_FILE):
+    os.remove(state_store.STATE_FILE)
+
+with tempfile.TemporaryDirectory() as output_folder:
+    image_manipulation.OUTPUT_FOLDER = ingest.OUTPUT_FOLDER = photo_index.OUTPUT_FOLDER = output_folder
+    photo_index.PHOTO_INDEX = os.path.join(output_folder, 'photo_index.json')
+    photo_library.OUTPUT_FOLDER = output_folder
+    photo_library.PHOTO_LIBRARY = os.path.join(output_folder, 'photo_library.db')
+    # every mail has the same photo : don't let duplicate detection skip the processing we measure
+    find_duplicate, photo_by_sha256, dhashes = ingest.find_duplicate, ingest.photo_by_sha256, ingest.dhashes
+    ingest.find_duplicate = ingest.photo_by_sha256 = lambda fingerprint: None
+    ingest.dhashes = list
+    # keep every photo : NUMBER_OF_PHOTOS_TO_KEEP of the .env would delete most of them right away
+    ingest.apply_retention = lambda: apply_retention(2 * NUMBER_OF_MAILS)
+
+    print(f"{NUMBER_OF_MAILS} mails, {len(photo) // 1024} KB photo each, {NETWORK_LATENCY * 1000:.0f} ms per IMAP command")
+
+    fill_mailbox(server, photo)
+    start = time.perf_counter()
+    attachments = check_mail_and_download_attachments()
+    downloaded = time.perf_counter()
+    new_photos = ingest_one_by_one(attachments)
+    duration = time.perf_counter() - start
+    print(f"Download, then process : {duration:.1f}s ({downloaded - start:.1f}s download), "
+          f"{len(new_photos)} photos, {NUMBER_OF_MAILS / duration:.1f} mails/s")
+
+    fill_mailbox(server, photo)
+    start = time.perf_counter()
+    first_command = len(server.commands)
+    new_photos = ingest_new_mail()
+    duration = time.perf_counter() - start
+    print(f"Pipelined ingest       : {duration:.1f}s, {len(new_photos)} photos, {NUMBER_OF_MAILS / duration:.1f} mails/s")
+    commands = server.commands[first_command:]
+    downloads = [command for command in commands if 'BODY.PEEK[' in command]
+    print(f"IMAP commands : {len(commands) - len(downloads)} (search, fetch structure, delete) "
+          f"+ {len(downloads)} attachment downloads")
+    print(f"Senders to notify : {sorted(set(sender for sender, _ in new_photos))}")
+    print(f"Mails left on server : {len(server.messages)} (should be 0)")
+
+    # More new photos than the frame keeps : retention deletes the first ones, they are not announced
+    ingest.apply_retention = lambda: apply_retention(5)
+    for index in range(8):
+        server.deliver(photo_mail(index, photo))
+    new_photos = ingest_new_mail()
+    print(f"8 new photos, 5 kept : {len(new_photos)} announced, "
+          f"{'ok' if len(new_photos) == 5 and all(map(photo_library.has_photo, (n for _, n in new_photos))) else 'WRONG'}")
+
+    # Processing fails half way : the downloader stops and lets go of the mailbox, the mails stay for the next check
+    def failing_submit(filename, attachment):
+        raise RuntimeError("image workers gone")
+
+    submit_new_image, ingest.submit_new_image = ingest.submit_new_image, failing_submit
+    for index in range(20):
+        server.deliver(photo_mail(index, photo))
+    try:
+        ingest.process_new_mail()
+    except RuntimeError as e:
+        stopped = 'downloader' not in (thread.name for thread in threading.enumerate())
+        print(f"Processing failed ({e}) : downloader stopped {stopped}, "
+              f"mailbox closed {mailbox.mail is None}, {len(server.messages)} mails left on server (should be 20)")
+    ingest.submit_new_image = submit_new_image
+    ingest_new_mail()
+    print(f"Next check : {len(server.messages)} mails left on server (should be 0)")
+
+    # Photos sent again : the same file doesn't go to the workers, a recompressed copy is not resized nor saved
+    ingest.find_duplicate, ingest.photo_by_sha256, ingest.dhashes = find_duplicate, photo_by_sha256, dhashes
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(photo)).save(buffer, format='JPEG', quality=60)
+    for index in range(8):
+        server.deliver(photo_mail(index, photo if index < 4 else buffer.getvalue()))
+    submitted = []
+    submit, ingest.submit = ingest.submit, lambda *args: submitted.append(args) or submit(*args)
+    photos_before = photo_library.photo_count()
+    processed = ingest.process_new_mail()
+    new_photos = ingest.add_new_photos(processed)
+    ingest.submit = submit
+    resized = [tmp_path for _, _, (_, _, tmp_path) in processed if tmp_path]
+    print(f"8 photos sent again : {len(submitted)} sent to the workers (should be 4), {len(resized)} resized "
+          f"(should be 0), {photo_library.photo_count() - photos_before} new photos (should be 0), "
+          f"{len(new_photos)} announced (should be 8)")
+
+mailbox.close_mailbox()
+server.stop()
+print("End")
@@ -0,0 +1,77 @@
+"""
+Benchmark : turn attachments into photos for the frame, the old way (save attachment, convert to JPG,
+rename, decode again, save) vs the single pass (save attachment for the worker, decode once, save once).
+Reports time per photo and bytes written to disk. Photos are written to a temporary folder.
+
+    python -um tests.test_ingest_single_pass
+"""
+import io
+import os
+import tempfile
+import time
+
+from PIL import Image, ImageOps
+from pillow_heif import HeifImagePlugin
+
+import utils.image_manipulation as image_manipulation
+import utils.ingest as ingest
+import utils.photo_index as photo_index
+import utils.photo_library as photo_library
+from utils.image_manipulation import resize_and_crop_image, publish_new_image
+
+ROUNDS = 5
+
+
+def bytes_written():
+    # bytes this process passed to write() : files, whatever the file system
+    with open('/proc/self/io') as f:
+        return int(dict(line.split(': ') for line in f.read().splitlines())['wchar'])
+
+
+def old_ingest(filename, data, folder):
+    path = os.path.join(folder, filename)
+    with open(path, 'wb') as f:
+        f.write(data)
+    if not path.lower().endswith('.jpg'):
+        with Image.open(path) as image:
+            image.convert('RGB').save(os.path.splitext(path)[0] + '.jpg', format='JPEG')
+        os.remove(path)
+        path = os.path.splitext(path)[0] + '.jpg'
+    image = resize_and_crop_image(ImageOps.exif_transpose(Image.open(path)))
+    image.save(os.path.join(folder, 'old-' + os.path.basename(path)))
+    os.remove(path)
+
+
+def new_ingest(filename, data):
+    # what submit_new_image() and a worker process do, then the move to the photos folder (see utils/ingest.py)
+    path, sha256 = ingest.save_for_worker(io.BytesIO(data))
+    fingerprint, captured_at, tmp_path = ingest.process_attachment(path, (800, 480), sha256)
+    return publish_new_image(tmp_path)
+
+
+def photo_bytes(format):
+    buffer = io.BytesIO()
+    Image.open('assets/samples/sample_photo.jpg').resize((4032, 3024)).save(buffer, format=format, quality=90)
+    return buffer.getvalue()
+
+
+with tempfile.TemporaryDirectory() as output_folder:
+    image_manipulation.OUTPUT_FOLDER = ingest.OUTPUT_FOLDER = photo_index.OUTPUT_FOLDER = output_folder
+    photo_index.PHOTO_INDEX = os.path.join(output_folder, 'photo_index.json')
+    photo_library.OUTPUT_FOLDER = output_folder
+    photo_library.PHOTO_LIBRARY = os.path.join(output_folder, 'photo_library.db')
+
+    for filename, format in (('IMG_0001.JPG', 'JPEG'), ('IMG_0002.HEIC', 'HEIF'), ('screenshot.png', 'PNG')):
+        data = photo_bytes(format)
+        print(f"{filename} : 4032x3024, {len(data) // 1024} KB")
+        for name, process in (('old way', lambda: old_ingest(filename, data, output_folder)),
+                              ('single pass', lambda: new_ingest(filename, data))):
+            written = bytes_written()
+            start = time.perf_counter()
+            for _ in range(ROUNDS):
+                process()
+            duration = (time.perf_counter() - start) / ROUNDS
+            written = (bytes_written() - written) / ROUNDS
+            print(f"  {name:>11} : {duration * 1000:.0f} ms per photo, {written / 1024:.0f} KB written")
+
+print("End")
@@ -0,0 +1,97 @@
+"""
+Benchmark : overhead of each display, with the Inky driver detected on every display (as before)
+or once and reused (utils/eink.py). Uses a stand-in driver instead of a real panel : detection costs
+what it costs on a Pi Zero 2 (EEPROM read over I2C, GPIO and SPI setup), the refresh itself costs nothing.
+Also checks that displays from several threads don't overlap, and that the driver is detected again after an error.
+
+    python -um tests.test_inky_driver [number_of_displays]
+"""
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from PIL import Image
+
+import utils.eink as eink
+import utils.state_store as state_store
+from utils.eink import send_to_eink, get_display
+
+NUMBER_OF_DISPLAYS = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+
+# Measured on a Pi Zero 2 W with an Inky Impression 7.3"
+DETECTION_TIME = 0.35
+
+
+class StandInInky:
+    """ Just enough of an Inky driver for send_to_eink() """
+    resolution = (800, 480)
+    created = 0
+    showing = 0
+    overlaps = 0
+    fail_next_show = False
+
+    def __init__(self):
+        time.sleep(DETECTION_TIME)
+        StandInInky.created += 1
+
+    def set_image(self, image):
+        self.image = image
+
+    def show(self):
+        StandInInky.showing += 1
+        if StandInInky.showing > 1:
+            StandInInky.overlaps += 1
+        time.sleep(0.01)
+        StandInInky.showing -= 1
+        if StandInInky.fail_next_show:
+            StandInInky.fail_next_show = False
+            raise OSError("SPI transfer failed")
+
+
+def display_many(times):
+    start = time.perf_counter()
+    for _ in range(times):
+        # forced : the same screen again and again would be skipped otherwise
+        assert send_to_eink(SCREEN, is_debug=True, force=True)
+    return (time.perf_counter() - start) / times
+
+
+with tempfile.TemporaryDirectory() as folder:
+    eink.TMP_DOWNLOAD_FOLDER = folder
+    state_store.STATE_FILE = os.path.join(folder, 'state.json')
+    SCREEN = 'screen.png'
+    Image.new('RGB', StandInInky.resolution, 'white').save(os.path.join(folder, SCREEN))
+
+    # Before : a new driver for each display
+    eink.get_display = lambda: StandInInky()
+    detect_every_time = display_many(NUMBER_OF_DISPLAYS)
+
+    # Now : one shared driver
+    eink.get_display = get_display
+    eink.auto = StandInInky
+    StandInInky.created = 0
+    first = display_many(1)
+    shared = display_many(NUMBER_OF_DISPLAYS)
+    print(f"{NUMBER_OF_DISPLAYS} displays, stand-in driver taking {DETECTION_TIME * 1000:.0f} ms to detect")
+    print(f"  detected every time : {detect_every_time * 1000:.0f} ms per display")
+    print(f"        shared driver : {first * 1000:.0f} ms for the first display, then {shared * 1000:.0f} ms per display")
+    print(f"     drivers created : {StandInInky.created}")
+
+    # Buttons, main loop and shutdown screen at the same time
+    threads = [threading.Thread(target=display_many, args=(5,)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    print(f"  4 threads x 5 displays : {StandInInky.created} driver(s), {StandInInky.overlaps} overlapping refresh(es)")
+
+    # A failed refresh drops the driver, the next display detects it again
+    StandInInky.fail_next_show = True
+    failed = send_to_eink(SCREEN, is_debug=True, force=True)
+    recovered = send_to_eink(SCREEN, is_debug=True, force=True)
+    print(f"  after an error : display {'failed' if not failed else 'succeeded ?!'}, "
+          f"next display {'succeeded' if recovered else 'failed'}, {StandInInky.created} driver(s) created")
+
+print("End")
@@ -0,0 +1,80 @@
+"""
+Benchmark of the LED thread (utils/led.py) : threads created, CPU used while blinking and while idle,
+how precisely the LED changes on time, and how long callers wait. The LED itself is replaced by a recorder.
+
+    python -um tests.test_led_controller
+"""
+import threading
+import time
+
+import utils.led as led
+from utils.led import led_on, led_off, start_blinking_led, stop_blinking_led, show_error_code
+
+changes = []  # (time.monotonic(), on)
+
+
+def record_led(on):
+    changes.append((time.monotonic(), on))
+
+
+def cpu_while(seconds):
+    start = time.process_time()
+    time.sleep(seconds)
+    return (time.process_time() - start) / seconds * 100
+
+
+led._set_led = record_led
+
+# Main loop iterations : blink during the check, stop when waiting
+threads_before = threading.active_count()
+start = time.perf_counter()
+waits = []
+for _ in range(100):
+    start_blinking_led()
+    call = time.perf_counter()
+    stop_blinking_led()
+    waits.append(time.perf_counter() - call)
+print(f"100 start / stop : {threading.active_count() - threads_before} thread(s) created, "
+      f"stop_blinking_led() returns in {max(waits) * 1000:.2f} ms at most (the old thread join : up to 1300 ms)")
+
+# Blinking : are changes on time ?
+changes.clear()
+start_blinking_led()
+cpu_blinking = cpu_while(6)
+stop_blinking_led()
+steps = [(changes[i + 1][0] - changes[i][0]) - (led.BLINK_ON if changes[i][1] else led.BLINK_OFF)
+         for i in range(len(changes) - 2)]
+print(f"Blinking 6 s : {len(changes) - 1} changes, {max(abs(step) for step in steps) * 1000:.1f} ms off schedule "
+      f"at most, process CPU {cpu_blinking:.2f} %")
+
+# Idle : the LED thread waits for the next pattern without polling
+print(f"Idle 3 s : process CPU {cpu_while(3):.2f} %")
+
+# Error code 3, then a button turning the LED on
+changes.clear()
+show_error_code(3)
+time.sleep(3 * (led.ERROR_FLASH_ON + led.ERROR_FLASH_OFF) + led.ERROR_PAUSE / 2)
+flashes = len([on for _, on in changes if on])
+led_on()
+on_now = changes[-1][1]
+led_off()
+print(f"Error code 3 : {flashes} flashes in one cycle, led_on() right after : LED {'on' if on_now else 'off ?!'}, "
+      f"led_off() : LED {'off' if not changes[-1][1] else 'on ?!'}")
+
+# Buttons and main loop at the same time
+def hammer():
+    for _ in range(200):
+        led_on()
+        start_blinking_led()
+        led_off()
+
+threads = [threading.Thread(target=hammer) for _ in range(4)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+stop_blinking_led()
+print(f"4 threads x 600 patterns : LED {'off' if not changes[-1][1] else 'on ?!'} after the last stop, "
+      f"{threading.active_count() - threads_before} LED thread")
+
+print("End")
@@ -0,0 +1,125 @@
+"""
+Simulated day of mail checks (no network, no waiting) : fixed interval vs adaptive polling
+(utils/mailbox.py next_check_interval() : every CHECK_INTERVAL seconds during a burst of photos,
+backing off up to CHECK_INTERVAL_MAX while the mailbox is quiet).
+Without IMAP IDLE (IMAP_KEEPALIVE=False), checks are the only way to notice new mail, and each one is
+a TLS connection and a login. With IDLE, the server wakes us up when a mail arrives : checks are a safety net.
+
+Reports the delay from a photo being sent to being displayed, and the checks, data and CPU time per day.
+
+    python -um tests.test_mail_polling
+"""
+import random
+import statistics
+
+import utils.mailbox as mailbox
+
+DAY = 24 * 3600
+
+# Cost of one check without a kept-alive connection : TLS handshake, login, search, logout.
+# Rough estimates for a Pi Zero 2 W and a big mail provider : only the ratios between settings matter
+CHECK_BYTES = 7 * 1024
+CHECK_CPU_SECONDS = 0.12
+
+# Adaptive settings, see utils/constants.py
+CHECK_INTERVAL = 60
+CHECK_INTERVAL_MAX = 300        # IMAP_KEEPALIVE=False
+CHECK_INTERVAL_MAX_IDLE = 1800  # IMAP_KEEPALIVE=True
+MAIL_BURST_DURATION = 120
+# With IDLE : from the mail arriving to the server telling us
+IDLE_NOTICE_DELAY = 2
+
+
+def photos_of_a_day(seed=1):
+    """ A few bursts (someone sending the photos of the weekend), a few single photos : arrival times """
+    rng = random.Random(seed)
+    arrivals = []
+    for _ in range(3):
+        sent = rng.uniform(8 * 3600, 22 * 3600)
+        for _ in range(rng.randint(3, 8)):
+            arrivals.append(sent)
+            sent += rng.uniform(10, 120)
+    arrivals += [rng.uniform(0, DAY) for _ in range(4)]
+    return sorted(arrivals)
+
+
+def simulate(arrivals, next_interval, idle=False):
+    """
+    :param idle: if True, a mail arriving during a wait ends it (IMAP IDLE)
+    :return: (number of checks, list of (arrival, delay to display))
+    """
+    checks = 0
+    delays = []
+    now = last_check = 0
+    while now < DAY:
+        checks += 1
+        found = [arrival for arrival in arrivals if last_check < arrival <= now]
+        delays += [(arrival, now - arrival) for arrival in found]
+        last_check = now
+        now += next_interval(len(found), now)
+        if idle:
+            now = min([now] + [arrival + IDLE_NOTICE_DELAY for arrival in arrivals if last_check < arrival < now])
+    return checks, delays
+
+
+def split_delays(delays, arrivals):
+    """
+    :return: (delays of photos in a burst, delays of first photos)
+    """
+    # first photo of a burst : nothing arrived in the previous 10 minutes
+    first = {arrival for arrival in arrivals if not any(0 < arrival - other < 600 for other in arrivals)}
+    return [delay for arrival, delay in delays if arrival not in first], \
+        [delay for arrival, delay in delays if arrival in first]
+
+
+def adaptive(interval_max):
+    """ next_check_interval() with CHECK_INTERVAL_MAX = interval_max, from a quiet mailbox """
+    mailbox.CHECK_INTERVAL_MAX = interval_max
+    mailbox.check_interval, mailbox.burst_end_time = CHECK_INTERVAL, 0
+    return mailbox.next_check_interval
+
+
+def report(name, checks, delays, arrivals):
+    in_burst, alone = split_delays(delays, arrivals)
+    print(f"  {name:<30} {checks:>6} checks  {checks * CHECK_BYTES / 1024 / 1024:>6.1f} MB  "
+          f"{checks * CHECK_CPU_SECONDS:>6.0f} s CPU  | burst photos {statistics.mean(in_burst):>5.0f} s avg "
+          f"{max(in_burst):>5.0f} s max  | first photos {statistics.mean(alone):>5.0f} s avg {max(alone):>5.0f} s max")
+
+
+mailbox.CHECK_INTERVAL = CHECK_INTERVAL
+mailbox.MAIL_BURST_DURATION = MAIL_BURST_DURATION
+
+
+def settings():
+    """ :return: list of (name, function returning next_interval(), idle) """
+    return [
+        ('every 300 s', lambda: lambda found, now: 300, False),
+        (f"adaptive {CHECK_INTERVAL} - {CHECK_INTERVAL_MAX} s", lambda: adaptive(CHECK_INTERVAL_MAX), False),
+        ('every 300 s, IDLE', lambda: lambda found, now: 300, True),
+        (f"adaptive {CHECK_INTERVAL} - {CHECK_INTERVAL_MAX_IDLE} s, IDLE", lambda: adaptive(CHECK_INTERVAL_MAX_IDLE),
+         True),
+    ]
+
+
+arrivals = photos_of_a_day()
+print(f"One day, {len(arrivals)} photos. Delay from sending to display, and cost of the checks :")
+report(f"every {CHECK_INTERVAL} s", *simulate(arrivals, lambda found, now: CHECK_INTERVAL), arrivals)
+for name, next_interval, idle in settings():
+    report(name, *simulate(arrivals, next_interval(), idle), arrivals)
+
+# Over many days, to smooth the randomness
+totals = {}
+for seed in range(30):
+    arrivals = photos_of_a_day(seed)
+    for name, next_interval, idle in settings():
+        checks, delays = simulate(arrivals, next_interval(), idle)
+        total = totals.setdefault(name, [0, [], []])
+        total[0] += checks
+        total[1] += split_delays(delays, arrivals)[0]
+        total[2] += [delay for _, delay in delays]
+print("30 simulated days :")
+for name, (checks, in_burst, delays) in totals.items():
+    print(f"  {name:<30} {checks / 30:>6.0f} checks per day | burst photos {statistics.mean(in_burst):>5.0f} s avg "
+          f"{max(in_burst):>5.0f} s max | all photos {statistics.mean(delays):>5.0f} s avg {max(delays):>5.0f} s max")
+
+print("End")
@@ -0,0 +1,103 @@
+"""
+Test the mail prefilter (reject_mail() and is_allowed_sender() in utils/check_new.py) against a local stand-in
+IMAP server : mails from senders not in ALLOWED_SENDERS, and mails over MAX_MAIL_SIZE_MB, are rejected from
+their headers and structure only, before any of their body is downloaded. Wanted mails still go through.
+No real mail account needed.
+
+    python -um tests.test_mail_prefilter
+"""
+import os
+import re
+import tempfile
+from email.message import EmailMessage
+
+import utils.check_new as check_new
+import utils.mailbox as mailbox
+import utils.state_store as state_store
+from tests.fake_imap_server import FakeImapServer
+from utils.check_new import check_mail_and_download_attachments, is_allowed_sender
+
+
+def photo_mail(sender, padding=0):
+    msg = EmailMessage()
+    msg['From'] = sender
+    msg['Subject'] = 'Test photo'
+    msg.set_content('Hello Grandma')
+    with open('assets/samples/sample_photo.jpg', 'rb') as f:
+        msg.add_attachment(f.read(), maintype='image', subtype='jpeg', filename='sample_photo.jpg')
+    if padding:
+        # a video, or anything else that makes the mail big
+        msg.add_attachment(os.urandom(padding), maintype='video', subtype='mp4', filename='video.mp4')
+    return msg.as_bytes()
+
+
+def body_fetches():
+    """
+    :return: {uid: number of FETCH of body parts}
+    """
+    fetches = {}
+    for command in server.commands:
+        if match := re.match(r'UID FETCH (\d+) \(BODY(?:\.PEEK)?\[', command, re.IGNORECASE):
+            uid = int(match.group(1))
+            fetches[uid] = fetches.get(uid, 0) + 1
+    return fetches
+
+
+server = FakeImapServer().start()
+mailbox.IMAP_SERVER, mailbox.IMAP_PORT, mailbox.IMAP_SSL = '127.0.0.1', server.port, False
+mailbox.IMAP_USER, mailbox.IMAP_PASSWORD, mailbox.IMAP_KEEPALIVE = 'test', 'test', True
+state_store.STATE_FILE = os.path.join(tempfile.gettempdir(), 'cadrephoto_test_state.json')
+if os.path.exists(state_store.STATE_FILE):
+    os.remove(state_store.STATE_FILE)
+
+check_new.ALLOWED_SENDERS = ['grandson@test-email.null', '@family.null']
+check_new.MAX_MAIL_SIZE_MB = 1
+
+checks = {
+    'allowed email': is_allowed_sender('grandson@test-email.null'),
+    'allowed email, other case': is_allowed_sender('GrandSon@Test-Email.null'),
+    'allowed domain': is_allowed_sender('cousin@family.null'),
+    'other sender': not is_allowed_sender('spam@test-email.null'),
+    'other domain ending the same': not is_allowed_sender('spam@notfamily.null'),
+}
+
+mails = {
+    'allowed sender': server.deliver(photo_mail('grandson@test-email.null')),
+    'sender not allowed': server.deliver(photo_mail('spam@test-email.null')),
+    'allowed domain': server.deliver(photo_mail('cousin@family.null')),
+    'too big': server.deliver(photo_mail('grandson@test-email.null', padding=2 * 1024 * 1024)),
+}
+
+attachments = check_mail_and_download_attachments()
+for _, _, attachment in attachments:
+    attachment.close()
+downloaded = {int(filename.split('-')[0]) for _, filename, _ in attachments}
+fetches = body_fetches()
+for name, uid in mails.items():
+    print(f"Mail {uid} ({name}) : {'downloaded' if uid in downloaded else 'rejected'}, "
+          f"{fetches.get(uid, 0)} body fetch(es)")
+
+checks['allowed mails downloaded'] = {mails['allowed sender'], mails['allowed domain']} == downloaded
+checks['rejected mails : nothing downloaded'] = not fetches.get(mails['sender not allowed']) \
+    and not fetches.get(mails['too big'])
+checks['all mails deleted'] = not server.messages
+
+# FETCH responses the frame didn't ask for (flags changed by another client) : ignored
+server.unsolicited = [b'* 1 FETCH (FLAGS (\\Seen))', b'* 1 FETCH (UID 999 FLAGS ())']
+for mail in (photo_mail('spam@test-email.null'), photo_mail('grandson@test-email.null', padding=2 * 1024 * 1024),
+             photo_mail('grandson@test-email.null')):
+    server.deliver(mail)
+attachments = check_mail_and_download_attachments()
+server.unsolicited = []
+with open('assets/samples/sample_photo.jpg', 'rb') as f:
+    checks['other FETCH responses : ignored'] = [attachment.read() for _, _, attachment in attachments] == [f.read()] \
+        and not server.messages and mailbox.mail is not None
+for _, _, attachment in attachments:
+    attachment.close()
+
+for check, ok in checks.items():
+    print(f"  {'ok   ' if ok else 'WRONG'} {check}")
+
+mailbox.close_mailbox()
+server.stop()
+print("End")
@@ -0,0 +1,113 @@
+"""
+Check that processing a photo stays within its memory budget (IMAGE_MEMORY_BUDGET_MB / IMAGE_WORKERS,
+64 MB here : the default budget with 4 workers), with normal photos and with hostile ones : decompression bombs, huge PNG, giant panoramas.
+Each photo is processed in a fresh process, and its peak memory measured :
+    - RSS : everything, including Pillow's pixel buffers
+    - tracemalloc : Python objects only (Pillow's pixel buffers are not seen by tracemalloc)
+
+    python -um tests.test_memory_budget
+"""
+import hashlib
+import io
+import multiprocessing
+import os
+import struct
+import tempfile
+import tracemalloc
+import zlib
+
+from PIL import Image
+
+import utils.image_manipulation as image_manipulation
+from utils.ingest import process_attachment
+
+image_manipulation.MEMORY_BUDGET_PER_IMAGE = MEMORY_BUDGET_PER_IMAGE = 64 * 1024 * 1024
+
+# Memory used on top of the decoded image : Python objects, compressed data, Pillow internals
+MARGIN = 16 * 1024 * 1024
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def png_bomb(width, height, mode='RGB'):
+    """ Valid PNG of width x height black pixels, compressed without ever holding the whole image in memory """
+    colour_type, bands = {'L': (0, 1), 'RGB': (2, 3)}[mode]
+    compressor = zlib.compressobj(9)
+    row = b'\0' * (width * bands + 1)
+    rows_per_chunk = max(1, 2 ** 24 // len(row))
+    data = b''.join(compressor.compress(row * min(rows_per_chunk, height - y)) for y in range(0, height, rows_per_chunk))
+    data += compressor.flush()
+    header = struct.pack('>IIBBBBB', width, height, 8, colour_type, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', header) + png_chunk(b'IDAT', data) + png_chunk(b'IEND', b'')
+
+
+def encoded(image, format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+def memory_status(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) * 1024
+
+
+def measure(attachment_path, sha256, results):
+    # a forked process starts with the peak RSS of its parent : reset it (Linux)
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    tracemalloc.start()
+    baseline = memory_status('VmRSS')
+    try:
+        fingerprint, captured_at, path = process_attachment(attachment_path, (800, 480), sha256)
+        os.remove(path)
+        outcome = "processed"
+    except Exception as e:
+        outcome = f"rejected : {e}"
+    peak = memory_status('VmHWM') - baseline
+    results.put((outcome, peak, tracemalloc.get_traced_memory()[1]))
+
+
+def run(data):
+    # as sent to a worker : a temp file, deleted by process_attachment()
+    fd, attachment_path = tempfile.mkstemp(prefix='attachment-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    results = multiprocessing.Queue()
+    child = multiprocessing.Process(target=measure, args=(attachment_path, hashlib.sha256(data).hexdigest(), results))
+    child.start()
+    outcome = results.get()
+    child.join()
+    return outcome
+
+
+sample = Image.open('assets/samples/sample_photo.jpg').convert('RGB')
+rotated_exif = Image.Exif()
+rotated_exif[0x0112] = 6
+
+photos = {
+    'phone photo, JPEG 4032x3024': lambda: encoded(sample.resize((4032, 3024)), 'JPEG', quality=90),
+    'phone photo shot in portrait, JPEG 4032x3024': lambda: encoded(sample.resize((4032, 3024)), 'JPEG', exif=rotated_exif),
+    'panorama, JPEG 16000x2000': lambda: encoded(sample.resize((16000, 2000)), 'JPEG', quality=90),
+    'screenshot, PNG 1290x2796': lambda: encoded(sample.resize((1290, 2796)), 'PNG'),
+    'big PNG 4000x3000': lambda: png_bomb(4000, 3000),
+    'big PNG 4000x3000, rotated': lambda: encoded(sample.resize((4000, 3000)), 'PNG', exif=rotated_exif),
+    'GIF 4000x3000': lambda: encoded(sample.resize((4000, 3000)).quantize(), 'GIF'),
+    'huge PNG 9000x9000': lambda: png_bomb(9000, 9000),
+    'decompression bomb, PNG 40000x40000': lambda: png_bomb(40000, 40000, 'L'),
+}
+
+print(f"Memory budget per photo : {MEMORY_BUDGET_PER_IMAGE // 2**20} MB")
+for name, make_photo in photos.items():
+    data = make_photo()
+    outcome, peak_rss, peak_traced = run(data)
+    within = peak_rss <= MEMORY_BUDGET_PER_IMAGE + MARGIN
+    print(f"{name} ({len(data) // 1024} KB) : {outcome}")
+    print(f"    peak RSS +{peak_rss / 2**20:.0f} MB, tracemalloc peak {peak_traced / 2**20:.0f} MB, "
+          f"{'within budget' if within else '⚠️ OVER BUDGET'}")
+
+print("End")
@@ -0,0 +1,52 @@
+"""
+Check that photos are resized once, to the size of each Inky panel, without being stretched :
+landscape and portrait photos, on landscape and portrait frames. Frames are saved in a temporary
+folder (not deleted) to have a look at them.
+
+    python -um tests.test_panel_sizes
+"""
+import os
+import tempfile
+
+from PIL import Image
+
+import utils.colour_lut as colour_lut
+import utils.frame_cache as frame_cache
+import utils.image_manipulation as image_manipulation
+from utils.frame_cache import render_frame
+from utils.image_manipulation import get_target_size, resize_and_crop_image
+
+PANELS = [('InkyUC8159', (600, 448)), ('InkyUC8159', (640, 400)), ('InkyE673', (800, 480)), ('InkyEL133UF1', (1600, 1200))]
+PALETTE = [0, 0, 0, 255, 255, 255, 255, 255, 0, 255, 0, 0, 0, 0, 255, 0, 255, 0]
+
+sample = Image.open('assets/samples/sample_photo.jpg').convert('RGB')
+photos = {'landscape 4:3': sample.resize((1600, 1200)), 'portrait 3:4': sample.resize((1200, 1600))}
+resamples = 0
+original_resize = Image.Image.resize
+
+
+def counting_resize(self, *args, **kwargs):
+    global resamples
+    resamples += 1
+    return original_resize(self, *args, **kwargs)
+
+
+Image.Image.resize = counting_resize
+
+frames_folder = colour_lut.FRAME_CACHE_FOLDER = tempfile.mkdtemp()
+print(f"Frames in {frames_folder}")
+for rotation in (0, 90):
+    image_manipulation.PANEL_ROTATION = frame_cache.PANEL_ROTATION = rotation
+    for model, resolution in PANELS:
+        frame_cache.panel = {'model': model, 'resolution': list(resolution), 'palette': PALETTE}
+        size = get_target_size()
+        for photo_name, photo in photos.items():
+            resamples = 0
+            processed = resize_and_crop_image(photo, size)
+            frame = render_frame(processed, frame_cache.panel)
+            print(f"  {model} {resolution[0]}x{resolution[1]}, rotation {rotation:>2}, {photo_name} : "
+                  f"processed {processed.size[0]}x{processed.size[1]}, frame {frame.size[0]}x{frame.size[1]}, "
+                  f"{resamples} resample(s)")
+            frame.save(os.path.join(frames_folder, f"{model}-{resolution[0]}x{resolution[1]}-{rotation}-{photo_name[:4]}.png"))
+
+print("End")
@@ -0,0 +1,113 @@
+"""
+Checks and benchmark of the photo index (utils/photo_index.py) : exact, near and non duplicates are told apart,
+photos copied by hand are only found by dHash, and the cost of a lookup with thousands of photos on the frame,
+compared to comparing the new photo with every photo.
+Photos, library and state go to a temporary folder.
+
+    python -um tests.test_photo_index [number_of_photos]
+"""
+import hashlib
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+
+from PIL import Image, ImageFilter
+
+import utils.photo_index as photo_index
+import utils.photo_library as photo_library
+import utils.state_store as state_store
+from utils.photo_index import image_dhash, find_duplicate, add_photo, load_photo_index, NEAR_DUPLICATE_DISTANCE
+
+NUMBER_OF_PHOTOS = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+ROUNDS = 200
+
+
+def jpeg_bytes(image, quality=90):
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def received_fingerprint(data):
+    # what a worker process computes for an attachment, see utils/ingest.py process_attachment()
+    with Image.open(io.BytesIO(data)) as image:
+        return {'sha256': hashlib.sha256(data).hexdigest(), 'dhash': image_dhash(image)}
+
+
+def receive(name, data, fingerprint):
+    with open(os.path.join(photo_library.OUTPUT_FOLDER, name), 'wb') as f:
+        f.write(data)
+    add_photo(name, fingerprint, 'grandson@test-email.null')
+
+
+def old_find_duplicate(fingerprint):
+    # compare with every photo of the frame
+    for image_name, known in photo_index.photos.items():
+        if known['sha256'] == fingerprint['sha256'] \
+                or bin(known['dhash'] ^ fingerprint['dhash']).count('1') <= NEAR_DUPLICATE_DISTANCE:
+            return image_name
+    return None
+
+
+def per_call(function, fingerprints):
+    start = time.perf_counter()
+    for fingerprint in fingerprints:
+        function(fingerprint)
+    return (time.perf_counter() - start) / len(fingerprints) * 1000
+
+
+random.seed(1)
+sample = Image.open('assets/samples/sample_photo.jpg').convert('RGB')
+photo = jpeg_bytes(sample)
+resent = jpeg_bytes(sample.resize((sample.width // 2, sample.height // 2)), quality=60)
+other_photo = jpeg_bytes(sample.transpose(Image.Transpose.FLIP_LEFT_RIGHT).filter(ImageFilter.GaussianBlur(4)))
+
+with tempfile.TemporaryDirectory() as folder:
+    photo_library.OUTPUT_FOLDER = photo_index.OUTPUT_FOLDER = folder
+    photo_library.PHOTO_LIBRARY = os.path.join(folder, 'library', 'photo_library.db')
+    photo_index.PHOTO_INDEX = os.path.join(folder, 'library', 'photo_index.json')
+    state_store.STATE_FILE = os.path.join(folder, 'library', 'state.json')
+    os.makedirs(os.path.dirname(photo_library.PHOTO_LIBRARY))
+
+    # NUMBER_OF_PHOTOS photos with random dHash, then the sample photo
+    for number in range(NUMBER_OF_PHOTOS):
+        receive(f"photo-{number:06d}.jpg", b'', {'sha256': f"{number:064x}", 'dhash': random.getrandbits(64)})
+    receive('sample.jpg', photo, received_fingerprint(photo))
+
+    checks = {
+        'exact duplicate': find_duplicate(received_fingerprint(photo)) == 'sample.jpg',
+        'near duplicate (smaller, recompressed)': find_duplicate(received_fingerprint(resent)) == 'sample.jpg',
+        'not a duplicate': find_duplicate(received_fingerprint(other_photo)) is None,
+    }
+
+    unknown = [{'sha256': f"{random.getrandbits(256):064x}", 'dhash': random.getrandbits(64)} for _ in range(ROUNDS)]
+    known = [photo_index.photos[f"photo-{random.randrange(NUMBER_OF_PHOTOS):06d}.jpg"] for _ in range(ROUNDS)]
+    print(f"{NUMBER_OF_PHOTOS} photos, find a duplicate :")
+    print(f"  new photo   : {per_call(old_find_duplicate, unknown):.3f} ms comparing with every photo, "
+          f"{per_call(find_duplicate, unknown):.3f} ms now")
+    print(f"  photo again : {per_call(old_find_duplicate, known):.3f} ms comparing with every photo, "
+          f"{per_call(find_duplicate, known):.3f} ms now")
+
+    # Deleted photo : not a duplicate any more
+    photo_library.delete_photo('sample.jpg')
+    checks['deleted photo is not a duplicate'] = find_duplicate(received_fingerprint(photo)) is None
+
+    # Photo copied by hand : the received file is unknown, only its dHash is kept
+    with open(os.path.join(folder, 'copied_by_hand.jpg'), 'wb') as f:
+        f.write(photo)
+    photo_library.close_library()
+    load_photo_index()
+    checks['copied by hand : dHash only'] = photo_index.photos['copied_by_hand.jpg']['sha256'] is None
+    checks['copied by hand : found by dHash'] = find_duplicate(received_fingerprint(resent)) == 'copied_by_hand.jpg'
+    photo_library.close_library()
+    load_photo_index()
+    checks['copied by hand : dHash saved in the library'] = photo_index.photos['copied_by_hand.jpg']['sha256'] is None
+
+    for check, ok in checks.items():
+        print(f"  {'ok   ' if ok else 'WRONG'} {check}")
+    photo_library.close_library()
+
+print("End")
@@ -0,0 +1,117 @@
+"""
+Benchmark of the photo library (utils/photo_library.py) with thousands of photos : next, previous, delete
+and retention, compared to the old way (glob the photos folder, list.index(), stat and sort every file).
+Also checks the slideshow order, the totals kept by triggers and the sync with files copied or deleted by hand.
+Photos and library go to a temporary folder.
+
+    python -um tests.test_photo_library [number_of_photos]
+"""
+import glob
+import io
+import os
+import sys
+import tempfile
+import time
+
+from PIL import Image
+
+import utils.photo_library as photo_library
+import utils.state_store as state_store
+from utils.retention import apply_retention
+
+NUMBER_OF_PHOTOS = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+ROUNDS = 200
+
+
+def old_next_photo(output_folder, current_photo):
+    # get_next_photo() before the library
+    photos = [os.path.basename(x) for x in glob.glob(os.path.join(output_folder, '*.jpg'))]
+    next_index = (photos.index(current_photo) + 1) % len(glob.glob(os.path.join(output_folder, '*.jpg')))
+    return photos[next_index]
+
+
+def old_files_to_delete(output_folder, keep):
+    # delete_all_but_latest_XXX() before the library, without deleting
+    files = [os.path.join(output_folder, name) for name in os.listdir(output_folder)]
+    files.sort(key=os.path.getmtime, reverse=True)
+    return files[keep:]
+
+
+def per_call(function, *args):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        function(*args)
+    return (time.perf_counter() - start) / ROUNDS * 1000
+
+
+buffer = io.BytesIO()
+exif = Image.Exif()
+exif[photo_library.EXIF_DATE_TIME] = "2024:07:14 18:30:00"
+Image.new('RGB', (80, 48), 'orange').save(buffer, format='JPEG', exif=exif)
+photo = buffer.getvalue()
+
+with tempfile.TemporaryDirectory() as output_folder, tempfile.TemporaryDirectory() as state_folder:
+    photo_library.OUTPUT_FOLDER = output_folder
+    photo_library.PHOTO_LIBRARY = os.path.join(state_folder, 'photo_library.db')
+    state_store.STATE_FILE = os.path.join(state_folder, 'state.json')
+
+    names = [f"2025-01-01-{number:06d}.jpg" for number in range(NUMBER_OF_PHOTOS)]
+    for number, name in enumerate(names):
+        with open(os.path.join(output_folder, name), 'wb') as f:
+            f.write(photo)
+        os.utime(os.path.join(output_folder, name), (number, number))
+
+    start = time.perf_counter()
+    photo_library.get_library()
+    print(f"{NUMBER_OF_PHOTOS} photos, first sync of the library : {time.perf_counter() - start:.1f}s")
+
+    current = names[NUMBER_OF_PHOTOS // 2]
+    print(f"  next photo  : {per_call(old_next_photo, output_folder, current):.2f} ms before, "
+          f"{per_call(photo_library.next_photo, current):.3f} ms now")
+    print(f"  previous    : {per_call(photo_library.previous_photo, current):.3f} ms now")
+    print(f"  retention   : {per_call(old_files_to_delete, output_folder, NUMBER_OF_PHOTOS - 10):.2f} ms before, "
+          f"{per_call(photo_library.oldest_photo):.3f} ms now (which photo to delete)")
+    print(f"  add photo   : {per_call(photo_library.move_to_end, current):.3f} ms now (move to end)")
+
+    start = time.perf_counter()
+    for name in names[:ROUNDS]:
+        photo_library.delete_photo(name)
+    print(f"  delete      : {(time.perf_counter() - start) / ROUNDS * 1000:.3f} ms now (file and row)")
+    names = names[ROUNDS:]
+
+    # Slideshow order : received order, a photo received again goes to the end, wraps around
+    last, first = names[-1], names[0]
+    checks = {
+        'photo received again is the last one': photo_library.next_photo(last) == current,
+        'next after the last one is the first one': photo_library.next_photo(current) == first,
+        'previous before the first one is the last one': photo_library.previous_photo(first) == current,
+        'next of an unknown photo is the first one': photo_library.next_photo('gone.jpg') == first,
+        'totals kept by triggers': (photo_library.photo_count(), photo_library.library_size())
+                                   == (len(names), len(names) * len(photo)),
+        'capture time from EXIF': photo_library.get_library().execute(
+            "SELECT captured_at FROM photos WHERE name = ?", (first,)).fetchone()[0] == "2024-07-14 18:30:00",
+    }
+
+    deleted = apply_retention(len(names) - 5)
+    checks['retention deletes the oldest ones'] = deleted == names[:5] and not os.path.exists(
+        os.path.join(output_folder, names[0]))
+
+    photo_library.set_current_photo(os.path.join(output_folder, current))
+    checks['current photo'] = photo_library.get_current_photo() == current
+
+    # Photos copied or deleted by hand while the frame was off
+    photo_library.close_library()
+    os.remove(os.path.join(output_folder, names[10]))
+    with open(os.path.join(output_folder, 'copied_by_hand.jpg'), 'wb') as f:
+        f.write(photo)
+    with open(os.path.join(output_folder, 'notes.txt'), 'w') as f:
+        f.write("not a photo")
+    checks['sync after restart'] = not photo_library.has_photo(names[10]) \
+        and photo_library.has_photo('copied_by_hand.jpg') and not photo_library.has_photo('notes.txt') \
+        and photo_library.photo_count() == len(names) - 5 and photo_library.get_current_photo() == current
+
+    for check, ok in checks.items():
+        print(f"  {'ok   ' if ok else 'WRONG'} {check}")
+    photo_library.close_library()
+
+print("End")
@@ -0,0 +1,116 @@
+"""
+Benchmark and checks of retention (utils/retention.py) : cost of adding a photo with thousands of photos
+on the frame, compared to the old way (list the photos folder, stat and sort every file), then which photos
+go with the count limit, the size limit and per-sender fairness.
+Photos are small files of random bytes, in temporary folders.
+
+    python -um tests.test_retention [number_of_photos]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import utils.photo_library as photo_library
+import utils.state_store as state_store
+from utils.retention import apply_retention
+
+NUMBER_OF_PHOTOS = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+NEW_PHOTOS = 200
+
+
+def new_library(folder):
+    photo_library.close_library()
+    photo_library.OUTPUT_FOLDER = folder
+    photo_library.PHOTO_LIBRARY = os.path.join(folder, 'library', 'photo_library.db')
+    state_store.STATE_FILE = os.path.join(folder, 'library', 'state.json')
+    state_store.state = None
+    os.makedirs(os.path.dirname(photo_library.PHOTO_LIBRARY))
+    photo_library.get_library()
+
+
+def receive(name, sender, size=1000):
+    with open(os.path.join(photo_library.OUTPUT_FOLDER, name), 'wb') as f:
+        f.write(os.urandom(size))
+    photo_library.add_photo(name, sender=sender)
+
+
+def old_retention(folder, keep):
+    # delete_all_but_latest_XXX() before the library
+    files = [os.path.join(folder, name) for name in os.listdir(folder)]
+    files = [path for path in files if os.path.isfile(path)]
+    files.sort(key=os.path.getmtime, reverse=True)
+    for path in files[keep:]:
+        os.remove(path)
+
+
+def senders_left():
+    return {sender.split('@')[0]: count for sender, count, _ in photo_library.senders()}
+
+
+# Cost of a new photo with NUMBER_OF_PHOTOS photos on the frame
+for way in ['old', 'new']:
+    with tempfile.TemporaryDirectory() as folder:
+        new_library(folder)
+        for number in range(NUMBER_OF_PHOTOS):
+            receive(f"photo-{number:06d}.jpg", f"relative{number % 5}@test-email.null")
+
+        start = time.perf_counter()
+        for number in range(NEW_PHOTOS):
+            receive(f"new-{number:06d}.jpg", "cousin@test-email.null")
+            if way == 'old':
+                old_retention(folder, NUMBER_OF_PHOTOS)
+            else:
+                apply_retention(NUMBER_OF_PHOTOS, 0, False)
+        duration = (time.perf_counter() - start) / NEW_PHOTOS * 1000
+        print(f"{way} retention, {NUMBER_OF_PHOTOS} photos : {duration:.2f} ms per new photo")
+        if way == 'new':
+            plan = photo_library.get_library().execute(
+                "EXPLAIN QUERY PLAN SELECT position, name FROM photos WHERE COALESCE(sender, '') = ? "
+                "AND name IS NOT ? ORDER BY position LIMIT 1", ('cousin@test-email.null', None)).fetchall()
+            print(f"  oldest photo of a sender : {plan[-1][-1]}")
+
+# 4 relatives have sent 5 photos each, then a cousin sends 15 at once. 20 photos kept
+print("A cousin sends 15 photos, 4 relatives have 5 photos each, 20 photos kept :")
+for per_sender in [False, True]:
+    with tempfile.TemporaryDirectory() as folder:
+        new_library(folder)
+        for number in range(20):
+            receive(f"photo-{number:02d}.jpg", f"relative{number % 4}@test-email.null")
+        for number in range(15):
+            receive(f"cousin-{number:02d}.jpg", "cousin@test-email.null")
+        apply_retention(20, 0, per_sender)
+        print(f"  per sender {str(per_sender):5} : {senders_left()}")
+
+# Size limit : photos of 1 to 10 KB, 50 KB max, biggest sender in MB first
+with tempfile.TemporaryDirectory() as folder:
+    new_library(folder)
+    for number in range(30):
+        receive(f"photo-{number:02d}.jpg", f"relative{number % 3}@test-email.null", size=1024 * (1 + number % 10))
+    with open(os.path.join(folder, 'notes.txt'), 'w') as f:
+        f.write("not a photo")
+    photo_library.set_current_photo('photo-00.jpg')
+
+    deleted = apply_retention(100, 50 * 1024, True)
+    print(f"Size limit of 50 KB : {len(deleted)} photo(s) deleted, {photo_library.library_size() // 1024} KB left, "
+          f"{senders_left()}")
+    checks = {
+        'size limit': photo_library.library_size() <= 50 * 1024,
+        'count limit': apply_retention(3, 0, True) and photo_library.photo_count() == 3,
+        'files deleted': all(not os.path.exists(os.path.join(folder, name)) for name in deleted),
+        'photo on the frame kept': photo_library.has_photo('photo-00.jpg'),
+        'other files kept': os.path.exists(os.path.join(folder, 'notes.txt')),
+        'totals per sender': sum(count for _, count, _ in photo_library.senders()) == photo_library.photo_count(),
+    }
+    apply_retention(0, 0, False)
+    checks['photo on the frame and last photo kept'] = photo_library.photo_count() == 2 \
+        and photo_library.has_photo('photo-00.jpg') and photo_library.has_photo('photo-29.jpg')
+    photo_library.set_current_photo('photo-29.jpg')
+    apply_retention(0, 0, False)
+    checks['last photo kept'] = photo_library.photo_count() == 1
+
+    for check, ok in checks.items():
+        print(f"  {'ok   ' if ok else 'WRONG'} {check}")
+    photo_library.close_library()
+
+print("End")
@@ -0,0 +1,90 @@
+"""
+Benchmark of the event loop (utils/scheduler.py) : how late timers fire, how long a button press waits before
+its action runs, the order of events posted while a long one is running, and how long a button press waits
+during a mail check (downloads and processing in the mail watcher thread, only adding the photos in the loop).
+The old loop only looked at the clock and the buttons between two waits of CHECK_INTERVAL seconds.
+
+    python -um tests.test_scheduler
+"""
+import threading
+import time
+
+from utils.constants import CHECK_INTERVAL
+from utils.scheduler import post, call_later, cancel, run
+
+DELAYS = [0.05, 0.2, 0.5, 1.0, 1.5]
+
+ran = []
+
+
+def record(name, posted_at=None):
+    ran.append((name, time.monotonic(), posted_at))
+
+
+def slow_event():
+    record('slow event start')
+    time.sleep(1)
+    record('slow event end')
+
+
+def mail_check():
+    # like check_new_mail() in app.py, in the mail watcher thread
+    record('mail check start')
+    time.sleep(1)  # downloads and photo processing
+    post(record, 'add new photos').result()
+    record('mail check end')
+
+
+threading.Thread(target=run, name='event loop', daemon=True).start()
+
+# Timers : how late after their deadline
+start = time.monotonic()
+for delay in DELAYS:
+    call_later(delay, record, f"timer {delay}s", start + delay)
+cancelled = call_later(0.3, record, 'cancelled timer')
+cancel(cancelled)
+time.sleep(max(DELAYS) + 0.2)
+late = [(at - deadline) * 1000 for name, at, deadline in ran if name.startswith('timer')]
+print(f"Timers : {len(late)} fired, {max(late):.1f} ms late at most, "
+      f"cancelled timer {'fired ?!' if any(name == 'cancelled timer' for name, _, _ in ran) else 'did not fire'}")
+
+# Button presses while idle : how long before the action runs
+ran.clear()
+for press in range(10):
+    post(record, 'button', time.monotonic()).result()
+waits = [(at - posted_at) * 1000 for _, at, posted_at in ran]
+print(f"Button press while idle : action runs {max(waits):.1f} ms after the press at most "
+      f"(old loop : up to {CHECK_INTERVAL} s)")
+
+# Button press and timer during a slow event : run after it, in order
+ran.clear()
+post(slow_event)
+time.sleep(0.1)
+call_later(0.2, record, 'rotation timer')
+time.sleep(0.3)
+post(record, 'button A').result()
+order = [name for name, _, _ in ran]
+print(f"During a 1 s event : {' -> '.join(order)}")
+print(f"  {'ok' if order == ['slow event start', 'slow event end', 'rotation timer', 'button A'] else 'WRONG'}")
+
+# Button press and timer during a 1 s mail check : they don't wait for it
+ran.clear()
+watcher = threading.Thread(target=mail_check, name='mail watcher')
+watcher.start()
+time.sleep(0.1)
+call_later(0.2, record, 'rotation timer')
+time.sleep(0.3)
+pressed_at = time.monotonic()
+post(record, 'button A').result()
+button_wait = (time.monotonic() - pressed_at) * 1000
+watcher.join()
+order = [name for name, _, _ in ran]
+print(f"During a 1 s mail check : {' -> '.join(order)}, button action runs {button_wait:.1f} ms after the press")
+expected = ['mail check start', 'rotation timer', 'button A', 'add new photos', 'mail check end']
+print(f"  {'ok' if order == expected else 'WRONG'}")
+
+# An event failing doesn't stop the loop
+failing = post(lambda: 1 / 0)
+print(f"Failing event : {failing.exception()!r}, next event runs : {post(lambda: True).result()}")
+
+print("End")
@@ -0,0 +1,73 @@
+"""
+Check that the panel is only refreshed when what it shows changes (utils/eink.py), even across restarts,
+and that forced displays (buttons) always refresh. Uses a stand-in driver that counts refreshes,
+and a temporary display state file.
+
+    python -um tests.test_skip_refresh
+"""
+import os
+import tempfile
+import time
+
+from PIL import Image
+
+import utils.eink as eink
+import utils.state_store as state_store
+from utils.eink import send_to_eink
+from utils.state_store import flush_state
+
+
+class StandInInky:
+    """ Just enough of an Inky driver for send_to_eink() """
+    resolution = (800, 480)
+    refreshes = 0
+    fail_next_show = False
+
+    def set_image(self, image):
+        self.image = image
+
+    def show(self):
+        if StandInInky.fail_next_show:
+            StandInInky.fail_next_show = False
+            raise OSError("SPI transfer failed")
+        StandInInky.refreshes += 1
+
+
+def restart_app():
+    # what a service restart forgets (the state is saved on exit)
+    flush_state()
+    eink.reset_display()
+    state_store.state = None
+
+
+def check(step, expected_refreshes, **kwargs):
+    before = StandInInky.refreshes
+    start = time.perf_counter()
+    success = send_to_eink(kwargs.pop('image', 'photo.png'), is_debug=True, **kwargs)
+    duration = (time.perf_counter() - start) * 1000
+    refreshes = StandInInky.refreshes - before
+    status = 'ok' if refreshes == expected_refreshes else 'WRONG'
+    print(f"  {step:<38} : {refreshes} refresh(es), {'success' if success else 'failure'}, {duration:.0f} ms  {status}")
+
+
+with tempfile.TemporaryDirectory() as folder:
+    eink.TMP_DOWNLOAD_FOLDER = folder
+    state_store.STATE_FILE = os.path.join(folder, 'state.json')
+    eink.auto = StandInInky
+    Image.new('RGB', StandInInky.resolution, 'white').save(os.path.join(folder, 'photo.png'))
+    Image.new('RGB', StandInInky.resolution, 'black').save(os.path.join(folder, 'other.png'))
+
+    check("first display", 1)
+    check("same photo again", 0)
+    restart_app()
+    check("same photo after a restart", 0)
+    check("same photo, forced (button)", 1, force=True)
+    check("another photo", 1, image='other.png')
+    StandInInky.fail_next_show = True
+    check("first photo, refresh fails", 0)
+    check("first photo again after the failure", 1)
+    restart_app()
+    os.remove(state_store.STATE_FILE)
+    check("restart without display state", 1)
+
+print("End")
@@ -0,0 +1,170 @@
+"""
+Benchmark of the state store (utils/state_store.py) : bytes written, files written and fsyncs for one simulated day
+of the frame (mail checks, photo rotation, button presses), for several STATE_FLUSH_INTERVAL settings,
+compared to the old way (one file per value, rewritten on every change, never synced).
+The day runs on a simulated clock, in a second or so. Files go to a temporary folder.
+
+    python -um tests.test_state_store
+"""
+import hashlib
+import heapq
+import itertools
+import json
+import os
+import tempfile
+
+import utils.mailbox as mailbox
+import utils.state_store as state_store
+from utils.eink import save_last_frame_hash
+from utils.photo_library import set_current_photo
+
+DAY = 24 * 3600
+CHECKS_PER_DAY = 98        # adaptive, with IDLE : see tests/test_mail_polling.py
+MAILS_PER_DAY = 8
+BUTTON_PRESSES_PER_DAY = 10
+ROTATION_INTERVAL = 3600
+REFRESH_TIME = 25
+FLUSH_INTERVALS = [0, 60, 300, 3600]
+
+written = {'bytes': 0, 'files': 0, 'fsyncs': 0}
+now = 0
+timers = []                # heap of (time, sequence, SimulatedTimer)
+sequence = itertools.count()
+
+
+class SimulatedTimer:
+    """ Stands for the concurrent.futures.Future returned by scheduler.call_later() """
+    def __init__(self, function, args):
+        self.function, self.args, self.cancelled = function, args, False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def simulated_call_later(delay, function, *args):
+    timer = SimulatedTimer(function, args)
+    heapq.heappush(timers, (now + delay, next(sequence), timer))
+    return timer
+
+
+def run_timers(until):
+    global now
+    while timers and timers[0][0] <= until:
+        now, _, timer = heapq.heappop(timers)
+        if not timer.cancelled:
+            timer.function(*timer.args)
+    now = until
+
+
+real_replace, real_fsync = os.replace, os.fsync
+
+
+def counting_replace(src, dst):
+    written['bytes'] += os.path.getsize(src)
+    written['files'] += 1
+    real_replace(src, dst)
+
+
+def counting_fsync(fd):
+    written['fsyncs'] += 1
+    real_fsync(fd)
+
+
+def day_of_events():
+    """
+    :return: sorted list of (time, name, argument)
+    """
+    events = [(number * DAY / CHECKS_PER_DAY, 'check', None) for number in range(CHECKS_PER_DAY)]
+    events += [(ROTATION_INTERVAL * number, 'display', f"rotation-{number}.jpg")
+               for number in range(1, DAY // ROTATION_INTERVAL)]
+    events += [(1000 + number * 7919, 'display', f"button-{number}.jpg") for number in range(BUTTON_PRESSES_PER_DAY)]
+    mail_checks = [time for time, name, _ in events if name == 'check']
+    events += [(mail_checks[number * CHECKS_PER_DAY // MAILS_PER_DAY] + 0.5, 'mail', None)
+               for number in range(MAILS_PER_DAY)]
+    return sorted(events, key=lambda event: event[0])
+
+
+def simulate_day(save_checkpoint, save_current_photo, save_frame_hash):
+    last_uid = 0
+    for time, name, argument in day_of_events():
+        run_timers(time)
+        if name == 'check':
+            save_checkpoint(last_uid)
+        elif name == 'mail':
+            # new photo : checkpoint moves on, the photo is displayed at once
+            last_uid += 1
+            save_checkpoint(last_uid)
+            save_current_photo(f"mail-{last_uid}.jpg")
+            run_timers(time + REFRESH_TIME)
+            save_frame_hash(f"{last_uid:064x}")
+        else:
+            save_current_photo(argument)
+            run_timers(time + REFRESH_TIME)
+            save_frame_hash(hashlib.sha256(argument.encode()).hexdigest())
+    run_timers(DAY)
+
+
+def old_way(folder):
+    # mailbox_state.json, current_photo.txt and display_state.json, as written before the state store
+    def save_checkpoint(last_uid):
+        with open(os.path.join(folder, 'mailbox_state.json.tmp'), 'w') as f:
+            json.dump({'uidvalidity': 1234567, 'last_uid': last_uid}, f)
+        os.replace(os.path.join(folder, 'mailbox_state.json.tmp'), os.path.join(folder, 'mailbox_state.json'))
+
+    def save_current_photo(image_name):
+        with open(os.path.join(folder, 'current_photo.txt'), 'w') as f:
+            f.write(image_name)
+        written['bytes'] += len(image_name)
+        written['files'] += 1
+
+    def save_frame_hash(new_hash):
+        with open(os.path.join(folder, 'display_state.json.tmp'), 'w') as f:
+            json.dump({'frame_hash': new_hash}, f)
+        os.replace(os.path.join(folder, 'display_state.json.tmp'), os.path.join(folder, 'display_state.json'))
+
+    simulate_day(save_checkpoint, save_current_photo, save_frame_hash)
+
+
+os.replace, os.fsync = counting_replace, counting_fsync
+state_store.call_later = simulated_call_later
+mailbox.uidvalidity = 1234567
+
+print(f"One day : {CHECKS_PER_DAY} mail checks, {MAILS_PER_DAY} new photos, {DAY // ROTATION_INTERVAL - 1} rotations, "
+      f"{BUTTON_PRESSES_PER_DAY} button presses")
+with tempfile.TemporaryDirectory() as folder:
+    old_way(folder)
+    print(f"  old way (no fsync, current_photo.txt rewritten in place) : {written['files']:4} files written, "
+          f"{written['bytes'] / 1024:5.1f} KB, {written['fsyncs']:3} fsyncs")
+
+for flush_interval in FLUSH_INTERVALS:
+    with tempfile.TemporaryDirectory() as folder:
+        state_store.STATE_FILE = os.path.join(folder, 'state.json')
+        state_store.STATE_FLUSH_INTERVAL = flush_interval
+        state_store.state, state_store.dirty, state_store.flush_timer = None, False, None
+        written.update(bytes=0, files=0, fsyncs=0)
+        now = 0
+
+        simulate_day(mailbox.save_checkpoint, set_current_photo, save_last_frame_hash)
+        with open(state_store.STATE_FILE, 'r') as f:
+            saved = json.load(f)
+        print(f"  state store, STATE_FLUSH_INTERVAL={flush_interval:<4}                 : {written['files']:4} files "
+              f"written, {written['bytes'] / 1024:5.1f} KB, {written['fsyncs']:3} fsyncs, "
+              f"end of day saved : {'ok' if saved == state_store.state else 'WRONG'}")
+
+# Power cut while saving : the state file is the previous one or the new one, never empty
+with tempfile.TemporaryDirectory() as folder:
+    state_store.STATE_FILE = os.path.join(folder, 'state.json')
+    state_store.state, state_store.dirty = None, False
+    state_store.set_state('current_photo', 'before.jpg', flush=True)
+
+    def power_cut(src, dst):
+        raise OSError("power cut")
+
+    os.replace = power_cut
+    state_store.set_state('current_photo', 'after.jpg', flush=True)
+    os.replace = counting_replace
+    with open(state_store.STATE_FILE, 'r') as f:
+        print(f"Power cut before the rename : state file has {json.load(f)}")
+
+os.replace, os.fsync = real_replace, real_fsync
+print("End")
@@ -0,0 +1,85 @@
+"""
+Save mail attachments, decoding them on the fly, chunk by chunk.
+Memory use stays the same whatever the size of the attachment.
+"""
+import base64
+import binascii
+import tempfile
+
+from utils.constants import TMP_DOWNLOAD_FOLDER
+from utils.utils import debug_log
+
+# Attachments up to this size stay in memory, bigger ones are spooled to a temp file in TMP_DOWNLOAD_FOLDER
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+
+
+def decode_chunks(chunks, encoding):
+    """
+    Decode a transfer-encoded body part, chunk by chunk.
+    Chunks can be cut anywhere : leftovers are kept for the next chunk.
+
+    :param chunks: iterable of bytes, as fetched from the server
+    :param encoding: Content-Transfer-Encoding : 'base64', 'quoted-printable', '7bit'...
+    :return: generator of decoded bytes
+    """
+    if encoding == 'base64':
+        leftover = b''
+        for chunk in chunks:
+            data = leftover + chunk.translate(None, b' \t\r\n')
+            usable = len(data) - len(data) % 4
+            leftover = data[usable:]
+            if usable:
+                yield binascii.a2b_base64(data[:usable])
+        if leftover.rstrip(b'='):
+            yield base64.b64decode(leftover + b'=' * (-len(leftover) % 4))
+
+    elif encoding == 'quoted-printable':
+        # decode line by line, so that soft line breaks and =XX sequences are never cut
+        leftover = b''
+        for chunk in chunks:
+            data = leftover + chunk
+            end = data.rfind(b'\n') + 1
+            leftover = data[end:]
+            if end:
+                yield binascii.a2b_qp(data[:end])
+        if leftover:
+            yield binascii.a2b_qp(leftover)
+
+    else:
+        yield from chunks
+
+
+def spool_attachment(chunks, encoding, max_size):
+    """
+    Decode an attachment into a file object : in memory for photos, in a temp file for huge attachments.
+    The attachment never lands in TMP_DOWNLOAD_FOLDER under its own name, it's gone once the file object is closed.
+
+    :param chunks: iterable of transfer-encoded bytes
+    :param encoding: Content-Transfer-Encoding of the attachment
+    :param max_size: maximum size of the decoded attachment, in bytes
+    :return: file object (tempfile.SpooledTemporaryFile), rewound, or False if error
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE, dir=TMP_DOWNLOAD_FOLDER)
+    try:
+        _copy_decoded(chunks, encoding, spool, max_size)
+    except ValueError as e:
+        debug_log(f"❌ Could not save attachment : {e}", 'critical')
+        spool.close()
+        return False
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return spool
+
+
+def _copy_decoded(chunks, encoding, f, max_size):
+    written = 0
+    for data in decode_chunks(chunks, encoding):
+        written += len(data)
+        if written > max_size:
+            raise ValueError(f"attachment is bigger than {max_size} bytes")
+        f.write(data)
+    return written
+
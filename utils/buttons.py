@@ -1,7 +1,8 @@
 from gpiozero import Button
-from utils.display_next import get_next_photo, delete_current_photo
-from utils.eink import send_to_eink
+from utils.display_next import get_next_photo, delete_current_photo, schedule_rotation
+from utils.display_worker import request_display, PRIORITY_DEBUG
 from utils.led import stop_blinking_led, start_blinking_led, led_on, led_off
+from utils.scheduler import post, call_later
 from utils.utils import debug_log
 
 # +--------+--------------------+------------------------------+
@@ -13,9 +14,11 @@ from utils.utils import debug_log
 # | D      | --                 | Shutdhown                    |
 # +--------+--------------------+------------------------------+    # neat ! https://ozh.github.io/ascii-tables/ :)
 #
-# Disclaimer (and room for improvement): pressing a button during the sleep time will not interrupt the sleep in app.py
-# This might lead to conflict, ie pressing a button to display next image while app is downloading a new image to display
-# ¯\_(ツ)_/¯
+# Button actions don't run in the gpiozero threads : they are posted to the event loop of the app (utils/scheduler.py),
+# and run in order with new photos being added and photo rotation, without waiting for downloads.
+
+# Seconds the first log screen stays before the second one is displayed
+LOG_SCREEN_DURATION = 30
 
 def button_not_implemented(button, action):
     debug_log(f"Button {button} : {action} not implemented", 'info')
@@ -25,29 +28,33 @@ def button_shutdown_system():
     import utils.shutdown
 
 def button_display_logs():
-    import time
-    from utils.logs import logs_to_image_first_screen, logs_to_image_second_screen
+    from utils.logs import logs_to_image_first_screen
     led_on()
     # Not too much debug logs here, as we don't want to flood the display with log messages saying we are displaying logs
     debug_log("Button C - logs", 'info')
-    send_to_eink(logs_to_image_first_screen(), is_debug=True)
-    time.sleep(30)
-    send_to_eink(logs_to_image_second_screen(), is_debug=True)
-    led_off()
+    # second screen LOG_SCREEN_DURATION seconds after the first one is displayed
+    request_display(logs_to_image_first_screen(), is_debug=True, force=True, priority=PRIORITY_DEBUG) \
+        .add_done_callback(lambda _: call_later(LOG_SCREEN_DURATION, display_logs_second_screen))
+
+def display_logs_second_screen():
+    from utils.logs import logs_to_image_second_screen
+    request_display(logs_to_image_second_screen(), is_debug=True, force=True,
+                    priority=PRIORITY_DEBUG).add_done_callback(lambda _: led_off())
     debug_log('Done displaying debug screens. Press button again to refresh', 'info')
 
 def button_display_next_image():
     debug_log("Button A - displaying next image", 'info')
     led_on()
-    send_to_eink(get_next_photo())
-    led_off()
+    # force : pressing a button always refreshes the panel, even with a single photo
+    request_display(get_next_photo(), force=True).add_done_callback(lambda _: led_off())
+    schedule_rotation()
 
 def button_delete_current():
     debug_log("Button B - deleting current and display next", 'info')
     led_on()
     delete_current_photo()
-    send_to_eink(get_next_photo())
-    led_off()
+    request_display(get_next_photo(), force=True).add_done_callback(lambda _: led_off())
+    schedule_rotation()
 
 # Define buttons with long press detection
 button_a = Button(5, hold_time=2)
@@ -55,14 +62,14 @@ button_b = Button(6, hold_time=2)
 button_c = Button(16, hold_time=2)
 button_d = Button(24, hold_time=2)
 
-button_a.when_pressed = button_display_next_image
+button_a.when_pressed = lambda: post(button_display_next_image)
 button_a.when_held = lambda: button_not_implemented('A', 'long press')
 
 button_b.when_pressed = lambda: button_not_implemented('B', 'press')
-button_b.when_held = button_delete_current
+button_b.when_held = lambda: post(button_delete_current)
 
 button_c.when_pressed = lambda: button_not_implemented('C', 'press')
-button_c.when_held = button_display_logs
+button_c.when_held = lambda: post(button_display_logs)
 
 button_d.when_pressed = lambda: button_not_implemented('D', 'press')
-button_d.when_held = button_shutdown_system
+button_d.when_held = lambda: post(button_shutdown_system)
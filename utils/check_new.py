@@ -1,96 +1,256 @@
 import imaplib
-import email
 
 from utils.utils import *
-from utils.image_manipulation import convert_image_to_jpg
+from utils.attachments import spool_attachment
+from utils.imap_response import parse_fetch_response, walk_bodystructure, envelope_sender, format_uid_set
+from utils.mailbox import get_mailbox, release_mailbox, close_mailbox, load_checkpoint, save_checkpoint
 
-from utils.constants import IMAP_SERVER, IMAP_USER, IMAP_PASSWORD, IMAP_PORT, TMP_DOWNLOAD_FOLDER
+from utils.constants import MAX_ATTACHMENT_SIZE_MB, MAX_MAIL_SIZE_MB, ALLOWED_SENDERS
 
 from utils.utils import debug_log
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.heif', '.heic')
+
+# File extension for image types, when the attachment has no filename
+IMAGE_SUBTYPE_EXTENSIONS = {
+    'jpeg': '.jpg',
+    'jpg': '.jpg',
+    'png': '.png',
+    'gif': '.gif',
+    'heic': '.heic',
+    'heif': '.heif',
+}
+
+# Smaller images are most likely logos or icons from an email signature, not photos
+MIN_IMAGE_PART_SIZE = 10 * 1024
+
+# Attachments are downloaded and decoded by chunks of XXX bytes, to keep memory use low
+FETCH_CHUNK_SIZE = 1024 * 1024
+
 
 def check_mail_and_download_attachments():
     """
-    Checks mails.
-    - Return False if no new mail or no image
-    - Returns: from_email, attachment_path
+    Checks mails, and downloads every image attachment of every unread mail.
+
+    :return: list of (from_email, filename, attachment), empty if no new mail or no image
+    """
+    return list(iter_mail_attachments())
+
+
+def iter_mail_attachments():
+    """
+    Download every image attachment of every new mail, one after the other.
+
+    Mails are identified by UID : we remember the highest UID already ingested (checkpoint) and
+    only ask for newer ones. Whatever the number of mails, searching, fetching their structure and
+    deleting them takes one command each.
 
-    :return: false, or from_email, attachment_path
+    This is a generator, so that images can be processed while the next ones are downloading.
+    Attachments are kept in memory (see spool_attachment()) : the caller must close them.
+
+    :return: generator of (from_email, filename, attachment file object)
     """
+    if not (mail := get_mailbox()):
+        return
+
+    last_uid = load_checkpoint()
+
     try:
-        mail = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
-        mail.login(IMAP_USER, IMAP_PASSWORD)
-        mail.select("INBOX")
-
-        status, response = mail.search(None, 'UNSEEN')
-        unread_msg_nums = response[0].split()
-    except imaplib.IMAP4.error as e:
-        debug_log(f"❌ Could not connect to IMAP mail server : {e}", 'critical')
-        return False
+        status, response = mail.uid('SEARCH', f"UID {last_uid + 1}:* UNSEEN")
+        if status != 'OK' or not response:
+            raise imaplib.IMAP4.error(f"SEARCH failed : {response}")
+        # "N:*" always matches the last mail, even if its UID is lower than N
+        new_uids = sorted(uid for uid in map(int, (response[0] or b'').split()) if uid > last_uid)
+    except (imaplib.IMAP4.error, OSError, ValueError) as e:
+        debug_log(f"❌ Could not search IMAP mailbox : {e}", 'critical')
+        close_mailbox()
+        return
 
-    if not unread_msg_nums:
+    if not new_uids:
         debug_log("📭 No unread mail", 'info')
-        return False
+        release_mailbox()
+        return
 
-    debug_log("📭 New mail !", 'info')
+    debug_log(f"📭 {len(new_uids)} new mail(s) !", 'info')
 
-    attachment_path = None
-    from_email = None
-    to_delete = []
+    done = []
+    number_of_attachments = 0
 
-    for msg_id in unread_msg_nums:
-        status, full_data = mail.fetch(msg_id, '(RFC822)')
+    try:
+        # Look at the headers and structure of all mails first (a few hundred bytes per mail),
+        # then download only the image parts of the mails we want
+        status, data = mail.uid('FETCH', format_uid_set(new_uids), '(UID ENVELOPE RFC822.SIZE BODYSTRUCTURE)')
         if status != 'OK':
-            continue
-
-        msg = email.message_from_bytes(full_data[0][1])
-        from_email_candidate = email.utils.parseaddr(msg.get('From'))[1]
+            raise imaplib.IMAP4.error(f"FETCH failed : {data}")
+        # Servers may add FETCH responses of their own (flags changed by another client...) : only keep
+        # the responses about the mails we asked for, merged per mail, and ignore the others
+        messages = {}
+        for message in parse_fetch_response(data):
+            if message.get('UID') in new_uids:
+                messages.setdefault(message['UID'], {}).update(message)
 
-        for part in msg.walk():
-            if part.get_content_maintype() == 'multipart':
+        for uid, message in sorted(messages.items()):
+            if 'BODYSTRUCTURE' not in message:
+                debug_log(f"❌ No structure for mail {uid}, skipped until next check", 'critical')
                 continue
-            if part.get('Content-Disposition') is None:
+            from_email = envelope_sender(message.get('ENVELOPE'))
+            image_parts = find_image_parts(message.get('BODYSTRUCTURE'))
+
+            if rejection := reject_mail(from_email, message.get('RFC822.SIZE'), image_parts):
+                debug_log(f"🚫 Mail {uid} from {from_email} rejected : {rejection}", 'info')
+                done.append(uid)
                 continue
 
-            filename = part.get_filename()
-
-            if filename:
-                filepath = os.path.join(TMP_DOWNLOAD_FOLDER, filename)
-                with open(filepath, 'wb') as f:
-                    f.write(part.get_payload(decode=True))
-                attachment_path = filepath
-                from_email = from_email_candidate
-                break
-
-        to_delete.append(msg_id)
-
-        if attachment_path:
-            break  # we found an attachment, no need to check further
-
-    # Delete all unread messages
-    for msg_id in unread_msg_nums:
-       mail.store(msg_id, '+FLAGS', '\\Deleted')
-    mail.expunge()
-    debug_log(f"{len(to_delete)} mail(s) deleted", 'info')
-
-    mail.logout()
-
-    if attachment_path:
-        # Check if the attachment is an image
-        if not attachment_path.lower().endswith(('.png', '.jpg', '.jpeg', '.gif', '.heif', '.heic')):
-            debug_log(f"❌ Unsupported attachment : {attachment_path}", 'critical')
-            return False
-
-        # If the image is not JPG, convert it to JPG
-        if not attachment_path.lower().endswith('.jpg'):
-            try:
-                attachment_path = convert_image_to_jpg(attachment_path)
-            except Exception as e:
-                debug_log(f"❌ Error converting attachment : {e}", 'critical')
-                return False
-
-        debug_log(f"📥 Attachment downloaded : {attachment_path}", 'info')
-        return from_email, attachment_path
-    else:
+            for part in image_parts:
+                # several mails can have attachments with the same name (IMG_0001.JPG...)
+                filename = f"{uid}-{part['section']}-{part['filename']}"
+                chunks = fetch_part_chunks(mail, uid, part['section'])
+                if not (attachment := spool_attachment(chunks, part['encoding'], MAX_ATTACHMENT_SIZE_MB * 1024 * 1024)):
+                    continue
+
+                debug_log(f"📥 Attachment downloaded : {filename}", 'info')
+                number_of_attachments += 1
+                yield from_email, filename, attachment
+
+            done.append(uid)
+    except (imaplib.IMAP4.error, OSError, ValueError, IndexError) as e:
+        debug_log(f"❌ IMAP error while downloading mail : {e}", 'critical')
+        close_mailbox()
+        mail = None
+
+    # Checkpoint : every mail up to this UID is done
+    checkpoint = last_uid
+    for uid in new_uids:
+        if uid not in done:
+            break
+        checkpoint = uid
+    save_checkpoint(checkpoint)
+
+    if done and mail:
+        delete_mails(mail, done)
+
+    release_mailbox()
+
+    if not number_of_attachments:
         debug_log("Mail(s) had no attachment (and all mails deleted)", 'info')
-        return False
\ No newline at end of file
+
+
+def delete_mails(mail, uids):
+    """
+    Delete mails, with one STORE for all of them, then UID EXPUNGE if the server supports it
+    (expunge only these mails), or a plain EXPUNGE otherwise.
+
+    :param mail: IMAP connection
+    :param uids: list of UIDs
+    :return: True if deleted
+    """
+    uid_set = format_uid_set(uids)
+    try:
+        mail.uid('STORE', uid_set, '+FLAGS.SILENT', '(\\Deleted)')
+        if 'UIDPLUS' in mail.capabilities:
+            mail.uid('EXPUNGE', uid_set)
+        else:
+            mail.expunge()
+        # we don't need the "* n EXPUNGE" responses, don't let them pile up on a long-lived connection
+        mail.response('EXPUNGE')
+        debug_log(f"{len(uids)} mail(s) deleted", 'info')
+        return True
+    except (imaplib.IMAP4.error, OSError) as e:
+        debug_log(f"❌ Could not delete mails : {e}", 'critical')
+        close_mailbox()
+        return False
+
+
+def reject_mail(from_email, size, image_parts):
+    """
+    Decide if a mail is worth downloading, from its headers and structure only
+
+    :param from_email: sender email
+    :param size: size of the whole mail (RFC822.SIZE), in bytes
+    :param image_parts: image parts found in the mail, see find_image_parts()
+    :return: reason for rejecting the mail, or None if it is accepted
+    """
+    if ALLOWED_SENDERS and not is_allowed_sender(from_email):
+        return "sender not in ALLOWED_SENDERS"
+    if isinstance(size, int) and size > MAX_MAIL_SIZE_MB * 1024 * 1024:
+        return f"too big ({size} bytes)"
+    if not image_parts:
+        return "no image"
+    return None
+
+
+def is_allowed_sender(from_email):
+    """
+    Is the sender in ALLOWED_SENDERS ? Entries are full emails, or @domain for a whole domain.
+
+    :param from_email: sender email
+    :return: bool
+    """
+    from_email = from_email.lower()
+    domain = '@' + from_email.rpartition('@')[2]
+    return from_email in ALLOWED_SENDERS or domain in ALLOWED_SENDERS
+
+
+def fetch_part_chunks(mail, uid, section, chunk_size=FETCH_CHUNK_SIZE):
+    """
+    Download a body part piece by piece, with partial fetches : BODY.PEEK[section]<offset.length>
+
+    :param mail: IMAP connection
+    :param uid: UID of the mail
+    :param section: section number of the part, eg "2"
+    :param chunk_size: number of bytes per fetch
+    :return: generator of (still transfer-encoded) bytes
+    """
+    offset = 0
+    while True:
+        status, data = mail.uid('FETCH', str(uid), f"(BODY.PEEK[{section}]<{offset}.{chunk_size}>)")
+        if status != 'OK':
+            raise imaplib.IMAP4.error(f"could not fetch part {section} of mail {uid}")
+
+        # the answer can hold other FETCH responses (flags changed by another client...) : find ours
+        key = f"BODY[{section}]<{offset}>"
+        answers = [message for message in parse_fetch_response(data) if message.get('UID') == uid and key in message]
+        if not answers:
+            raise imaplib.IMAP4.error(f"no part {section} of mail {uid} in the server answer")
+        chunk = answers[0][key] or b''
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        if chunk:
+            yield chunk
+        if len(chunk) < chunk_size:
+            return
+        offset += len(chunk)
+
+
+def find_image_parts(bodystructure):
+    """
+    Find the image attachments in a mail, from its BODYSTRUCTURE, without downloading anything.
+    Images that are too big, or too small to be a photo, are skipped.
+
+    :param bodystructure: parsed BODYSTRUCTURE of the mail
+    :return: list of dicts {section, type, encoding, size, filename}, in the order they appear in the mail
+    """
+    if not bodystructure:
+        return []
+
+    image_parts = []
+    for part in walk_bodystructure(bodystructure):
+        maintype, subtype = part['type'].split('/', 1)
+        filename = part['filename'] or ''
+        if maintype != 'image' and not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+
+        # base64 makes things 4/3 bigger
+        size = part['size'] * 3 // 4 if part['encoding'] == 'base64' else part['size']
+        if size > MAX_ATTACHMENT_SIZE_MB * 1024 * 1024:
+            debug_log(f"Skipping {filename or part['type']} : too big ({size} bytes)", 'info')
+            continue
+        if size < MIN_IMAGE_PART_SIZE:
+            debug_log(f"Skipping {filename or part['type']} : too small to be a photo ({size} bytes)", 'info')
+            continue
+
+        if not os.path.splitext(filename)[1]:
+            part['filename'] = f"{filename or 'attachment'}{IMAGE_SUBTYPE_EXTENSIONS.get(subtype, '.' + subtype)}"
+        image_parts.append(part)
+
+    return image_parts
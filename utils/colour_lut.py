@@ -0,0 +1,103 @@
+"""
+Colour correction of photos before they are converted to the panel palette : saturation, contrast and gamma,
+then mapping into the panel gamut (black and white of the photo become the darkest and brightest panel colours,
+so that dithering doesn't have to fight colours the panel can't show).
+
+All of this is baked in a 33x33x33 colour lookup table, built once per panel and settings, saved next to the
+frames, and applied with Pillow's Color3DLUT filter (trilinear interpolation in C) : a few milliseconds per frame.
+"""
+import hashlib
+import json
+import os
+
+import numpy as np
+from PIL import ImageFilter
+
+from utils.constants import FRAME_CACHE_FOLDER, COLOUR_SATURATION, COLOUR_CONTRAST, COLOUR_GAMMA
+from utils.utils import debug_log
+
+LUT_SIZE = 33
+
+# Rec. 601 luma, to change saturation without changing brightness
+LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+luts = {}  # {key: ImageFilter.Color3DLUT}
+
+
+def colour_settings(panel):
+    """
+    Everything the lookup table depends on
+
+    :param panel: panel dict, see utils/frame_cache.py
+    :return: list, JSON serializable
+    """
+    return [LUT_SIZE, COLOUR_SATURATION, COLOUR_CONTRAST, COLOUR_GAMMA, panel['palette']]
+
+
+def build_lut(black, white, saturation=1.0, contrast=1.0, gamma=1.0, size=LUT_SIZE):
+    """
+    Compute the colour lookup table
+
+    :param black: (r, g, b) darkest panel colour, 0 - 255
+    :param white: (r, g, b) brightest panel colour, 0 - 255
+    :param saturation: 1.0 unchanged, more is more vivid
+    :param contrast: 1.0 unchanged, more is more contrasted
+    :param gamma: 1.0 unchanged, more is brighter midtones
+    :param size: number of points per channel
+    :return: float32 array (size, size, size, 3) indexed [b][g][r], values 0 - 1, as Color3DLUT expects
+    """
+    steps = np.linspace(0, 1, size, dtype=np.float32)
+    b, g, r = np.meshgrid(steps, steps, steps, indexing='ij')
+    rgb = np.stack([r, g, b], axis=-1)
+
+    rgb = np.clip((rgb - 0.5) * contrast + 0.5, 0, 1)
+    rgb = rgb ** (1 / gamma)
+    luma = (rgb @ LUMA_WEIGHTS)[..., np.newaxis]
+    rgb = np.clip(luma + (rgb - luma) * saturation, 0, 1)
+
+    # panel gamut : the photo range is squeezed between the darkest and brightest panel colours
+    black = np.array(black, dtype=np.float32) / 255
+    white = np.array(white, dtype=np.float32) / 255
+    return (black + (white - black) * rgb).astype(np.float32)
+
+
+def get_colour_lut(panel):
+    """
+    Colour lookup table for a panel and the current settings : from memory, from disk, or built now
+
+    :param panel: panel dict, see utils/frame_cache.py
+    :return: ImageFilter.Color3DLUT
+    """
+    key = hashlib.sha256(json.dumps(colour_settings(panel)).encode()).hexdigest()[:16]
+    if key in luts:
+        return luts[key]
+
+    path = os.path.join(FRAME_CACHE_FOLDER, f"colour-lut-{key}.npy")
+    try:
+        table = np.load(path)
+    except (OSError, ValueError):
+        colours = np.array(panel['palette']).reshape(-1, 3)
+        brightness = colours.sum(axis=1)
+        table = build_lut(colours[brightness.argmin()], colours[brightness.argmax()],
+                          COLOUR_SATURATION, COLOUR_CONTRAST, COLOUR_GAMMA)
+        try:
+            with open(path + '.tmp', 'wb') as f:
+                np.save(f, table)
+            os.replace(path + '.tmp', path)
+        except OSError as e:
+            debug_log(f"Could not save colour lookup table {path} : {e}", 'critical')
+        debug_log(f"Colour lookup table built : {path}", 'info')
+
+    luts[key] = ImageFilter.Color3DLUT(LUT_SIZE, table.ravel())
+    return luts[key]
+
+
+def apply_colour_lut(image, panel):
+    """
+    Colour correct an image for a panel
+
+    :param image: image object (PIL.Image)
+    :param panel: panel dict, see utils/frame_cache.py
+    :return: image object (PIL.Image), RGB
+    """
+    return image.convert('RGB').filter(get_colour_lut(panel))
@@ -7,6 +7,9 @@ IMAP_SERVER = os.getenv("IMAP_SERVER")
 IMAP_PORT = int(os.getenv("IMAP_PORT", 993))
 IMAP_USER = os.getenv("IMAP_USER")
 IMAP_PASSWORD = os.getenv("IMAP_PASSWORD")
+IMAP_SSL = (os.getenv("IMAP_SSL", "True").lower() == 'true')
+IMAP_KEEPALIVE = (os.getenv("IMAP_KEEPALIVE", "True").lower() == 'true')
+IMAP_RECONNECT_MAX_DELAY = int(os.getenv("IMAP_RECONNECT_MAX_DELAY", 900))  # in seconds
 SMTP_SERVER = os.getenv("SMTP_SERVER")
 SMTP_PORT = int(os.getenv("SMTP_PORT"))
 SMTP_USER = os.getenv("SMTP_USER")
@@ -20,8 +23,30 @@ EMAIL_OWNER_BODY = os.getenv("EMAIL_OWNER_BODY")
 
 DEBUG = (os.getenv("DEBUG").lower() == 'true')
 NUMBER_OF_PHOTOS_TO_KEEP = int(os.getenv("NUMBER_OF_PHOTOS_TO_KEEP", 5))
+PHOTOS_MAX_SIZE_MB = int(os.getenv("PHOTOS_MAX_SIZE_MB", 0))  # 0 : no limit
+RETENTION_PER_SENDER = (os.getenv("RETENTION_PER_SENDER", "False").lower() == 'true')
 DISPLAY_PHOTO_INTERVAL = int(os.getenv("DISPLAY_PHOTO_INTERVAL", 3600))  # in seconds
-CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", 10))  # in seconds
+CHECK_INTERVAL = int(os.getenv("CHECK_INTERVAL", 60))  # in seconds, during a burst of photos
+# Quiet mailbox : with IMAP_KEEPALIVE the server tells us about new mail, checks are only a safety net
+CHECK_INTERVAL_MAX = max(CHECK_INTERVAL, int(os.getenv("CHECK_INTERVAL_MAX", 1800 if IMAP_KEEPALIVE else 300)))
+MAIL_BURST_DURATION = int(os.getenv("MAIL_BURST_DURATION", 120))  # in seconds
+STATE_FLUSH_INTERVAL = int(os.getenv("STATE_FLUSH_INTERVAL", 300))  # in seconds
+MAX_ATTACHMENT_SIZE_MB = int(os.getenv("MAX_ATTACHMENT_SIZE_MB", 30))
+MAX_MAIL_SIZE_MB = int(os.getenv("MAX_MAIL_SIZE_MB", 100))
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", min(4, os.cpu_count() or 1)))
+IMAGE_MEMORY_BUDGET_MB = int(os.getenv("IMAGE_MEMORY_BUDGET_MB", 256))
+IMAGE_JOB_TIMEOUT = int(os.getenv("IMAGE_JOB_TIMEOUT", 120))  # in seconds
+PANEL_RESOLUTION = tuple(int(x) for x in os.getenv("PANEL_RESOLUTION", "").lower().split('x')) if os.getenv("PANEL_RESOLUTION") else None
+PANEL_ROTATION = int(os.getenv("PANEL_ROTATION", 0)) % 360  # in degrees, multiple of 90
+INKY_SATURATION = float(os.getenv("INKY_SATURATION", 0.5))
+INKY_DITHER = os.getenv("INKY_DITHER", "floyd-steinberg").lower()
+COLOUR_SATURATION = float(os.getenv("COLOUR_SATURATION", 1.2))
+COLOUR_CONTRAST = float(os.getenv("COLOUR_CONTRAST", 1.1))
+COLOUR_GAMMA = float(os.getenv("COLOUR_GAMMA", 1.0))
+DISPLAY_BACKEND = os.getenv("DISPLAY_BACKEND", "inky").lower()  # inky | headless
+HEADLESS_REFRESH_TIME = float(os.getenv("HEADLESS_REFRESH_TIME", 25))  # in seconds
+HEADLESS_FRAMES_FOLDER = os.getenv("HEADLESS_FRAMES_FOLDER", "")
+ALLOWED_SENDERS = [sender.strip().lower() for sender in os.getenv("ALLOWED_SENDERS", "").split(',') if sender.strip()]
 
 SHUTDOWN_MESSAGE_LINE1= os.getenv("SHUTDOWN_MESSAGE_LINE1")
 SHUTDOWN_MESSAGE_LINE2= os.getenv("SHUTDOWN_MESSAGE_LINE2")
@@ -33,4 +58,11 @@ MAX_BLINKS = 200
 # File parameters
 TMP_DOWNLOAD_FOLDER = "./temp_download"
 OUTPUT_FOLDER = "./photos"
+FRAME_CACHE_FOLDER = "./frames"
+PHOTO_LIBRARY = "./photo_library.db"
+STATE_FILE = "./state.json"
+# Files of previous versions, imported once in PHOTO_LIBRARY and STATE_FILE
 CURRENT_PHOTO = "./current_photo.txt"
+PHOTO_INDEX = "./photo_index.json"
+MAILBOX_STATE = "./mailbox_state.json"
+DISPLAY_STATE = "./display_state.json"
@@ -1,24 +1,23 @@
+import pathlib
 import shutil
-from utils.constants import CURRENT_PHOTO, OUTPUT_FOLDER
-from utils.eink import send_to_eink
+from utils.constants import OUTPUT_FOLDER, DISPLAY_PHOTO_INTERVAL
+from utils.display_worker import request_display
+from utils.frame_cache import prune_frames
+import utils.photo_library as photo_library
+from utils.scheduler import call_later, cancel
 from utils.utils import *
 from utils.utils import debug_log
 
 
 def get_current_photo():
     """
-    Get current photo name from current_photo.txt
+    Get the name of the photo on the frame, from the photo library
 
-    :return: string
+    :return: string, or None
     """
-    try:
-        with open(CURRENT_PHOTO, 'r') as f:
-            image_path = f.read().strip()
-            debug_log(f"Current photo: {image_path}", 'info')
-            return image_path
-    except FileNotFoundError:
-        debug_log(f"Could not open or read {CURRENT_PHOTO}", 'critical')
-        return None
+    image_name = photo_library.get_current_photo()
+    debug_log(f"Current photo: {image_name}", 'info')
+    return image_name
 
 
 def delete_current_photo():
@@ -29,51 +28,71 @@ def delete_current_photo():
     """
     current_photo = get_current_photo()
     if current_photo:
-        try:
-            os.remove(os.path.join(OUTPUT_FOLDER, current_photo))
-            debug_log(f"Deleted current photo: {current_photo}", 'info')
-        except Exception as e:
-            debug_log(f"Error deleting current photo: {e}", 'critical')
+        if photo_library.delete_photo(current_photo):
+            prune_frames()
     else:
         debug_log("No current photo to delete.", 'info')
 
 
+def add_sample_photo():
+    """
+    Copy /assets/samples/sample_photo.jpg to OUTPUT_FOLDER, when there is no photo at all
+    """
+    sample_photo = pathlib.Path(__file__).parent.parent / 'assets' / 'samples' / 'sample_photo.jpg'
+    if not sample_photo.exists():
+        debug_log("No photo found in the photo folder. Get one sent by email !", 'critical')
+        exit_program(1)
+
+    debug_log(f"No photos found. Copying sample photo from {sample_photo} to {OUTPUT_FOLDER}", 'critical')
+    shutil.copy(sample_photo, OUTPUT_FOLDER)
+    photo_library.add_photo(sample_photo.name)
+
+
 def get_next_photo():
     """
-    Return next photo filename
+    Return next photo filename : the one received after the current one, or the oldest one after the newest
 
     :return: string: filename of the next photo to display
     """
+    if not photo_library.photo_count():
+        add_sample_photo()
+    return photo_library.next_photo(get_current_photo())
 
-    photos_folder = pathlib.Path(OUTPUT_FOLDER)
-    photos = [os.path.basename(x) for x in photos_folder.glob('*.jpg')]
-
-    if not photos:
-        # Copy /assets/samples/sample_photo.jpg to OUTPUT_FOLDER
-        sample_photo = pathlib.Path(__file__).parent.parent / 'assets' / 'samples' / 'sample_photo.jpg'
-        if sample_photo.exists():
-            debug_log(f"No photos found. Copying sample photo from {sample_photo} to {OUTPUT_FOLDER}", 'critical')
-            shutil.copy(sample_photo, OUTPUT_FOLDER)
-            photos = [os.path.basename(sample_photo)]
-        else:
-            debug_log("No photo found in the photo folder. Get one sent by email !", 'critical')
-            exit_program(1)
-
-    if current_photo := get_current_photo():
-        try:
-            current_index = photos.index(current_photo)
-            next_index = (current_index + 1) % len(list(photos_folder.glob('*.jpg')))
-        except ValueError:
-            debug_log("Current image not found in the photos folder.", 'info')
-            next_index = 0
-    else:
-        next_index = 0
 
-    return photos[next_index]
+def get_previous_photo():
+    """
+    Return previous photo filename : the one received before the current one, or the newest one before the oldest
+
+    :return: string: filename of the previous photo to display
+    """
+    if not photo_library.photo_count():
+        add_sample_photo()
+    return photo_library.previous_photo(get_current_photo())
 
 
 def display_next_image():
     next_image = get_next_photo()
     debug_log(f"Next image to display: {next_image}", 'info')
-    send_to_eink(next_image)
+    return request_display(next_image)
+
+
+rotation_timer = None  # next display_next_image(), see schedule_rotation()
+
+
+def schedule_rotation(delay=DISPLAY_PHOTO_INTERVAL):
+    """
+    Display the next photo in `delay` seconds, and every DISPLAY_PHOTO_INTERVAL seconds after that.
+    Called again each time a photo is displayed : the new photo stays DISPLAY_PHOTO_INTERVAL seconds.
+
+    :param delay: seconds
+    """
+    global rotation_timer
+    cancel(rotation_timer)
+    rotation_timer = call_later(delay, rotate_photo)
+
+
+def rotate_photo():
+    debug_log("Displaying next image", 'info')
+    display_next_image()
+    schedule_rotation()
 
@@ -0,0 +1,97 @@
+"""
+Display worker : one thread owns the panel and displays what it's asked to, one refresh at a time.
+The main loop, the buttons and the shutdown screen queue display requests instead of waiting for the refresh.
+
+    job = request_display('2025-01-01-120000.jpg')      # returns at once
+    job.add_done_callback(lambda job: led_off())        # called when displayed, with job.result() True or False
+    job.result()                                        # or wait for the refresh
+
+While a refresh is running, requests pile up : only the latest one of each priority is kept, the others
+are answered with the result of the request that replaced them. Pressing "next" three times during a refresh
+gives one more refresh, not three. Shutdown and debug screens go before photos, and nothing goes after
+the shutdown screen.
+"""
+import concurrent.futures
+import threading
+
+from utils.eink import send_to_eink
+from utils.photo_library import set_current_photo
+from utils.utils import debug_log
+
+# Display requests, most important last
+PRIORITY_PHOTO = 0
+PRIORITY_DEBUG = 1
+PRIORITY_SHUTDOWN = 2
+
+pending = {}                      # {priority: (args of send_to_eink(), [futures])}, latest request only
+condition = threading.Condition()
+worker = None                     # display thread, started on first request
+shutting_down = False             # shutdown screen requested : no more displays
+requests_dropped = 0              # replaced by a later request, or dropped for the shutdown screen : never displayed
+
+
+def request_display(image_filename, is_debug=False, force=False, priority=PRIORITY_PHOTO):
+    """
+    Queue a display, see send_to_eink() for the parameters
+
+    :param image_filename: filename of the image to display
+    :param is_debug: if True, image is in TMP_DOWNLOAD_FOLDER, and is not the current photo
+    :param force: if True, refresh the panel even if it already shows this image
+    :param priority: PRIORITY_PHOTO, PRIORITY_DEBUG or PRIORITY_SHUTDOWN
+    :return: concurrent.futures.Future, result True if displayed, False if error or dropped
+    """
+    global worker, shutting_down, requests_dropped
+
+    future = concurrent.futures.Future()
+    dropped = []
+
+    with condition:
+        if shutting_down:
+            debug_log(f"Shutting down, not displaying {image_filename}", 'info')
+            future.set_result(False)
+            return future
+
+        # The photo about to be displayed is the current one : "next" counts from it, "delete" deletes it
+        if not is_debug:
+            set_current_photo(image_filename)
+
+        futures = [future]
+        if priority in pending:
+            (replaced, _, replaced_force), futures = pending[priority]
+            debug_log(f"⏭️ Display of {replaced} replaced by {image_filename}", 'info')
+            futures.append(future)
+            force = force or replaced_force
+            requests_dropped += 1
+        pending[priority] = ((image_filename, is_debug, force), futures)
+
+        if priority == PRIORITY_SHUTDOWN:
+            shutting_down = True
+            for other_priority in [p for p in pending if p != PRIORITY_SHUTDOWN]:
+                dropped += pending.pop(other_priority)[1]
+                requests_dropped += 1
+
+        if worker is None:
+            worker = threading.Thread(target=_display_loop, name='display', daemon=True)
+            worker.start()
+        condition.notify()
+
+    # outside of the lock : callbacks may request another display
+    for dropped_future in dropped:
+        dropped_future.set_result(False)
+    return future
+
+
+def _display_loop():
+    while True:
+        with condition:
+            while not pending:
+                condition.wait()
+            args, futures = pending.pop(max(pending))
+
+        try:
+            success = send_to_eink(*args)
+        except Exception as e:
+            debug_log(f"❌ Error displaying {args[0]} : {e!r}", 'critical')
+            success = False
+        for future in futures:
+            future.set_result(success)
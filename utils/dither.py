@@ -0,0 +1,133 @@
+"""
+Convert an RGB image to the few colours of the eink panel, with NumPy.
+
+Modes :
+    - floyd-steinberg : Pillow's error diffusion, what Inky does. Best looking, reference for the others
+    - diffusion       : error diffusion, one whole row at a time : the error of a row is spread on the next
+                        row only (below left, below, below right), so each row is a single vectorized step.
+                        Only a reference for tests/test_dither.py : slower than Pillow's floyd-steinberg
+                        (a Python loop over the rows) and worse looking (no error spread along the row)
+    - bayer           : ordered dithering with an 8x8 Bayer matrix, fully vectorized, fastest dithering
+    - nearest         : nearest colour, no dithering : flat areas, visible banding
+"""
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageFilter
+
+DITHER_MODES = ('floyd-steinberg', 'diffusion', 'bayer', 'nearest')
+
+# How far (in RGB units) the Bayer threshold moves colours : the palette of the panel is sparse, the spread is wide.
+# Tuned on Inky palettes with tests/test_dither.py
+BAYER_SPREAD = 224
+
+# Nearest colours are looked up in a table of 32x32x32 RGB values (5 bits per channel), built once per palette
+LOOKUP_BITS = 5
+
+# Error of a row spread on the next row : below left, below, below right
+ROW_DIFFUSION_WEIGHTS = (0.25, 0.5, 0.25)
+
+
+def _bayer_matrix(size):
+    matrix = np.zeros((1, 1), dtype=np.float32)
+    while matrix.shape[0] < size:
+        matrix = np.block([[4 * matrix, 4 * matrix + 2], [4 * matrix + 3, 4 * matrix + 1]])
+    return matrix / (size * size)
+
+
+BAYER_MATRIX = _bayer_matrix(8)
+
+
+def dither_image(image, palette, mode='floyd-steinberg'):
+    """
+    Convert an image to a palette image
+
+    :param image: image object (PIL.Image)
+    :param palette: flat list of the panel colours [r, g, b, r, g, b...]
+    :param mode: one of DITHER_MODES
+    :return: image object (PIL.Image), mode "P", with only the panel colours in its palette
+    """
+    if mode not in DITHER_MODES:
+        raise ValueError(f"Unknown dither mode '{mode}', should be one of {DITHER_MODES}")
+
+    if mode == 'floyd-steinberg':
+        palette_image = Image.new('P', (1, 1))
+        palette_image.putpalette(palette)
+        return image.convert('RGB').quantize(palette=palette_image, dither=Image.Dither.FLOYDSTEINBERG)
+
+    colours = np.array(palette, dtype=np.float32).reshape(-1, 3)
+    pixels = np.asarray(image.convert('RGB'))
+
+    if mode == 'nearest':
+        indices = nearest_colour(pixels, palette)
+    elif mode == 'bayer':
+        height, width = pixels.shape[:2]
+        threshold = np.tile(BAYER_MATRIX, (height // 8 + 1, width // 8 + 1))[:height, :width] - 0.5
+        indices = nearest_colour(pixels + threshold[..., np.newaxis] * BAYER_SPREAD, palette)
+    else:
+        indices = _row_diffusion(pixels.astype(np.float32), colours, palette)
+
+    frame = Image.fromarray(indices, mode='P')
+    frame.putpalette(palette)
+    return frame
+
+
+def nearest_colour(pixels, palette):
+    """
+    Index of the nearest palette colour of each pixel
+
+    :param pixels: array (..., 3) of RGB values, out of range values are clipped
+    :param palette: flat list of the panel colours [r, g, b, r, g, b...]
+    :return: uint8 array (...)
+    """
+    shift = 8 - LOOKUP_BITS
+    if pixels.dtype != np.uint8:
+        pixels = np.clip(pixels, 0, 255).astype(np.uint8)
+    pixels = pixels >> shift
+    return _lookup_table(tuple(palette))[pixels[..., 0], pixels[..., 1], pixels[..., 2]]
+
+
+@lru_cache(maxsize=4)
+def _lookup_table(palette):
+    # nearest colour (euclidean distance in RGB) of the center of each cell of the table
+    size = 1 << LOOKUP_BITS
+    cell = 256 // size
+    values = np.arange(size, dtype=np.float32) * cell + cell / 2
+    grid = np.stack(np.meshgrid(values, values, values, indexing='ij'), axis=-1)
+    colours = np.array(palette, dtype=np.float32).reshape(-1, 3)
+    distances = ((grid[..., np.newaxis, :] - colours) ** 2).sum(axis=-1)
+    return distances.argmin(axis=-1).astype(np.uint8)
+
+
+def _row_diffusion(pixels, colours, palette):
+    # reference only, see the module docstring : use floyd-steinberg on the frame
+    height, width = pixels.shape[:2]
+    left, below, right = ROW_DIFFUSION_WEIGHTS
+    indices = np.empty((height, width), dtype=np.uint8)
+    error = np.zeros((width, 3), dtype=np.float32)
+
+    for y in range(height):
+        row = pixels[y] + error
+        indices[y] = nearest_colour(row, palette)
+        row_error = row - colours[indices[y]]
+
+        error = below * row_error
+        error[:-1] += left * row_error[1:]
+        error[1:] += right * row_error[:-1]
+
+    return indices
+
+
+def dither_error(image, frame, blur_radius=1.5):
+    """
+    How far a dithered frame looks from the original image, seen from a distance : RMSE between both images
+    once slightly blurred (the eye averages neighbouring dots). Lower is better.
+
+    :param image: original image object (PIL.Image)
+    :param frame: dithered image object (PIL.Image), same size
+    :param blur_radius: Gaussian blur radius, in pixels
+    :return: float, in RGB units (0 - 255)
+    """
+    blurred_image = np.asarray(image.convert('RGB').filter(ImageFilter.GaussianBlur(blur_radius)), dtype=np.float32)
+    blurred_frame = np.asarray(frame.convert('RGB').filter(ImageFilter.GaussianBlur(blur_radius)), dtype=np.float32)
+    return float(np.sqrt(((blurred_image - blurred_frame) ** 2).mean()))
@@ -1,25 +1,129 @@
+"""
+Pimoroni e-ink display.
+
+The Inky driver is detected once (EEPROM read over I2C, GPIO and SPI setup), on the first display,
+and reused for the life of the app. If displaying fails, the driver is dropped and detected again next time.
+One display at a time : buttons, the main loop and the shutdown screen share the same driver.
+
+Any object with the interface of the Inky drivers (resolution, set_image(), show()) can stand for the panel :
+DISPLAY_BACKEND=headless uses utils/headless_display.py, for tests and benchmarks without a Raspberry Pi.
+
+A full refresh takes tens of seconds and flickers : the hash of the last frame sent to the panel is saved,
+and a frame identical to what the panel already shows is not sent again (even after a restart), unless forced.
+"""
+import hashlib
+import json
 import os
 import sys
-from PIL import Image
-from utils.constants import OUTPUT_FOLDER, TMP_DOWNLOAD_FOLDER
-from utils.utils import debug_log, write_photo_name
+import threading
+import time
+from PIL import Image, ImageOps
+from utils.constants import OUTPUT_FOLDER, TMP_DOWNLOAD_FOLDER, DISPLAY_BACKEND
+from utils.frame_cache import remember_panel, get_frame
+from utils.headless_display import HeadlessInky
+from utils.photo_library import photo_displayed
+from utils.state_store import get_state, set_state
+from utils.utils import debug_log
 
 if sys.platform != "win32":
-    from inky.auto import auto
+    try:
+        from inky.auto import auto
+    except ImportError:
+        auto = None  # no Inky library : headless display only
 else:
     # On windows, we will use tkinter to display the image
     from tkinter import *
     from PIL import ImageTk, Image
 
-def send_to_eink(image_filename, is_debug=False):
+display = None  # Inky driver (or headless display), see get_display()
+lock = threading.RLock()
+
+
+def create_display():
+    """
+    Create the display driver chosen with DISPLAY_BACKEND
+
+    :return: Inky driver, or HeadlessInky (raises if no display could be detected)
+    """
+    if DISPLAY_BACKEND == 'headless':
+        return HeadlessInky()
+    if auto is None:
+        raise RuntimeError("Inky library not installed (pip install inky), or set DISPLAY_BACKEND=headless")
+    return auto()
+
+
+def get_display():
+    """
+    Return the display driver, detecting the display if not done yet
+
+    :return: Inky driver, or HeadlessInky (raises if no display could be detected)
+    """
+    global display
+
+    with lock:
+        if display is None:
+            start = time.perf_counter()
+            display = create_display()
+            debug_log(f"Inky {type(display).__name__} {display.resolution} detected "
+                      f"in {(time.perf_counter() - start) * 1000:.0f} ms", 'info')
+        return display
+
+
+def reset_display():
+    """
+    Forget the Inky driver : the display is detected again on the next get_display()
+    """
+    global display
+
+    with lock:
+        display = None
+
+def frame_hash(inky, image):
+    """
+    Hash of what the panel would show : panel model and resolution, and every pixel of the image
+
+    :param inky: Inky driver
+    :param image: image object (PIL.Image), as given to inky.set_image()
+    :return: string
+    """
+    key = hashlib.sha256()
+    key.update(json.dumps([type(inky).__name__, list(inky.resolution), image.mode, list(image.size)]).encode())
+    if image.mode == 'P':
+        key.update(bytes(image.getpalette() or []))
+    key.update(image.tobytes())
+    return key.hexdigest()
+
+
+def load_last_frame_hash():
+    """
+    Hash of the frame on the panel : the panel keeps its image when the app (or the Pi) restarts
+
+    :return: string, or None if unknown
+    """
+    return get_state('frame_hash')
+
+
+def save_last_frame_hash(new_hash):
+    """
+    Remember the hash of the frame on the panel, see utils/state_store.py
+
+    :param new_hash: string, or None if what the panel shows is unknown (failed refresh)
+    """
+    # unknown : saved now, an old hash could skip the refresh that would fix the panel
+    set_state('frame_hash', new_hash, flush=new_hash is None)
+
+
+def send_to_eink(image_filename, is_debug=False, force=False):
     """
     Display image on the Pimoroni e-ink
     Use basename of the image in the OUTPUT_FOLDER
 
     :param image_filename: filename of the image to display
-    :param is_debug: if True, use temp DOWNLOAD_FOLDER instead of OUTPUT_FOLDER for temp image, and do not write photo name
-    :return: False if error, True if success
+    :param is_debug: if True, use temp DOWNLOAD_FOLDER instead of OUTPUT_FOLDER for temp image
+    :param force: if True, refresh the panel even if it already shows this image
+    :return: False if error, True if success (including when the panel already showed the image)
     """
+    start = time.perf_counter()
 
     if is_debug:
         image_filename = TMP_DOWNLOAD_FOLDER + "/" + image_filename
@@ -30,11 +134,13 @@ def send_to_eink(image_filename, is_debug=False):
         debug_log(f"error : file {image_filename} does not exist", 'info')
         return False
 
-    if not is_debug:
-        write_photo_name(image_filename)
+    with lock:
+        return _display_image(image_filename, is_debug, force, start)
+
 
+def _display_image(image_filename, is_debug, force, start):
     try:
-        inky = auto()
+        inky = get_display()
     except Exception as e:
         if sys.platform == "win32":
             try:
@@ -47,15 +153,32 @@ def send_to_eink(image_filename, is_debug=False):
         debug_log(f"Could not initialize Inky : {e}", "critical")
         return False
 
-    image = Image.open(image_filename)
-    resizedimage = image.resize(inky.resolution)
-
     try:
-        inky.set_image(resizedimage)
+        # Photos : panel-ready frame from the cache. Debug screens : converted by Inky
+        if not is_debug and (panel := remember_panel(inky)):
+            image = get_frame(os.path.basename(image_filename), panel)
+        else:
+            image = Image.open(image_filename)
+            if image.size != inky.resolution:
+                image = ImageOps.fit(image, inky.resolution, Image.LANCZOS)
+
+        new_hash = frame_hash(inky, image)
+        if new_hash == load_last_frame_hash() and not force:
+            debug_log(f"⏭️ Panel already shows {image_filename}, no refresh", 'info')
+            return True
+
+        inky.set_image(image)
+        debug_log(f"⏱️ Refresh starting {(time.perf_counter() - start) * 1000:.0f} ms after display request", 'info')
         inky.show()
+        save_last_frame_hash(new_hash)
+        if not is_debug:
+            photo_displayed(os.path.basename(image_filename))
         debug_log(f"Displaying : {image_filename}", 'info')
     except Exception as e:
         debug_log(f"Could not display {image_filename} : {e}", "critical")
+        # driver in an unknown state (SPI error, busy pin timeout...) : start afresh next time
+        reset_display()
+        save_last_frame_hash(None)
         return False
 
     return True
@@ -0,0 +1,196 @@
+"""
+Cache of panel-ready frames : each photo, already resized to the panel resolution and converted to the panel
+palette (mode "P"). Inky skips its own palette conversion for "P" images, which is the slow part of a refresh
+on the Pi : displaying a cached photo is then just loading a small PNG.
+
+A frame is valid for one photo (SHA-256 of the photo file), one panel model and one set of conversion
+settings (saturation, colour correction, dither) : the file name holds a hash of all of them. Frames are evicted in step with
+the photo library (no frame is kept for a deleted photo), then least recently used first.
+"""
+import hashlib
+import json
+import os
+import pathlib
+
+from PIL import Image, ImageOps
+
+from utils.constants import OUTPUT_FOLDER, FRAME_CACHE_FOLDER, INKY_SATURATION, INKY_DITHER, NUMBER_OF_PHOTOS_TO_KEEP, \
+    PANEL_ROTATION
+from utils.colour_lut import apply_colour_lut, colour_settings
+from utils.dither import dither_image
+from utils.utils import debug_log
+
+# Dithering used to convert photos to the panel palette, see utils/dither.py
+FRAME_DITHER = INKY_DITHER
+
+# Frames are PNG : small, and decoded in a few milliseconds
+FRAME_EXTENSION = '.png'
+
+# Last panel seen, to prepare frames when new photos arrive, without initialising the panel
+PANEL_FILE = os.path.join(FRAME_CACHE_FOLDER, 'panel.json')
+
+panel = None  # {'model': str, 'resolution': [width, height], 'palette': [r, g, b, r, g, b...]}
+
+
+def remember_panel(inky):
+    """
+    Describe the panel from an Inky driver, and save it for the next time
+
+    :param inky: Inky driver
+    :return: panel dict, or None if the panel has no colour palette (black and white displays)
+    """
+    global panel
+
+    if not hasattr(inky, '_palette_blend'):
+        return None
+
+    new_panel = {
+        'model': type(inky).__name__,
+        'resolution': list(inky.resolution),
+        'palette': list(inky._palette_blend(INKY_SATURATION)),
+    }
+    if new_panel != load_panel():
+        panel = new_panel
+        try:
+            with open(PANEL_FILE + '.tmp', 'w') as f:
+                json.dump(panel, f)
+            os.replace(PANEL_FILE + '.tmp', PANEL_FILE)
+        except OSError as e:
+            debug_log(f"Could not save panel description to {PANEL_FILE} : {e}", 'critical')
+    return panel
+
+
+def load_panel():
+    """
+    Panel last seen by remember_panel()
+
+    :return: panel dict, or None if no panel was ever seen
+    """
+    global panel
+
+    if panel is None:
+        try:
+            with open(PANEL_FILE, 'r') as f:
+                panel = json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+    return panel
+
+
+def frame_path(image_name, panel):
+    """
+    Path of the cached frame of a photo, for a panel and the current settings
+
+    :param image_name: file name of the photo in OUTPUT_FOLDER
+    :param panel: panel dict
+    :return: path of the frame file (that may not exist yet)
+    """
+    key = hashlib.sha256()
+    with open(os.path.join(OUTPUT_FOLDER, image_name), 'rb') as f:
+        while chunk := f.read(1024 * 1024):
+            key.update(chunk)
+    settings = [panel['model'], panel['resolution'], PANEL_ROTATION, INKY_SATURATION, colour_settings(panel), FRAME_DITHER]
+    key.update(json.dumps(settings).encode())
+
+    stem = os.path.splitext(image_name)[0]
+    return os.path.join(FRAME_CACHE_FOLDER, f"{stem}-{key.hexdigest()[:16]}{FRAME_EXTENSION}")
+
+
+def render_frame(image, panel):
+    """
+    Convert an image to a panel-ready frame : rotation for portrait frames, colour correction, dithering.
+    Photos are already at the right size (see get_target_size()), no resampling here.
+
+    :param image: image object (PIL.Image)
+    :param panel: panel dict
+    :return: image object (PIL.Image), mode "P", at panel resolution
+    """
+    if PANEL_ROTATION:
+        # multiples of 90° : lossless transpose
+        image = image.rotate(PANEL_ROTATION, expand=True)
+
+    resolution = tuple(panel['resolution'])
+    if image.size != resolution:
+        # photo processed before this panel was detected : fill the panel, don't stretch the photo
+        debug_log(f"Photo is {image.size}, panel is {resolution} : resizing", 'info')
+        image = ImageOps.fit(image, resolution, Image.LANCZOS)
+    image = apply_colour_lut(image, panel)
+
+    # Only the panel colours in the palette : every pixel gets a colour index the panel knows
+    return dither_image(image, panel['palette'], FRAME_DITHER)
+
+
+def get_frame(image_name, panel):
+    """
+    Panel-ready frame of a photo : from the cache, or rendered and cached now
+
+    :param image_name: file name of the photo in OUTPUT_FOLDER
+    :param panel: panel dict
+    :return: image object (PIL.Image), mode "P", at panel resolution
+    """
+    path = frame_path(image_name, panel)
+
+    try:
+        with Image.open(path) as frame:
+            frame.load()
+        # least recently used frames are evicted first
+        os.utime(path)
+        debug_log(f"Frame cache hit : {path}", 'info')
+        return frame
+    except (FileNotFoundError, OSError, ValueError):
+        pass
+
+    debug_log(f"Frame cache miss : {image_name}", 'info')
+    with Image.open(os.path.join(OUTPUT_FOLDER, image_name)) as image:
+        frame = render_frame(image, panel)
+    save_frame(frame, path)
+    prune_frames()
+    return frame
+
+
+def save_frame(frame, path):
+    tmp_path = path + '.tmp'
+    try:
+        frame.save(tmp_path, format='PNG', compress_level=1)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        debug_log(f"Could not save frame {path} : {e}", 'critical')
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def prepare_frame(image_name):
+    """
+    Render the frame of a new photo now, so that displaying it later is quick.
+    Nothing to do if no panel was ever seen (first start) : the frame is rendered on first display.
+
+    :param image_name: file name of the photo in OUTPUT_FOLDER
+    :return: True if the frame is ready
+    """
+    if not (panel := load_panel()):
+        return False
+    try:
+        get_frame(image_name, panel)
+    except (OSError, ValueError) as e:
+        debug_log(f"Could not prepare frame of {image_name} : {e}", 'critical')
+        return False
+    return True
+
+
+def prune_frames():
+    """
+    Delete frames of photos that are gone, then least recently used frames above NUMBER_OF_PHOTOS_TO_KEEP
+    """
+    frames_folder = pathlib.Path(FRAME_CACHE_FOLDER)
+    photos = {os.path.splitext(name)[0] for name in os.listdir(OUTPUT_FOLDER)}
+
+    frames = []
+    for frame in frames_folder.glob('*' + FRAME_EXTENSION):
+        if frame.stem.rpartition('-')[0] in photos:
+            frames.append(frame)
+        else:
+            frame.unlink(missing_ok=True)
+
+    frames.sort(key=lambda f: f.stat().st_mtime, reverse=True)
+    for frame in frames[NUMBER_OF_PHOTOS_TO_KEEP:]:
+        frame.unlink(missing_ok=True)
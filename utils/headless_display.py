@@ -0,0 +1,105 @@
+"""
+Headless display : behaves like an Inky Impression 7.3" (Spectra 6 colours, 800x480) without any hardware,
+to test and benchmark the display path on any computer (DISPLAY_BACKEND=headless in .env).
+
+Like the real panel, it converts images to its palette, refuses images of the wrong size,
+and is busy for HEADLESS_REFRESH_TIME seconds during each refresh. Every frame shown is recorded :
+saved in HEADLESS_FRAMES_FOLDER, or kept in memory (the latest RECORDED_FRAMES_IN_MEMORY ones).
+"""
+import collections
+import os
+import threading
+import time
+
+from PIL import Image
+
+from utils.constants import HEADLESS_REFRESH_TIME, HEADLESS_FRAMES_FOLDER, PANEL_RESOLUTION
+from utils.utils import debug_log
+
+RECORDED_FRAMES_IN_MEMORY = 100
+
+# Colours of the Spectra 6 panel (inky_e673.py) : vivid, and what the panel really shows
+SATURATED_PALETTE = [(0, 0, 0), (161, 164, 165), (208, 190, 71), (156, 72, 75), (61, 59, 94), (58, 91, 70)]
+DESATURATED_PALETTE = [(0, 0, 0), (255, 255, 255), (255, 255, 0), (255, 0, 0), (0, 0, 255), (0, 255, 0)]
+
+
+class HeadlessInky:
+    """ Same interface as the Inky drivers used by utils/eink.py : resolution, set_image(), show() """
+
+    def __init__(self, refresh_time=None, frames_folder=None, resolution=None):
+        """
+        :param refresh_time: seconds per refresh, default HEADLESS_REFRESH_TIME
+        :param frames_folder: where to save frames shown, default HEADLESS_FRAMES_FOLDER ('' : in memory)
+        :param resolution: (width, height), default PANEL_RESOLUTION or 800x480
+        """
+        self.refresh_time = HEADLESS_REFRESH_TIME if refresh_time is None else refresh_time
+        self.frames_folder = HEADLESS_FRAMES_FOLDER if frames_folder is None else frames_folder
+        self.resolution = tuple(resolution or PANEL_RESOLUTION or (800, 480))
+        self.width, self.height = self.resolution
+
+        self.image = None            # set, not shown yet
+        self.frames = collections.deque(maxlen=RECORDED_FRAMES_IN_MEMORY)  # (refresh start, refresh end, image)
+        self.refreshes = 0
+        self.busy_time = 0.0         # seconds spent refreshing
+        self.frames_dropped = 0      # set but replaced before being shown
+        self.busy = threading.Event()
+
+        if self.frames_folder:
+            os.makedirs(self.frames_folder, exist_ok=True)
+
+    def _palette_blend(self, saturation, dtype='uint8'):
+        palette = []
+        for saturated, desaturated in zip(SATURATED_PALETTE, DESATURATED_PALETTE):
+            palette += [int(s * saturation + d * (1.0 - saturation)) for s, d in zip(saturated, desaturated)]
+        return palette
+
+    def set_image(self, image, saturation=0.5):
+        """
+        Copy an image to the display buffer, converted to the panel colours if needed
+
+        :param image: image object (PIL.Image), at the panel resolution
+        :param saturation: from 0.0 to 1.0, for images that are not converted yet (not mode "P")
+        """
+        if image.size != self.resolution:
+            raise ValueError(f"Image must be ({self.width}x{self.height}) pixels!")
+        if image.mode != 'P':
+            palette_image = Image.new('P', (1, 1))
+            palette_image.putpalette(self._palette_blend(saturation))
+            image = image.convert('RGB').quantize(palette=palette_image, dither=Image.Dither.FLOYDSTEINBERG)
+
+        if self.image is not None:
+            self.frames_dropped += 1
+        self.image = image.copy()
+
+    def show(self):
+        """
+        Refresh the panel with the display buffer : blocks for refresh_time seconds
+        """
+        if self.image is None:
+            raise RuntimeError("Nothing to show, call set_image() first")
+
+        self.busy.set()
+        start = time.monotonic()
+        try:
+            time.sleep(self.refresh_time)
+        finally:
+            end = time.monotonic()
+            self.busy.clear()
+
+        image, self.image = self.image, None
+        self.refreshes += 1
+        self.busy_time += end - start
+        self.frames.append((start, end, image))
+        if self.frames_folder:
+            image.save(os.path.join(self.frames_folder, f"frame-{self.refreshes:05d}.png"))
+        debug_log(f"🖼️ Headless refresh #{self.refreshes} ({end - start:.1f}s)", 'info')
+
+    def stats(self):
+        """
+        :return: dict of counters : refreshes, busy_time (seconds), frames_dropped (set but not shown, or display
+                 requests replaced by a later one in the display worker before reaching the panel)
+        """
+        # not imported at the top : the display worker imports this module, through utils/eink.py
+        from utils import display_worker
+        return {'refreshes': self.refreshes, 'busy_time': self.busy_time,
+                'frames_dropped': self.frames_dropped + display_worker.requests_dropped}
@@ -1,94 +1,181 @@
 # Image manipulation
 import math
 import os
+import tempfile
 from pillow_heif import HeifImagePlugin
 
 from PIL import Image, ImageOps
-from utils.utils import debug_log, delete_all_but_latest_XXX, rename_file_with_timestamp
-from utils.constants import OUTPUT_FOLDER
+from utils.utils import debug_log, timestamped_name
+from utils.constants import OUTPUT_FOLDER, TMP_DOWNLOAD_FOLDER, PANEL_RESOLUTION, PANEL_ROTATION, \
+    IMAGE_MEMORY_BUDGET_MB, IMAGE_WORKERS
+from utils.frame_cache import load_panel
 
+# Size of the processed images, when the panel was never detected and PANEL_RESOLUTION is not set
+TARGET_SIZE = (800, 480)
 
-def fix_image_orientation(path):
+# Tall photo cropped to a wide frame : keep more of the top than of the bottom (that's where faces usually are)
+TALL_PHOTO_CROP_TOP = 1 / 3
+
+# Memory a photo may use while it's decoded : the budget is shared by the workers processing photos at the same time
+MEMORY_BUDGET_PER_IMAGE = IMAGE_MEMORY_BUDGET_MB * 1024 * 1024 // IMAGE_WORKERS
+
+# EXIF orientations where the image is stored rotated by 90°
+EXIF_ORIENTATION = 0x0112
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)
+
+
+def open_image_for_size(path, size=TARGET_SIZE, memory_budget=None):
     """
-    Fix the orientation of an image based on its EXIF data.
-    :param path:  Path to the image file.
-    :return:  image object (PIL.Image)
+    Open an image, asking the decoder for the smallest version that still covers `size` once rotated
+    according to its EXIF data : JPEG are decoded at 1/2, 1/4 or 1/8 scale (libjpeg DCT scaling),
+    HEIC use their embedded thumbnail when it is big enough. Other formats are decoded at full size.
+    A 12 MP phone photo is then decoded at 1/4 scale, which is much faster and uses much less memory.
+
+    Nothing is decoded yet : if decoding would need more than `memory_budget`, the image is rejected now.
+
+    :param path: Path to the image file, or binary file object
+    :param size: (width, height) the image will be resized to
+    :param memory_budget: max memory for the decoded image, in bytes. Default MEMORY_BUDGET_PER_IMAGE
+    :return: image object (PIL.Image), not decoded yet
+    :raise Image.DecompressionBombError: if the image is too big for the memory budget
     """
-    pil = Image.open(path)
-    pil = ImageOps.exif_transpose(pil)
-    return pil
-
+    memory_budget = memory_budget or MEMORY_BUDGET_PER_IMAGE
+    image = Image.open(path)
+    width, height = size
+    orientation = exif_orientation(image)
+    if orientation in ROTATED_ORIENTATIONS:
+        width, height = height, width
+    if image.draft('RGB', (width, height)):
+        debug_log(f"Reduced decode : {image.size}", 'info')
+
+    # decoded image, plus its rotated copy and its RGB copy if needed (see fix_image_orientation())
+    needed = decoded_size(image) * (2 if orientation != 1 else 1)
+    if image.mode not in ('RGB', 'L'):
+        needed += image.size[0] * image.size[1] * 4
+    if needed > memory_budget:
+        image.close()
+        raise Image.DecompressionBombError(f"{image.size[0]}x{image.size[1]} image would need {needed // 2**20} MB "
+                                           f"to decode, memory budget is {memory_budget // 2**20} MB")
+    return image
+
+
+def exif_orientation(image):
+    """
+    EXIF orientation of an image, from the EXIF data found in its header, without decoding it
+    (image.getexif() decodes the whole image for PNG)
 
-def resize_and_crop_image(image: Image) -> Image:
+    :param image: image object (PIL.Image), just opened
+    :return: int, 1 (not rotated) to 8
     """
-    Resize the image to a width of 800 pixels
+    exif = Image.Exif()
+    if 'exif' in image.info:
+        exif.load(image.info['exif'])
+    return exif.get(EXIF_ORIENTATION, 1)
 
-    :param image: an image object (PIL.Image)
-    :return:  a resized and cropped image object
+
+def decoded_size(image):
     """
-    new_width = 800
-    ratio = new_width / image.width
-    new_height = int(image.height * ratio)
-    resized = image.resize((new_width, new_height), Image.LANCZOS)
-    debug_log(f"Redimension : {resized.size}", 'info')
+    Memory used by an image once decoded : Pillow stores pixels on 1 byte (L, P, 1), 2 bytes (I;16) or 4 bytes
 
-    top = max(0, (resized.height - 480) // 2)
-    cropped = resized.crop((0, top, 800, top + 480))
-    debug_log(f"Crop : {cropped.size}", 'info')
-    return cropped
+    :param image: image object (PIL.Image)
+    :return: bytes
+    """
+    if image.mode in ('1', 'L', 'P'):
+        bytes_per_pixel = 1
+    elif image.mode.startswith('I;16'):
+        bytes_per_pixel = 2
+    else:
+        bytes_per_pixel = 4
+    return image.size[0] * image.size[1] * bytes_per_pixel
 
 
-def convert_image_to_jpg(input_path='', preserve_original=False):
+def get_target_size():
     """
-    Convert an image to JPG format if it is not already in that format.
+    Size of the processed images, as seen by the viewer : resolution of the panel (detected, or PANEL_RESOLUTION),
+    width and height swapped if the panel is mounted in portrait (PANEL_ROTATION 90 or 270)
 
-    :param input_path: Path to the image file
-    :param preserve_original: If True, the original file will not be deleted after conversion.
-    :return: Path to the converted JPG file.
+    :return: (width, height)
     """
-    if not os.path.isfile(input_path):
-        raise FileNotFoundError(f"File not found: {input_path}")
+    if panel := load_panel():
+        width, height = panel['resolution']
+    elif PANEL_RESOLUTION:
+        width, height = PANEL_RESOLUTION
+    else:
+        width, height = TARGET_SIZE
 
-    # lower case ext
-    ext = os.path.splitext(input_path)[1].lower()
-    output_path = os.path.splitext(input_path)[0] + ".jpg"
+    if PANEL_ROTATION in (90, 270):
+        width, height = height, width
+    return width, height
 
-    if ext in ['.png', '.jpg', '.jpeg', '.heic', '.heif', '.webp', ]:
-        with Image.open(input_path) as img:
-            rgb_img = img.convert("RGB")
-            rgb_img.save(output_path, format="JPEG")
-    else:
-        raise ValueError(f"Unsupported file format: {ext}")
 
-    debug_log(f"JPG conversion: {input_path} -> {output_path}", 'info')
-    # delete original file unless stated otherwise
-    if not preserve_original:
-        os.remove(input_path)
-    return output_path
+def fix_image_orientation(path, size=TARGET_SIZE):
+    """
+    Fix the orientation of an image based on its EXIF data.
+    :param path:  Path to the image file, or binary file object
+    :param size:  (width, height) the image will be resized to, see open_image_for_size()
+    :return:  image object (PIL.Image)
+    """
+    pil = open_image_for_size(path, size)
+    # in place : no copy of the whole image when it's not rotated
+    ImageOps.exif_transpose(pil, in_place=True)
+    if pil.mode not in ('RGB', 'L'):
+        # palette (GIF, some PNG), transparency, CMYK... : resize and JPG need RGB
+        pil = pil.convert('RGB')
+    return pil
 
 
-def process_new_image(image_path):
+def resize_and_crop_image(image: Image, size=TARGET_SIZE) -> Image:
     """
-    Process a new image :
-        - fix orientation
-        - resize & crop
-        - return new image name
+    Resize the image to fill `size`, cropping what's outside, with a single resample :
+    the crop box is given to the resize, whatever the orientation of the photo and of the frame
 
-    :param image_path: path to the image file
-    :return: image file name
+    :param image: an image object (PIL.Image)
+    :param size: (width, height)
+    :return:  a resized and cropped image object
+    """
+    width, height = size
+    scale = max(width / image.width, height / image.height)
+    crop_width, crop_height = width / scale, height / scale
+
+    left = (image.width - crop_width) / 2
+    top = (image.height - crop_height) * (TALL_PHOTO_CROP_TOP if image.height > image.width else 0.5)
+    box = (left, top, left + crop_width, top + crop_height)
+
+    resized = image.resize(size, Image.LANCZOS, box=box)
+    debug_log(f"Redimension and crop : {image.size} -> {resized.size}, box {tuple(round(x) for x in box)}", 'info')
+    return resized
+
+
+def render_new_image(image, size=TARGET_SIZE):
     """
+    Resize & crop an image, and save it once, as JPG, to a temp file.
+    Safe to run in several processes at once : each image gets its own temp file.
 
-    image_path = rename_file_with_timestamp(image_path)
+    :param image: image object (PIL.Image)
+    :param size: (width, height), see get_target_size()
+    :return: path of the temp file
+    """
+    image = resize_and_crop_image(image, size)
 
-    image = fix_image_orientation(image_path)
-    image = resize_and_crop_image(image)
+    fd, tmp_path = tempfile.mkstemp(prefix='processed-', suffix='.jpg', dir=TMP_DOWNLOAD_FOLDER)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            image.convert('RGB').save(f, format='JPEG')
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+    return tmp_path
 
-    # Save the processed image to the output folder, delete original image
-    image_name = os.path.basename(image_path)
-    image.save(f"{OUTPUT_FOLDER}/{image_name}")
-    os.remove(image_path)
 
-    # Keep only XXX most recent images
-    delete_all_but_latest_XXX(OUTPUT_FOLDER)
+def publish_new_image(tmp_path):
+    """
+    Move a rendered image to the output folder, as YYYY-MM-DD-HHMMSS.jpg.
+    Renaming is atomic : a power cut leaves either no photo or a complete photo, never half a photo.
 
+    :param tmp_path: path returned by render_new_image()
+    :return: image file name
+    """
+    image_name = timestamped_name(OUTPUT_FOLDER, '.jpg')
+    os.replace(tmp_path, os.path.join(OUTPUT_FOLDER, image_name))
+    debug_log(f"Image saved : {image_name}", 'info')
     return image_name
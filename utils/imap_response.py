@@ -0,0 +1,205 @@
+"""
+Parse IMAP FETCH responses, as returned by imaplib : BODYSTRUCTURE, ENVELOPE, BODY[section]...
+so that we can look at the structure of a mail before downloading anything big.
+"""
+import email.header
+import email.utils
+import os
+import re
+
+_OPEN = object()
+_CLOSE = object()
+_LITERAL_MARKER = re.compile(rb'\{(\d+)\}\s*$')
+
+
+def parse_fetch_response(data):
+    """
+    Parse the data returned by imaplib's fetch() into one dict per message.
+
+        [(b'1 (UID 7 BODY[2] {5}', b'hello'), b')'] -> [{'SEQ': 1, 'UID': 7, 'BODY[2]': b'hello'}]
+
+    Quoted strings become str, literals stay bytes, numbers become int and NIL becomes None.
+
+    :param data: list returned by imaplib (bytes, or tuples of (bytes, literal))
+    :return: list of dicts
+    :raise ValueError: if the response is truncated or malformed (unterminated quoted string)
+    """
+    tokens = []
+    for element in data:
+        if isinstance(element, tuple):
+            text, literal = element
+            tokens += _tokenize(_LITERAL_MARKER.sub(b'', text))
+            tokens.append(literal)
+        elif isinstance(element, bytes):
+            tokens += _tokenize(element)
+
+    values = _parse_values(iter(tokens))
+    messages = []
+    for seq, items in zip(values[0::2], values[1::2]):
+        message = {'SEQ': seq}
+        message.update(zip(items[0::2], items[1::2]))
+        messages.append(message)
+    return messages
+
+
+def _tokenize(text):
+    tokens = []
+    i = 0
+    while i < len(text):
+        char = text[i:i + 1]
+        if char in b' \r\n':
+            i += 1
+        elif char == b'(':
+            tokens.append(_OPEN)
+            i += 1
+        elif char == b')':
+            tokens.append(_CLOSE)
+            i += 1
+        elif char == b'"':
+            value = bytearray()
+            i += 1
+            while i < len(text) and text[i:i + 1] != b'"':
+                if text[i:i + 1] == b'\\':
+                    i += 1
+                value += text[i:i + 1]
+                i += 1
+            if i >= len(text):
+                raise ValueError(f"Unterminated quoted string in IMAP response : {text[:80]!r}")
+            tokens.append(value.decode('utf-8', errors='replace'))
+            i += 1
+        else:
+            # atom, eg NIL, 123, BODY[HEADER.FIELDS (FROM)]<0>
+            start = i
+            depth = 0
+            while i < len(text) and (depth or text[i:i + 1] not in b' ()\r\n'):
+                depth += {b'[': 1, b']': -1}.get(text[i:i + 1], 0)
+                i += 1
+            atom = text[start:i].decode('ascii', errors='replace')
+            tokens.append(None if atom.upper() == 'NIL' else int(atom) if atom.isdigit() else atom)
+    return tokens
+
+
+def _parse_values(tokens):
+    values = []
+    for token in tokens:
+        if token is _OPEN:
+            values.append(_parse_values(tokens))
+        elif token is _CLOSE:
+            return values
+        else:
+            values.append(token)
+    return values
+
+
+def format_uid_set(uids):
+    """
+    Compact IMAP set of UIDs, to act on many messages with a single command
+
+        [1, 2, 3, 5, 8, 9] -> "1:3,5,8:9"
+
+    :param uids: iterable of int
+    :return: string
+    """
+    ranges = []
+    for uid in sorted(set(uids)):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ','.join(str(start) if start == end else f"{start}:{end}" for start, end in ranges)
+
+
+def _text(value):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='replace')
+    return value
+
+
+def envelope_sender(envelope):
+    """
+    Email address of the sender, from an ENVELOPE structure
+
+    :param envelope: parsed ENVELOPE (date, subject, from, sender, reply-to, to, ...)
+    :return: string, eg 'joe@domain.com', or '' if unknown
+    """
+    try:
+        _name, _adl, mailbox, host = envelope[2][0]
+        return f"{_text(mailbox)}@{_text(host)}"
+    except (TypeError, IndexError, ValueError):
+        return ''
+
+
+def walk_bodystructure(structure, section=''):
+    """
+    Yield every leaf part of a BODYSTRUCTURE, with its section number (as used in BODY[section]),
+    including parts of attached (forwarded) messages.
+
+    :param structure: parsed BODYSTRUCTURE
+    :param section: section number of `structure`, '' for the whole message
+    :return: generator of dicts {section, type, encoding, size, filename}
+    """
+    if isinstance(structure[0], list):
+        # multipart : (part1)(part2)... "mixed" ...
+        for index, part in enumerate(structure[:_count_leading_lists(structure)], start=1):
+            yield from walk_bodystructure(part, f"{section}.{index}" if section else str(index))
+        return
+
+    section = section or '1'
+    maintype, subtype = _text(structure[0]).lower(), _text(structure[1]).lower()
+
+    if (maintype, subtype) == ('message', 'rfc822') and len(structure) > 8 and isinstance(structure[8], list):
+        # attached message : its parts are numbered section.1, section.2...
+        nested = structure[8]
+        if isinstance(nested[0], list):
+            yield from walk_bodystructure(nested, section)
+        else:
+            yield from walk_bodystructure(nested, f"{section}.1")
+        return
+
+    yield {
+        'section': section,
+        'type': f"{maintype}/{subtype}",
+        'encoding': (_text(structure[5]) or '7bit').lower(),
+        'size': structure[6] if isinstance(structure[6], int) else 0,
+        'filename': _part_filename(structure, maintype),
+    }
+
+
+def _count_leading_lists(structure):
+    count = 0
+    for element in structure:
+        if not isinstance(element, list):
+            break
+        count += 1
+    return count
+
+
+def _part_filename(structure, maintype):
+    """
+    Filename of a body part : Content-Disposition "filename" parameter, or Content-Type "name" parameter
+    """
+    # extension data starts after md5, which comes after "lines" for text parts
+    disposition_index = 9 if maintype == 'text' else 8
+    candidates = []
+    if len(structure) > disposition_index and isinstance(structure[disposition_index], list):
+        candidates.append(structure[disposition_index][1] if len(structure[disposition_index]) > 1 else None)
+    candidates.append(structure[2])
+
+    for params in candidates:
+        if not isinstance(params, list):
+            continue
+        params = dict(zip([_text(key).lower() for key in params[0::2]], params[1::2]))
+        for key in ('filename', 'name', 'filename*', 'name*'):
+            if params.get(key):
+                return _decode_filename(_text(params[key]), rfc2231=key.endswith('*'))
+    return None
+
+
+def _decode_filename(filename, rfc2231=False):
+    if rfc2231:
+        filename = email.utils.collapse_rfc2231_value(email.utils.decode_rfc2231(filename))
+    else:
+        filename = str(email.header.make_header(email.header.decode_header(filename)))
+    # never trust a path coming from an email
+    return os.path.basename(filename.replace('\\', '/'))
+
@@ -0,0 +1,252 @@
+"""
+Ingest new photos : download every image from every unread mail, and process them
+while the next ones are still downloading (producer / consumer, with a bounded queue).
+
+Each photo goes from the mail to the photos folder in one pass : downloaded in memory,
+decoded once, resized and cropped, then written once.
+
+Decoding and resizing run in the worker processes (see utils/workers.py), several photos at once.
+Workers get the attachments as temp files : the bytes of the jobs waiting for a worker don't stay in memory.
+Duplicate detection and the photo index stay in the main process. A file we already have is not sent to
+the workers at all, and a worker stops before resizing a photo that looks like one we have.
+
+The app runs it in two steps : process_new_mail() in the mail watcher thread (downloads and workers,
+seconds to minutes), then add_new_photos() in the event loop (library and retention, a few milliseconds),
+and prepare_frames() back in the mail watcher thread.
+"""
+import concurrent.futures
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+
+from utils.check_new import iter_mail_attachments, IMAGE_EXTENSIONS
+from utils.constants import TMP_DOWNLOAD_FOLDER
+from utils.frame_cache import prepare_frame
+from utils.image_manipulation import fix_image_orientation, render_new_image, publish_new_image, get_target_size
+from utils.mailbox import close_mailbox
+from utils.photo_index import image_dhash, find_duplicate, add_photo, is_near_duplicate
+from utils.photo_library import capture_time, move_to_end, has_photo, photo_by_sha256, dhashes
+from utils.retention import apply_retention
+from utils.utils import debug_log
+from utils.workers import submit, result
+
+# Max number of downloaded images waiting to be processed
+INGEST_QUEUE_SIZE = 4
+
+_DONE = None
+
+
+def process_new_mail():
+    """
+    Download and process all new photos, without adding them to the photos yet (see add_new_photos()).
+    Downloads run in a thread, processing in the workers : the calling thread only waits.
+
+    :return: list of (sender_email, filename, processed image), in the order mails were received
+    """
+    downloads = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+    stop = threading.Event()
+    downloader = threading.Thread(target=_download_attachments, args=(downloads, stop), name='downloader',
+                                  daemon=True)
+    downloader.start()
+
+    # Start processing each photo as soon as it's downloaded...
+    jobs = []
+    item = None
+    try:
+        while (item := downloads.get()) is not _DONE:
+            sender_email, filename, attachment = item
+            with attachment:
+                if job := submit_new_image(filename, attachment):
+                    jobs.append((sender_email, filename, job))
+    finally:
+        if item is not _DONE:
+            # Error while processing : the downloader may be waiting for room in the queue, with the mailbox
+            stop.set()
+            while (item := downloads.get()) is not _DONE:
+                item[2].close()
+        downloader.join()
+
+    # ... and wait for all of them
+    return [(sender_email, filename, processed) for sender_email, filename, job in jobs
+            if (processed := wait_new_image(filename, job))]
+
+
+def add_new_photos(processed_images):
+    """
+    Add processed images to the photos, in the order mails were received, then apply retention
+
+    :param processed_images: list returned by process_new_mail()
+    :return: list of (sender_email, image_name) of the new photos still there after retention
+    """
+    new_photos = []
+    for sender_email, filename, processed in processed_images:
+        if image_name := add_new_image(filename, processed, sender_email):
+            new_photos.append((sender_email, image_name))
+    # more new photos than NUMBER_OF_PHOTOS_TO_KEEP : the first ones are already gone
+    apply_retention()
+    new_photos = [(sender_email, image_name) for sender_email, image_name in new_photos if has_photo(image_name)]
+
+    debug_log(f"📷 {len(new_photos)} new photo(s)", 'info')
+    return new_photos
+
+
+def _download_attachments(downloads, stop):
+    """
+    Producer : put every downloaded attachment in the queue, then _DONE
+
+    :param downloads: queue.Queue
+    :param stop: threading.Event, set if the consumer gave up : stop downloading
+    """
+    attachments = iter_mail_attachments()
+    try:
+        for item in attachments:
+            if stop.is_set():
+                item[2].close()
+                break
+            downloads.put(item)
+    except Exception as e:
+        debug_log(f"❌ Error downloading attachments : {e}", 'critical')
+    finally:
+        if stop.is_set():
+            # No checkpoint, no mail deleted : the mails are downloaded again at the next check
+            attachments.close()
+            close_mailbox()
+        downloads.put(_DONE)
+
+
+def submit_new_image(filename, attachment):
+    """
+    Start processing an attachment in a worker process
+
+    :param filename: file name of the attachment
+    :param attachment: binary file object with the attachment
+    :return: job (concurrent.futures.Future), or False if the attachment is not an image
+    """
+    # Check if the attachment is an image
+    if not filename.lower().endswith(IMAGE_EXTENSIONS):
+        debug_log(f"❌ Unsupported attachment : {filename}", 'critical')
+        return False
+
+    path, sha256 = save_for_worker(attachment)
+
+    # Same file sent again : no need for a worker, add_new_image() brings the photo we have back to the front
+    if known := photo_by_sha256(sha256):
+        os.remove(path)
+        job = concurrent.futures.Future()
+        job.set_result((known[1], None, None))
+        return job
+
+    try:
+        job = submit(process_attachment, path, get_target_size(), sha256, dhashes())
+    except BaseException:
+        os.remove(path)
+        raise
+    # deleted by the worker, or by wait_new_image() if the worker never got to it
+    job.attachment_path = path
+    return job
+
+
+def save_for_worker(attachment):
+    """
+    Copy an attachment to a temp file in TMP_DOWNLOAD_FOLDER, chunk by chunk : only its path goes to the worker
+
+    :param attachment: binary file object with the attachment
+    :return: (path of the temp file, SHA-256 of the attachment)
+    """
+    digest = hashlib.sha256()
+    fd, path = tempfile.mkstemp(prefix='attachment-', dir=TMP_DOWNLOAD_FOLDER)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while chunk := attachment.read(1024 * 1024):
+                digest.update(chunk)
+                f.write(chunk)
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, digest.hexdigest()
+
+
+def process_attachment(path, size, sha256, known_dhashes=()):
+    """
+    In a worker process : decode an attachment once, at the smallest size that fits the frame,
+    fingerprint it, then resize, crop and save it to a temp file.
+    A near duplicate of a photo we have is not resized nor saved.
+
+    :param path: temp file with the attachment, see save_for_worker(). Deleted once processed
+    :param size: (width, height) of the processed image
+    :param sha256: SHA-256 of the attachment
+    :param known_dhashes: dHash of the photos we have, see photo_library.dhashes()
+    :return: (fingerprint dict, capture time or None, path of the temp file or None if near duplicate)
+    """
+    try:
+        image = fix_image_orientation(path, size)
+        fingerprint = {'sha256': sha256, 'dhash': image_dhash(image)}
+        if is_near_duplicate(fingerprint['dhash'], known_dhashes):
+            return fingerprint, None, None
+        return fingerprint, capture_time(image), render_new_image(image, size)
+    finally:
+        os.remove(path)
+
+
+def wait_new_image(filename, job):
+    """
+    Wait for the worker processing an attachment
+
+    :param filename: file name of the attachment
+    :param job: job returned by submit_new_image()
+    :return: what process_attachment() returned, or None if error
+    """
+    try:
+        return result(job)
+    except Exception as e:
+        debug_log(f"❌ Error processing attachment {filename} : {e!r}", 'critical')
+        # the worker was killed (timeout), or never started the job
+        if os.path.exists(job.attachment_path):
+            os.remove(job.attachment_path)
+        return None
+
+
+def add_new_image(filename, processed, sender_email=None):
+    """
+    Add a processed attachment to the photos, unless it's a photo we already have
+
+    :param filename: file name of the attachment
+    :param processed: what process_attachment() returned
+    :param sender_email: email of the sender, or None if unknown
+    :return: image file name, or None if not added
+    """
+    fingerprint, captured_at, tmp_path = processed
+
+    # Same photo sent again ? Don't keep it, just bring the one we have back to the front
+    if duplicate := find_duplicate(fingerprint):
+        debug_log(f"♻️ {filename} is a duplicate of {duplicate}", 'info')
+        if tmp_path:
+            os.remove(tmp_path)
+        # newest photo : kept longer, and displayed now
+        move_to_end(duplicate)
+        return duplicate
+
+    if not tmp_path:
+        # not processed, as a duplicate of a photo deleted since (button, retention)
+        debug_log(f"❌ {filename} was a duplicate of a photo deleted since, not added", 'critical')
+        return None
+
+    image_name = publish_new_image(tmp_path)
+    add_photo(image_name, fingerprint, sender_email, captured_at)
+    return image_name
+
+
+def prepare_frames(image_names):
+    """
+    Convert new photos to the panel palette now, in the workers, while nobody is waiting for the screen
+
+    :param image_names: file names of the photos in OUTPUT_FOLDER
+    """
+    jobs = [submit(prepare_frame, image_name) for image_name in dict.fromkeys(image_names)]
+    for job in jobs:
+        try:
+            result(job)
+        except Exception as e:
+            debug_log(f"❌ Error preparing frame : {e!r}", 'critical')
@@ -1,3 +1,9 @@
+"""
+LED of the frame, driven by one long-lived thread that plays patterns : on, off, blink, error code.
+Anyone (main loop, buttons, display worker) asks for a pattern, the LED thread is the only one touching the LED.
+Between two changes of the LED, the thread sleeps until the next change or the next pattern : no polling.
+"""
+import queue
 import sys
 import threading
 import time
@@ -17,41 +23,103 @@ if sys.platform != "win32":
                               config={led: gpiod.LineSettings(direction=Direction.OUTPUT, bias=Bias.DISABLED)})
 
 
-stop_event = threading.Event() # Global event to control the blinking thread
-blink_thread = None            # thread ref
-blinks_iteration = 0           # count number of blinks in the current thread
+# Blinking : on for XXX seconds, off for XXX seconds
+BLINK_ON = 0.3
+BLINK_OFF = 1
+# Error code N : N short flashes, then a pause, again and again
+ERROR_FLASH_ON = 0.2
+ERROR_FLASH_OFF = 0.4
+ERROR_PAUSE = 2
 
-def led_on():
-    if sys.platform != "win32":
-        gpio.set_value(led, Value.ACTIVE)
-    else:
-        print("O", end=' ')
+# Error codes
+ERROR_MAILBOX = 2
 
-def led_off():
+patterns = queue.Queue()  # (steps, threading.Event set when the pattern has started)
+controller = None         # LED thread, started on first pattern
+lock = threading.Lock()
+
+
+def _set_led(on):
     if sys.platform != "win32":
-        gpio.set_value(led, Value.INACTIVE)
+        gpio.set_value(led, Value.ACTIVE if on else Value.INACTIVE)
     else:
-        print(".", end=' ')
+        print("O" if on else ".", end=' ')
+
+
+def _solid(on):
+    yield on, None
+
+
+def _blink():
+    # The idea is to stop blinking after a long time, to avoid letting the LED on forever
+    for _ in range(MAX_BLINKS):
+        yield True, BLINK_ON
+        yield False, BLINK_OFF
+    yield False, None
+
+
+def _error_code(code):
+    while True:
+        for _ in range(code):
+            yield True, ERROR_FLASH_ON
+            yield False, ERROR_FLASH_OFF
+        yield False, ERROR_PAUSE
 
-def blink_led():
-    global blinks_iteration
-    while not stop_event.is_set() and blinks_iteration <= MAX_BLINKS :
-        blinks_iteration+= 1
-        led_on()
-        time.sleep(0.3)
-        led_off()
-        time.sleep(1)
+
+def _control_led():
+    steps = _solid(False)
+    deadline = None
+    while True:
+        timeout = None if deadline is None else max(0, deadline - time.monotonic())
+        try:
+            steps, started = patterns.get(timeout=timeout)
+            deadline = time.monotonic()
+        except queue.Empty:
+            started = None
+
+        on, duration = next(steps)
+        _set_led(on)
+        if started is not None:
+            started.set()
+        # next change at a fixed pace from the previous one : no drift
+        deadline = None if duration is None else deadline + duration
+
+
+def play(steps, wait=False):
+    """
+    Play a pattern on the LED, instead of the current one
+
+    :param steps: iterator of (on, duration) : LED on or off, for duration seconds (None : until the next pattern)
+    :param wait: if True, return once the LED has changed
+    """
+    global controller
+
+    with lock:
+        if controller is None:
+            controller = threading.Thread(target=_control_led, name='led', daemon=True)
+            controller.start()
+    started = threading.Event()
+    patterns.put((steps, started))
+    if wait:
+        started.wait(timeout=1)
+
+
+def led_on():
+    play(_solid(True), wait=True)
+
+def led_off():
+    play(_solid(False), wait=True)
 
 def start_blinking_led():
-    global blink_thread
-    stop_event.clear()
-    blink_thread = threading.Thread(target=blink_led)
-    blink_thread.start()
+    play(_blink())
 
 def stop_blinking_led():
-    global blinks_iteration
-    blinks_iteration = 0
-    stop_event.set()
-    if blink_thread is not None:
-        blink_thread.join()
+    play(_solid(False), wait=True)
+
+def show_error_code(code):
+    """
+    Blink an error code until the next pattern
 
+    :param code: number of flashes, see ERROR_XXX
+    """
+    play(_error_code(code))
@@ -0,0 +1,285 @@
+"""
+Persistent IMAP session
+
+One authenticated connection is kept open for the whole life of the app, instead of
+a full TLS handshake + login on every check. New mail is announced by the server
+with IMAP IDLE (or noticed with NOOP polling if the server doesn't support IDLE).
+If the connection drops, we reconnect, waiting longer and longer between attempts.
+
+Mail checks are frequent right after a photo arrives (CHECK_INTERVAL, for MAIL_BURST_DURATION seconds),
+then less and less frequent while the mailbox stays quiet (up to CHECK_INTERVAL_MAX), see next_check_interval().
+"""
+import imaplib
+import select
+import ssl
+import time
+
+from utils.constants import IMAP_SERVER, IMAP_PORT, IMAP_USER, IMAP_PASSWORD, IMAP_SSL, IMAP_KEEPALIVE, \
+    IMAP_RECONNECT_MAX_DELAY, CHECK_INTERVAL, CHECK_INTERVAL_MAX, MAIL_BURST_DURATION
+from utils.state_store import get_state, set_state, flush_state
+from utils.utils import debug_log
+
+# RFC 2177 : clients should re-issue IDLE at least every 29 minutes
+IDLE_MAX_DURATION = 25 * 60
+# Without IDLE support, ask the server for news every XXX seconds
+NOOP_POLL_INTERVAL = 30
+# First delay before reconnecting after a failure, doubled each time up to IMAP_RECONNECT_MAX_DELAY
+RECONNECT_MIN_DELAY = 5
+# Quiet mailbox : the delay between two checks is multiplied by XXX each time, up to CHECK_INTERVAL_MAX
+CHECK_BACKOFF_FACTOR = 3
+
+mail = None              # current IMAP connection, INBOX selected
+uidvalidity = None       # UIDVALIDITY of INBOX, as announced by the server when selecting it
+reconnect_delay = 0      # current backoff delay, in seconds
+next_connect_time = 0    # time.monotonic() value before which we don't try to reconnect
+check_interval = CHECK_INTERVAL  # current delay between two mail checks, see next_check_interval()
+burst_end_time = 0       # time.monotonic() value until which we check every CHECK_INTERVAL
+
+
+def connect_mailbox():
+    """
+    Open a new connection to the IMAP server, log in and select INBOX.
+
+    :return: IMAP connection
+    """
+    if IMAP_SSL:
+        connection = imaplib.IMAP4_SSL(IMAP_SERVER, IMAP_PORT)
+    else:
+        connection = imaplib.IMAP4(IMAP_SERVER, IMAP_PORT)
+    connection.login(IMAP_USER, IMAP_PASSWORD)
+    connection.select("INBOX")
+    # SELECT tells how many messages there are : not new mail, only EXISTS after that means new mail (see _noop())
+    connection.untagged_responses.pop('EXISTS', None)
+    return connection
+
+
+def read_uidvalidity(connection):
+    """
+    UIDVALIDITY of the selected mailbox : if it changes, UIDs we know of are meaningless
+
+    :param connection: IMAP connection, right after SELECT
+    :return: int, or None if the server didn't tell
+    """
+    typ, data = connection.response('UIDVALIDITY')
+    try:
+        return int(data[-1])
+    except (TypeError, ValueError):
+        return None
+
+
+def get_mailbox():
+    """
+    Return the IMAP connection, (re)connecting if needed.
+    If the server could not be reached recently, don't try again before the backoff delay is over.
+
+    :return: IMAP connection, or None if not connected
+    """
+    global mail, uidvalidity, reconnect_delay, next_connect_time
+
+    if mail is not None:
+        return mail
+
+    if time.monotonic() < next_connect_time:
+        debug_log(f"IMAP server unreachable, next attempt in {int(next_connect_time - time.monotonic())}s", 'info')
+        return None
+
+    try:
+        mail = connect_mailbox()
+        uidvalidity = read_uidvalidity(mail)
+        reconnect_delay = 0
+        debug_log("🔌 Connected to IMAP server", 'info')
+    except (imaplib.IMAP4.error, OSError) as e:
+        mail = None
+        reconnect_delay = min(max(reconnect_delay * 2, RECONNECT_MIN_DELAY), IMAP_RECONNECT_MAX_DELAY)
+        next_connect_time = time.monotonic() + reconnect_delay
+        debug_log(f"❌ Could not connect to IMAP mail server : {e} (retry in {reconnect_delay}s)", 'critical')
+
+    return mail
+
+
+def release_mailbox():
+    """
+    Done with the mailbox for now : log out, unless we keep the connection open (IMAP_KEEPALIVE)
+    """
+    if not IMAP_KEEPALIVE:
+        close_mailbox()
+
+
+def close_mailbox():
+    """
+    Log out and forget the current connection. Next get_mailbox() will reconnect.
+    """
+    global mail
+    if mail is None:
+        return
+    try:
+        mail.logout()
+    except Exception as e:
+        debug_log(f"Could not log out cleanly from IMAP server : {e}", 'info')
+    mail = None
+
+
+def next_check_interval(new_photos, now=None):
+    """
+    How long to wait before the next mail check : CHECK_INTERVAL during a burst of photos,
+    then CHECK_BACKOFF_FACTOR times longer after each check that found nothing, up to CHECK_INTERVAL_MAX.
+
+    :param new_photos: number of photos found by the check that just ended
+    :param now: time.monotonic() value, default now
+    :return: seconds
+    """
+    global check_interval, burst_end_time
+
+    now = time.monotonic() if now is None else now
+    if new_photos:
+        burst_end_time = now + MAIL_BURST_DURATION
+    if now < burst_end_time:
+        check_interval = CHECK_INTERVAL
+    else:
+        check_interval = min(check_interval * CHECK_BACKOFF_FACTOR, CHECK_INTERVAL_MAX)
+    return check_interval
+
+
+def wait_for_new_mail(timeout):
+    """
+    Wait up to `timeout` seconds for new mail.
+    Returns as soon as the server announces new mail (IMAP IDLE), or after a NOOP poll if the
+    server doesn't support IDLE. Without IMAP_KEEPALIVE, just sleep.
+
+    :param timeout: max number of seconds to wait
+    :return: True if new mail has arrived, False otherwise (timeout, or connection lost)
+    """
+    deadline = time.monotonic() + timeout
+
+    if not IMAP_KEEPALIVE:
+        time.sleep(timeout)
+        return False
+
+    while (remaining := deadline - time.monotonic()) > 0:
+        connection = get_mailbox()
+        if connection is None:
+            time.sleep(min(remaining, max(1, next_connect_time - time.monotonic())))
+            continue
+
+        try:
+            if 'IDLE' in connection.capabilities:
+                has_new_mail = _idle(connection, min(remaining, IDLE_MAX_DURATION))
+            else:
+                time.sleep(min(remaining, NOOP_POLL_INTERVAL))
+                has_new_mail = _noop(connection)
+        except (imaplib.IMAP4.error, OSError) as e:
+            debug_log(f"❌ IMAP connection lost : {e}", 'critical')
+            close_mailbox()
+            continue
+
+        if has_new_mail:
+            debug_log("📬 Server says we have new mail", 'info')
+            return True
+
+    return False
+
+
+def _noop(connection):
+    """
+    Send a NOOP and check if the server mentioned new messages in its answer
+
+    :param connection: IMAP connection
+    :return: True if new mail
+    """
+    connection.noop()
+    typ, data = connection.response('EXISTS')
+    return data != [None]
+
+
+def _idle(connection, timeout):
+    """
+    Run an IMAP IDLE command (RFC 2177) for up to `timeout` seconds.
+    imaplib doesn't know IDLE (before Python 3.14), so we talk to the socket ourselves.
+
+    :param connection: IMAP connection
+    :param timeout: max number of seconds to idle
+    :return: True if the server announced new mail
+    """
+    tag = connection._new_tag()
+    connection.send(tag + b' IDLE\r\n')
+
+    has_new_mail = False
+    while not (line := _read_line(connection)).startswith(b'+'):
+        if line.startswith(tag):
+            raise imaplib.IMAP4.error(f"IDLE refused : {line.decode(errors='replace').strip()}")
+        has_new_mail = has_new_mail or _is_new_mail(line)
+
+    deadline = time.monotonic() + timeout
+    while not has_new_mail and (remaining := deadline - time.monotonic()) > 0:
+        if not _has_buffered_data(connection) and not select.select([connection.sock], [], [], remaining)[0]:
+            break
+        has_new_mail = _is_new_mail(_read_line(connection))
+
+    connection.send(b'DONE\r\n')
+    while not (line := _read_line(connection)).startswith(tag):
+        has_new_mail = has_new_mail or _is_new_mail(line)
+    connection.tagged_commands.pop(tag, None)
+
+    if not line.startswith(tag + b' OK'):
+        raise imaplib.IMAP4.error(f"IDLE failed : {line.decode(errors='replace').strip()}")
+
+    return has_new_mail
+
+
+def _has_buffered_data(connection):
+    """
+    Lines the server sent with the "+ idling" answer are already read from the socket, in imaplib's buffer,
+    and SSL sockets can hold decrypted data : select() on the socket doesn't see either of them
+
+    :param connection: IMAP connection
+    :return: True if there is something to read without waiting
+    """
+    sock = connection.sock
+    timeout = sock.gettimeout()
+    sock.setblocking(False)
+    try:
+        return bool(connection.file.peek())
+    except (BlockingIOError, ssl.SSLWantReadError):
+        return False
+    finally:
+        sock.settimeout(timeout)
+
+
+def _read_line(connection):
+    line = connection.readline()
+    if not line:
+        raise imaplib.IMAP4.abort("socket closed by server")
+    return line
+
+
+def _is_new_mail(line):
+    # Untagged "* 23 EXISTS" (or "* 1 RECENT") means the mailbox has grown
+    return line.startswith(b'* ') and line.rstrip().upper().endswith((b' EXISTS', b' RECENT'))
+
+
+def load_checkpoint():
+    """
+    Highest UID of the mails already ingested, so that we only ask the server for newer ones.
+    Forgotten if the mailbox UIDVALIDITY has changed.
+
+    :return: int, 0 if unknown
+    """
+    if not (state := get_state('mailbox')):
+        return 0
+
+    if state.get('uidvalidity') != uidvalidity:
+        debug_log(f"Mailbox UIDVALIDITY changed ({state.get('uidvalidity')} -> {uidvalidity}), full resync", 'info')
+        return 0
+    return state.get('last_uid', 0)
+
+
+def save_checkpoint(last_uid):
+    """
+    Remember the highest UID of the mails already ingested. Saved at once : mails ingested again would be
+    announced to their senders again. Nothing is written if it didn't change (no new mail).
+
+    :param last_uid: int
+    :return: True if saved
+    """
+    set_state('mailbox', {'uidvalidity': uidvalidity, 'last_uid': last_uid})
+    return flush_state()
@@ -0,0 +1,183 @@
+"""
+Index of the photos in OUTPUT_FOLDER, to spot duplicates before processing a new photo.
+
+Each photo is known by :
+    - the SHA-256 of the file that was received : exact duplicates
+    - a 64 bits difference hash (dHash) of a tiny grayscale version : near duplicates
+      (same photo resent, forwarded, recompressed...)
+
+Photos whose received file is unknown (copied by hand, or from previous versions) only have a dHash :
+the SHA-256 of the processed JPEG would never match a file sent by mail. Such photos are only found as near duplicates.
+
+Lookups are dict lookups. For near duplicates, the 64 bits hash is split in 4 bands of 16 bits :
+two hashes that differ by at most 3 bits have at least one identical band, so we only compare
+with the few photos sharing a band.
+
+Fingerprints are saved in the photo library (utils/photo_library.py), the lookup tables are built from it at start.
+"""
+import json
+import os
+
+import numpy as np
+from PIL import Image, ImageOps
+from pillow_heif import HeifImagePlugin
+
+from utils.constants import OUTPUT_FOLDER, PHOTO_INDEX
+import utils.photo_library as photo_library
+from utils.utils import debug_log
+
+# Max number of different bits between two dHash to consider photos identical (must be < NUMBER_OF_BANDS)
+NEAR_DUPLICATE_DISTANCE = 3
+NUMBER_OF_BANDS = 4
+
+photos = None     # {image_name: {'sha256': str or None, 'dhash': int}}
+by_sha256 = {}    # {sha256: image_name}
+by_band = {}      # {(band number, band value): set of image names}
+
+
+def photo_fingerprint(path):
+    """
+    Compute the fingerprint of a photo of OUTPUT_FOLDER whose received file is unknown : dHash only
+
+    :param path: path to the image file
+    :return: dict {'sha256': None, 'dhash': int}, or None if the image can't be read
+    """
+    try:
+        return {'sha256': None, 'dhash': dhash(path)}
+    except (OSError, ValueError) as e:
+        debug_log(f"Could not compute fingerprint of {path} : {e}", 'info')
+        return None
+
+
+def dhash(path):
+    """
+    Difference hash of an image file
+
+    :param path: path to the image file
+    :return: int, 64 bits
+    """
+    with Image.open(path) as image:
+        # JPEG : let the decoder do most of the downscaling, much faster than decoding the full image
+        image.draft('L', (64, 64))
+        return image_dhash(ImageOps.exif_transpose(image))
+
+
+def image_dhash(image):
+    """
+    Difference hash : is each pixel brighter than its right neighbour, on a 9x8 grayscale thumbnail
+
+    :param image: image object (PIL.Image), already oriented
+    :return: int, 64 bits
+    """
+    pixels = np.asarray(image.convert('L').resize((9, 8), Image.BOX), dtype=np.int16)
+    bits = np.packbits(pixels[:, 1:] > pixels[:, :-1])
+    return int.from_bytes(bits.tobytes(), 'big')
+
+
+def is_near_duplicate(value, known_dhashes):
+    """
+    Near duplicate check without the index, for the worker processes : compares with every dHash
+
+    :param value: dHash of the new photo
+    :param known_dhashes: dHash of the photos we have, see photo_library.dhashes()
+    :return: True if one of them differs by at most NEAR_DUPLICATE_DISTANCE bits
+    """
+    return any(bin(value ^ known).count('1') <= NEAR_DUPLICATE_DISTANCE for known in known_dhashes)
+
+
+def _bands(value):
+    band_bits = 64 // NUMBER_OF_BANDS
+    mask = (1 << band_bits) - 1
+    return [(band, (value >> (band * band_bits)) & mask) for band in range(NUMBER_OF_BANDS)]
+
+
+def load_photo_index():
+    """
+    Build the index from the photo library. Photos without a fingerprint yet (copied by hand, or from
+    previous versions) are taken from the PHOTO_INDEX file of previous versions, or fingerprinted now (dHash only).
+    """
+    global photos, by_sha256, by_band
+
+    try:
+        with open(PHOTO_INDEX, 'r') as f:
+            saved = json.load(f)
+    except (FileNotFoundError, ValueError):
+        saved = {}
+
+    photos, by_sha256, by_band = {}, {}, {}
+    for image_name, fingerprint in photo_library.fingerprints():
+        if fingerprint is None:
+            fingerprint = saved.get(image_name) or photo_fingerprint(os.path.join(OUTPUT_FOLDER, image_name))
+            if fingerprint:
+                photo_library.set_fingerprint(image_name, fingerprint)
+        if fingerprint:
+            _add(image_name, fingerprint)
+
+    debug_log(f"Photo index : {len(photos)} photo(s)", 'info')
+
+
+def _add(image_name, fingerprint):
+    photos[image_name] = fingerprint
+    if fingerprint['sha256']:
+        by_sha256[fingerprint['sha256']] = image_name
+    for band in _bands(fingerprint['dhash']):
+        by_band.setdefault(band, set()).add(image_name)
+
+
+def _remove(image_name):
+    fingerprint = photos.pop(image_name, None)
+    if not fingerprint:
+        return
+    if fingerprint['sha256'] and by_sha256.get(fingerprint['sha256']) == image_name:
+        del by_sha256[fingerprint['sha256']]
+    for band in _bands(fingerprint['dhash']):
+        by_band.get(band, set()).discard(image_name)
+
+
+def add_photo(image_name, fingerprint, sender=None, captured_at=None):
+    """
+    Add a newly processed photo to the photo library and to the index
+
+    :param image_name: file name of the photo in OUTPUT_FOLDER
+    :param fingerprint: dict returned by photo_fingerprint() for the original file
+    :param sender: email of the sender, or None if unknown
+    :param captured_at: date the photo was taken, see photo_library.capture_time()
+    """
+    if photos is None:
+        load_photo_index()
+    photo_library.add_photo(image_name, fingerprint, sender, captured_at)
+    if fingerprint:
+        _add(image_name, fingerprint)
+
+
+def find_duplicate(fingerprint):
+    """
+    Find a photo we already have that is identical, or nearly identical
+
+    :param fingerprint: dict returned by photo_fingerprint()
+    :return: image name of the duplicate in OUTPUT_FOLDER, or None
+    """
+    if photos is None:
+        load_photo_index()
+    if not fingerprint:
+        return None
+
+    candidates = []
+    if fingerprint['sha256'] and (image_name := by_sha256.get(fingerprint['sha256'])):
+        candidates.append(image_name)
+    for band in _bands(fingerprint['dhash']):
+        candidates += by_band.get(band, ())
+
+    for image_name in dict.fromkeys(candidates):
+        if image_name not in photos:
+            continue
+        same_file = fingerprint['sha256'] and photos[image_name]['sha256'] == fingerprint['sha256']
+        distance = bin(photos[image_name]['dhash'] ^ fingerprint['dhash']).count('1')
+        if not same_file and distance > NEAR_DUPLICATE_DISTANCE:
+            continue
+        # the photo might have been deleted since (button, retention)
+        if photo_library.has_photo(image_name):
+            return image_name
+        _remove(image_name)
+
+    return None
@@ -0,0 +1,361 @@
+"""
+Library of the photos in OUTPUT_FOLDER, in a SQLite database, instead of listing, sorting and searching
+the folder each time a photo is displayed.
+
+For each photo : file name, position in the slideshow (order received, a photo sent again goes back
+to the end), capture time (EXIF), sender, SHA-256 and dHash (see utils/photo_index.py), file size and
+display count.
+
+Next, previous, delete and retention are index lookups (O(log n)) : the frame can hold thousands of photos.
+The number of photos and their total size, overall and per sender, are kept up to date by triggers, never counted.
+Which photos to delete is decided by utils/retention.py.
+The library is synced with the folder once per start (photos copied or deleted by hand).
+"""
+import os
+import sqlite3
+import threading
+import time
+
+from PIL import Image
+
+from utils.constants import OUTPUT_FOLDER, PHOTO_LIBRARY
+from utils.state_store import get_state, set_state
+from utils.utils import debug_log
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS photos (
+    name TEXT PRIMARY KEY,
+    position INTEGER NOT NULL UNIQUE,
+    received_at REAL NOT NULL,
+    captured_at TEXT,
+    sender TEXT,
+    sha256 TEXT,
+    dhash TEXT,
+    size INTEGER NOT NULL DEFAULT 0,
+    display_count INTEGER NOT NULL DEFAULT 0,
+    displayed_at REAL
+);
+CREATE INDEX IF NOT EXISTS photos_sha256 ON photos (sha256);
+CREATE INDEX IF NOT EXISTS photos_sender ON photos (COALESCE(sender, ''), position);
+
+CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), count INTEGER NOT NULL, bytes INTEGER NOT NULL);
+INSERT OR IGNORE INTO totals VALUES (0, 0, 0);
+CREATE TRIGGER IF NOT EXISTS photos_insert AFTER INSERT ON photos BEGIN
+    UPDATE totals SET count = count + 1, bytes = bytes + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS photos_delete AFTER DELETE ON photos BEGIN
+    UPDATE totals SET count = count - 1, bytes = bytes - OLD.size;
+END;
+
+-- Same per sender ('' : unknown sender)
+CREATE TABLE IF NOT EXISTS senders (sender TEXT PRIMARY KEY, count INTEGER NOT NULL, bytes INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS senders_count ON senders (count);
+CREATE INDEX IF NOT EXISTS senders_bytes ON senders (bytes);
+INSERT OR IGNORE INTO senders SELECT COALESCE(sender, ''), COUNT(*), SUM(size) FROM photos GROUP BY 1;
+CREATE TRIGGER IF NOT EXISTS senders_insert AFTER INSERT ON photos BEGIN
+    INSERT INTO senders VALUES (COALESCE(NEW.sender, ''), 1, NEW.size)
+        ON CONFLICT (sender) DO UPDATE SET count = count + 1, bytes = bytes + excluded.bytes;
+END;
+CREATE TRIGGER IF NOT EXISTS senders_delete AFTER DELETE ON photos BEGIN
+    UPDATE senders SET count = count - 1, bytes = bytes - OLD.size WHERE sender = COALESCE(OLD.sender, '');
+    DELETE FROM senders WHERE sender = COALESCE(OLD.sender, '') AND count = 0;
+END;
+"""
+
+# EXIF tags : date the photo was taken, in the EXIF sub-IFD, or date of the file in the main IFD
+EXIF_IFD = 0x8769
+EXIF_DATE_TIME_ORIGINAL = 0x9003
+EXIF_DATE_TIME = 0x0132
+
+db = None                # sqlite3 connection, see get_library()
+lock = threading.RLock()  # main loop, display worker and buttons share the connection
+
+
+def get_library():
+    """
+    Open the library, create it and sync it with OUTPUT_FOLDER if not done yet
+
+    :return: sqlite3 connection
+    """
+    global db
+
+    with lock:
+        if db is None:
+            connection = sqlite3.connect(PHOTO_LIBRARY, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            # a replaced row fires the delete trigger too : totals stay right
+            connection.execute("PRAGMA recursive_triggers=ON")
+            connection.executescript(SCHEMA)
+            db = connection
+            sync_library()
+        return db
+
+
+def close_library():
+    global db
+
+    with lock:
+        if db is not None:
+            db.close()
+            db = None
+
+
+def sync_library():
+    """
+    Add photos of OUTPUT_FOLDER that are not in the library (oldest first), forget photos that are gone.
+    Photos added here have no fingerprint yet, see utils/photo_index.py
+    """
+    with lock:
+        known = {name for name, in db.execute("SELECT name FROM photos")}
+        on_disk = {name for name in os.listdir(OUTPUT_FOLDER) if name.lower().endswith('.jpg')}
+
+        for name in known - on_disk:
+            db.execute("DELETE FROM photos WHERE name = ?", (name,))
+        new = sorted(on_disk - known, key=lambda name: os.path.getmtime(os.path.join(OUTPUT_FOLDER, name)))
+        for name in new:
+            add_photo(name, captured_at=file_capture_time(os.path.join(OUTPUT_FOLDER, name)))
+
+    if known != on_disk:
+        debug_log(f"Photo library synced : {len(new)} added, {len(known - on_disk)} removed", 'info')
+    debug_log(f"Photo library : {photo_count()} photo(s), {library_size() // 1024} KB", 'info')
+
+
+def capture_time(image):
+    """
+    Date the photo was taken, from its EXIF data
+
+    :param image: image object (PIL.Image)
+    :return: string "YYYY-MM-DD HH:MM:SS", or None if unknown
+    """
+    exif = image.getexif()
+    value = exif.get_ifd(EXIF_IFD).get(EXIF_DATE_TIME_ORIGINAL) or exif.get(EXIF_DATE_TIME)
+    if not isinstance(value, str) or len(value) < 19:
+        return None
+    # EXIF dates are "YYYY:MM:DD HH:MM:SS"
+    return value[:10].replace(':', '-') + value[10:19]
+
+
+def file_capture_time(path):
+    try:
+        with Image.open(path) as image:
+            return capture_time(image)
+    except (OSError, ValueError):
+        return None
+
+
+def add_photo(image_name, fingerprint=None, sender=None, captured_at=None):
+    """
+    Add a photo of OUTPUT_FOLDER at the end of the slideshow
+
+    :param image_name: file name of the photo in OUTPUT_FOLDER
+    :param fingerprint: dict {'sha256': str or None, 'dhash': int}, or None if not computed yet
+    :param sender: email of the sender, or None if unknown
+    :param captured_at: date the photo was taken, see capture_time()
+    """
+    fingerprint = fingerprint or {}
+    dhash = f"{fingerprint['dhash']:016x}" if 'dhash' in fingerprint else None
+    size = os.path.getsize(os.path.join(OUTPUT_FOLDER, image_name))
+    with lock:
+        get_library().execute(
+            "INSERT OR REPLACE INTO photos (name, position, received_at, captured_at, sender, sha256, dhash, size) "
+            "VALUES (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM photos), ?, ?, ?, ?, ?, ?)",
+            (image_name, time.time(), captured_at, sender, fingerprint.get('sha256'), dhash, size))
+
+
+def photo_by_sha256(sha256):
+    """
+    Photo made from the same received file
+
+    :param sha256: SHA-256 of the received file
+    :return: (image name, {'sha256': str, 'dhash': int}), or None
+    """
+    with lock:
+        row = get_library().execute("SELECT name, dhash FROM photos WHERE sha256 = ? AND dhash IS NOT NULL LIMIT 1",
+                                    (sha256,)).fetchone()
+    return (row[0], {'sha256': sha256, 'dhash': int(row[1], 16)}) if row else None
+
+
+def dhashes():
+    """
+    :return: list of the dHash (int) of the photos, for the near duplicate check of the workers
+    """
+    with lock:
+        rows = get_library().execute("SELECT dhash FROM photos WHERE dhash IS NOT NULL").fetchall()
+    return [int(dhash, 16) for dhash, in rows]
+
+
+def set_fingerprint(image_name, fingerprint):
+    """
+    :param image_name: file name of the photo in OUTPUT_FOLDER
+    :param fingerprint: dict {'sha256': str or None, 'dhash': int}
+    """
+    with lock:
+        get_library().execute("UPDATE photos SET sha256 = ?, dhash = ? WHERE name = ?",
+                              (fingerprint['sha256'], f"{fingerprint['dhash']:016x}", image_name))
+
+
+def fingerprints():
+    """
+    :return: list of (image name, {'sha256': str or None, 'dhash': int} or None if not computed yet)
+    """
+    with lock:
+        rows = get_library().execute("SELECT name, sha256, dhash FROM photos").fetchall()
+    return [(name, {'sha256': sha256, 'dhash': int(dhash, 16)} if dhash else None)
+            for name, sha256, dhash in rows]
+
+
+def move_to_end(image_name):
+    """
+    Move a photo at the end of the slideshow, as if just received (same photo sent again)
+
+    :param image_name: file name of the photo in OUTPUT_FOLDER
+    """
+    with lock:
+        get_library().execute(
+            "UPDATE photos SET position = (SELECT MAX(position) + 1 FROM photos), received_at = ? WHERE name = ?",
+            (time.time(), image_name))
+
+
+def has_photo(image_name):
+    with lock:
+        return get_library().execute("SELECT 1 FROM photos WHERE name = ?", (image_name,)).fetchone() is not None
+
+
+def remove_photo(image_name):
+    """
+    Forget a photo (the file is already gone)
+
+    :param image_name: file name of the photo in OUTPUT_FOLDER
+    """
+    with lock:
+        get_library().execute("DELETE FROM photos WHERE name = ?", (image_name,))
+
+
+def delete_photo(image_name):
+    """
+    Delete a photo file, and forget it
+
+    :param image_name: file name of the photo in OUTPUT_FOLDER
+    :return: True if deleted
+    """
+    try:
+        os.remove(os.path.join(OUTPUT_FOLDER, image_name))
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        debug_log(f"Error deleting {image_name} : {e}", 'critical')
+        return False
+    remove_photo(image_name)
+    debug_log(f"Deleted : {image_name}", 'info')
+    return True
+
+
+def _neighbour(image_name, direction):
+    # next (direction 1) or previous (-1) photo by position, wrapping around
+    compare, order = ('>', 'ASC') if direction > 0 else ('<', 'DESC')
+    with lock:
+        library = get_library()
+        row = library.execute(
+            f"SELECT name FROM photos WHERE position {compare} (SELECT position FROM photos WHERE name = ?) "
+            f"ORDER BY position {order} LIMIT 1", (image_name,)).fetchone()
+        if row is None:
+            row = library.execute(f"SELECT name FROM photos ORDER BY position {order} LIMIT 1").fetchone()
+    return row[0] if row else None
+
+
+def next_photo(image_name):
+    """
+    Photo after this one in the slideshow, or the first one after the last one (or if image_name is unknown)
+
+    :param image_name: file name of the photo in OUTPUT_FOLDER, or None
+    :return: file name, or None if the library is empty
+    """
+    return _neighbour(image_name, 1)
+
+
+def previous_photo(image_name):
+    """
+    Photo before this one in the slideshow, or the last one before the first one (or if image_name is unknown)
+
+    :param image_name: file name of the photo in OUTPUT_FOLDER, or None
+    :return: file name, or None if the library is empty
+    """
+    return _neighbour(image_name, -1)
+
+
+def photo_count():
+    with lock:
+        return get_library().execute("SELECT count FROM totals").fetchone()[0]
+
+
+def library_size():
+    """
+    :return: total size of the photos, in bytes
+    """
+    with lock:
+        return get_library().execute("SELECT bytes FROM totals").fetchone()[0]
+
+
+def oldest_photo(sender=None, exclude=None):
+    """
+    First photo of the slideshow (received longest ago), of everyone or of one sender
+
+    :param sender: email of the sender ('' : unknown sender), or None for any sender
+    :param exclude: file name of a photo to skip (the one on the frame), or None
+    :return: (position, file name), or None if no photo
+    """
+    with lock:
+        if sender is None:
+            return get_library().execute(
+                "SELECT position, name FROM photos WHERE name IS NOT ? ORDER BY position LIMIT 1",
+                (exclude,)).fetchone()
+        return get_library().execute(
+            "SELECT position, name FROM photos WHERE COALESCE(sender, '') = ? AND name IS NOT ? "
+            "ORDER BY position LIMIT 1", (sender, exclude)).fetchone()
+
+
+def newest_photo():
+    """
+    Last photo of the slideshow (received, or sent again, last)
+
+    :return: file name, or None if no photo
+    """
+    with lock:
+        row = get_library().execute("SELECT name FROM photos ORDER BY position DESC LIMIT 1").fetchone()
+        return row[0] if row else None
+
+
+def senders(by_bytes=False):
+    """
+    :param by_bytes: sort by total size of the photos, instead of number of photos
+    :return: list of (sender, number of photos, total size in bytes), biggest first. Unknown sender : ''
+    """
+    order = 'bytes' if by_bytes else 'count'
+    with lock:
+        return get_library().execute(f"SELECT sender, count, bytes FROM senders ORDER BY {order} DESC").fetchall()
+
+
+def get_current_photo():
+    """
+    :return: file name of the photo on the frame (or about to be), or None
+    """
+    return get_state('current_photo')
+
+
+def set_current_photo(image_name):
+    """
+    :param image_name: file name (or path) of the photo on the frame, or about to be
+    """
+    set_state('current_photo', os.path.basename(image_name))
+
+
+def photo_displayed(image_name):
+    """
+    Count a display of a photo
+
+    :param image_name: file name of the photo in OUTPUT_FOLDER
+    """
+    with lock:
+        get_library().execute("UPDATE photos SET display_count = display_count + 1, displayed_at = ? WHERE name = ?",
+                              (time.time(), image_name))
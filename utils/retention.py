@@ -0,0 +1,75 @@
+"""
+Retention : which photos to delete when there are too many of them, or when they take too much of the SD card.
+
+Limits : NUMBER_OF_PHOTOS_TO_KEEP photos, and PHOTOS_MAX_SIZE_MB MB of photos (0 : no size limit).
+Over a limit, the oldest photo goes (received, or sent again, longest ago). With RETENTION_PER_SENDER, it's
+the oldest photo of the sender who has the most photos (or the most MB, over the size limit) : a cousin
+sending 50 photos at once replaces their own photos, not everyone else's.
+
+Only photos of the library (utils/photo_library.py) are deleted, never other files of OUTPUT_FOLDER.
+Counts and sizes, per sender too, are kept up to date by the library, and the oldest photo of anyone is
+an index lookup : adding a photo costs O(log n), whatever the number of photos.
+The photo on the frame and the last photo received are never deleted : with both to keep, there can be one
+photo more than NUMBER_OF_PHOTOS_TO_KEEP.
+"""
+from utils.constants import NUMBER_OF_PHOTOS_TO_KEEP, PHOTOS_MAX_SIZE_MB, RETENTION_PER_SENDER
+from utils.photo_library import photo_count, library_size, oldest_photo, newest_photo, senders, delete_photo, \
+    get_current_photo
+from utils.utils import debug_log
+
+
+def apply_retention(keep=NUMBER_OF_PHOTOS_TO_KEEP, max_bytes=PHOTOS_MAX_SIZE_MB * 1024 * 1024,
+                    per_sender=RETENTION_PER_SENDER):
+    """
+    Delete photos until there are at most `keep` of them, taking at most `max_bytes`
+
+    :param keep: max number of photos
+    :param max_bytes: max total size of the photos, in bytes. 0 : no limit
+    :param per_sender: if True, delete photos of the biggest sender first
+    :return: list of deleted file names, in the order they were deleted
+    """
+    current_photo = get_current_photo()
+    deleted = []
+
+    while photo_count() > 1:
+        if photo_count() > keep:
+            by_bytes = False
+        elif max_bytes and library_size() > max_bytes:
+            by_bytes = True
+        else:
+            break
+
+        image_name = next_to_delete(by_bytes, per_sender, current_photo)
+        if not image_name or not delete_photo(image_name):
+            break
+        deleted.append(image_name)
+
+    if deleted:
+        debug_log(f"🗑️ Retention : deleted {len(deleted)} photo(s), {photo_count()} left "
+                  f"({library_size() // 1024} KB)", 'info')
+    return deleted
+
+
+def next_to_delete(by_bytes=False, per_sender=RETENTION_PER_SENDER, current_photo=None):
+    """
+    Photo to delete first
+
+    :param by_bytes: over the size limit : the biggest sender is the one with the most MB, not the most photos
+    :param per_sender: if True, oldest photo of the biggest sender. Otherwise oldest photo of all
+    :param current_photo: file name of the photo on the frame, never deleted
+    :return: file name, or None if there is nothing to delete
+    """
+    # the last photo received is never deleted either
+    newest = newest_photo()
+    if per_sender:
+        ranking = senders(by_bytes)
+        size = 2 if by_bytes else 1
+        # several senders as big as the biggest one : the one whose oldest photo is the oldest
+        biggest = [row[0] for row in ranking if row[size] == ranking[0][size]]
+        oldest = [photo for sender in biggest
+                  if (photo := oldest_photo(sender, current_photo)) and photo[1] != newest]
+        if oldest:
+            return min(oldest)[1]
+
+    photo = oldest_photo(exclude=current_photo)
+    return photo[1] if photo and photo[1] != newest else None
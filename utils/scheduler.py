@@ -0,0 +1,95 @@
+"""
+Event loop of the app : everything that changes the photos or what's on the frame (new photos added, rotation,
+button actions, shutdown) runs in the main thread, one event at a time, in the order events happen.
+Other threads post events, so there is never two of them touching the photos at the same time. The mail
+watcher only does the slow part itself (downloads, photo processing in the workers, emails), then posts
+the new photos : events stay short, a button press never waits for a mail check.
+
+    post(function, arg1, arg2...)                 # from any thread : run function(arg1, arg2...) asap
+    timer = call_later(3600, function, arg1...)   # from any thread : run it in an hour
+    cancel(timer)
+    run()                                         # main thread : run events, forever
+
+post() and call_later() return a concurrent.futures.Future with what the function returned.
+Events and timers run in the order they are due : timers at their deadline (not at the next poll),
+events a few milliseconds after being posted, or right after the event running at that time.
+"""
+import concurrent.futures
+import heapq
+import itertools
+import threading
+import time
+
+from utils.utils import debug_log
+
+events = []                          # heap of (time, sequence, function, args, concurrent.futures.Future)
+sequence = itertools.count()         # events posted at the same time run in the order they were posted
+condition = threading.Condition()
+
+
+def post(function, *args):
+    """
+    Run a function in the event loop, after the events already waiting
+
+    :param function: function to run
+    :param args: its arguments
+    :return: concurrent.futures.Future, result of the function
+    """
+    return call_later(0, function, *args)
+
+
+def call_later(delay, function, *args):
+    """
+    Run a function in the event loop in `delay` seconds
+
+    :param delay: seconds
+    :param function: function to run
+    :param args: its arguments
+    :return: concurrent.futures.Future, result of the function. Also the timer, for cancel()
+    """
+    future = concurrent.futures.Future()
+    with condition:
+        heapq.heappush(events, (time.monotonic() + delay, next(sequence), function, args, future))
+        condition.notify()
+    return future
+
+
+def cancel(timer):
+    """
+    Cancel a timer, if it hasn't fired yet
+
+    :param timer: timer returned by call_later(), or None
+    """
+    if timer is not None:
+        timer.cancel()
+
+
+def run():
+    """
+    Run events and timers in the order they are due, forever. Errors in an event are logged, the loop goes on.
+    """
+    while True:
+        with condition:
+            while not events or (delay := events[0][0] - time.monotonic()) > 0:
+                condition.wait(delay if events else None)
+            _, _, function, args, future = heapq.heappop(events)
+        run_event(function, args, future)
+
+
+def run_event(function, args, future):
+    """
+    Run one event, and set its result
+
+    :param function: function to run
+    :param args: its arguments
+    :param future: concurrent.futures.Future
+    """
+    if not future.set_running_or_notify_cancel():
+        return
+    start = time.monotonic()
+    try:
+        future.set_result(function(*args))
+    except Exception as e:
+        debug_log(f"❌ Error in {function.__name__} : {e!r}", 'critical')
+        future.set_exception(e)
+    debug_log(f"⏱️ {function.__name__} done in {(time.monotonic() - start) * 1000:.0f} ms", 'info')
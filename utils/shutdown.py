@@ -4,9 +4,10 @@ import time
 from PIL import Image, ImageDraw, ImageFont
 
 from utils.constants import SHUTDOWN_MESSAGE_LINE1, SHUTDOWN_MESSAGE_LINE2, TMP_DOWNLOAD_FOLDER
-from utils.eink import send_to_eink
+from utils.display_worker import request_display, PRIORITY_SHUTDOWN
 from utils.utils import debug_log, exit_program
 from utils.led import led_off, led_on
+from utils.state_store import flush_state
 
 led_on()
 
@@ -42,7 +43,8 @@ def create_shutdown_image():
 # check if SHUTDOWN_SCREEN_FILE exists, create it otherwise
 if not os.path.exists(TMP_DOWNLOAD_FOLDER + '/' + SHUTDOWN_SCREEN_FILE):
     create_shutdown_image()
-send_to_eink(SHUTDOWN_SCREEN_FILE, is_debug=True)
+# before anything else waiting to be displayed, and wait for it : the panel keeps it once the Pi is off
+request_display(SHUTDOWN_SCREEN_FILE, is_debug=True, priority=PRIORITY_SHUTDOWN).result()
 time.sleep(1)
 
 # Shutdown LED if it was on
@@ -51,7 +53,8 @@ try:
 except Exception as e:
     debug_log(f"Could not turn LED off : {e}", "critical")
 
-# Shutdown the system
+# Shutdown the system, state saved first
+flush_state()
 try:
     debug_log("sudo shutdown -h now", 'info')
     os.system("sudo shutdown -h now")
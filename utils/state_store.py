@@ -0,0 +1,141 @@
+"""
+State store : what the app must remember across restarts (photo on the frame, hash of the frame on the panel,
+mailbox checkpoint), in one small JSON file, STATE_FILE.
+
+    get_state('current_photo')
+    set_state('current_photo', '2025-01-01-120000.jpg')   # saved within STATE_FLUSH_INTERVAL seconds
+    set_state('mailbox', {...}, flush=True)              # saved now
+    flush_state()                                        # at exit
+
+The state is kept in memory. Changes are saved together, at most once every STATE_FLUSH_INTERVAL seconds
+(0 : on every change), and setting a value that didn't change writes nothing : fewer writes wearing the SD card.
+Saving is atomic : temp file, fsync, rename. A power cut leaves the previous state or the new one, never
+an empty or half written file. It can lose the changes of the last STATE_FLUSH_INTERVAL seconds : at worst,
+the frame shows a photo again, or refreshes the panel once more. What can't be lost is saved with flush=True.
+"""
+import json
+import os
+import threading
+
+from utils.constants import STATE_FILE, STATE_FLUSH_INTERVAL, CURRENT_PHOTO, DISPLAY_STATE, MAILBOX_STATE
+from utils.scheduler import call_later, cancel
+from utils.utils import debug_log
+
+state = None          # {key: value}, see load_state()
+dirty = False         # changes not saved yet
+flush_timer = None    # pending flush_state(), see set_state()
+lock = threading.RLock()  # main loop and display worker both change the state
+
+
+def load_state():
+    """
+    Load the state from STATE_FILE, or from the files of previous versions if there is no STATE_FILE yet
+
+    :return: dict
+    """
+    global state
+
+    with lock:
+        if state is None:
+            try:
+                with open(STATE_FILE, 'r') as f:
+                    state = json.load(f)
+            except FileNotFoundError:
+                state = _previous_versions_state()
+            except ValueError as e:
+                debug_log(f"Could not read {STATE_FILE} : {e}, starting afresh", 'critical')
+                state = {}
+        return state
+
+
+def _previous_versions_state():
+    # current_photo.txt, display_state.json and mailbox_state.json : saved in STATE_FILE on the next flush
+    old_state = {}
+    try:
+        with open(CURRENT_PHOTO, 'r') as f:
+            old_state['current_photo'] = f.read().strip() or None
+    except OSError:
+        pass
+    for key, path in [('frame_hash', DISPLAY_STATE), ('mailbox', MAILBOX_STATE)]:
+        try:
+            with open(path, 'r') as f:
+                old_state[key] = json.load(f)
+        except (OSError, ValueError):
+            pass
+    if 'frame_hash' in old_state:
+        old_state['frame_hash'] = old_state['frame_hash'].get('frame_hash')
+    return old_state
+
+
+def get_state(key, default=None):
+    """
+    :param key: string
+    :param default: value if the key was never set
+    :return: value, as set by set_state()
+    """
+    with lock:
+        return load_state().get(key, default)
+
+
+def set_state(key, value, flush=False):
+    """
+    Change a value, saved with the next flush
+
+    :param key: string
+    :param value: anything that can be saved as JSON
+    :param flush: if True, save now (and everything else that changed)
+    """
+    global dirty, flush_timer
+
+    with lock:
+        if load_state().get(key) != value or key not in state:
+            state[key] = value
+            dirty = True
+        if not dirty:
+            return
+        if flush or STATE_FLUSH_INTERVAL <= 0:
+            flush_state()
+        elif flush_timer is None:
+            flush_timer = call_later(STATE_FLUSH_INTERVAL, flush_state)
+
+
+def flush_state():
+    """
+    Save the changes now, if any
+
+    :return: True if saved (or nothing to save)
+    """
+    global dirty, flush_timer
+
+    with lock:
+        cancel(flush_timer)
+        flush_timer = None
+        if not dirty:
+            return True
+
+        tmp_path = STATE_FILE + '.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, STATE_FILE)
+            _fsync_folder(os.path.dirname(os.path.abspath(STATE_FILE)))
+        except OSError as e:
+            debug_log(f"Could not save state to {STATE_FILE} : {e}", 'critical')
+            if STATE_FLUSH_INTERVAL > 0:
+                flush_timer = call_later(STATE_FLUSH_INTERVAL, flush_state)
+            return False
+        dirty = False
+        return True
+
+
+def _fsync_folder(folder):
+    # the rename itself is only on the SD card once the folder is synced (not possible on Windows)
+    if not hasattr(os, 'O_DIRECTORY'):
+        return
+    fd = os.open(folder, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,170 @@
+"""
+Small pool of worker processes for the heavy image work (decoding, resizing, palette conversion),
+so that it runs on every core of the Pi, and the main process stays free for the loop and the buttons.
+
+    start_workers()                         # at start of the app, before any other thread
+    job = submit(function, arg1, arg2...)   # blocks while too many jobs are waiting
+    value = result(job)                     # raises TimeoutError if the job takes too long
+
+Functions and arguments must be picklable : module level functions, bytes, strings...
+"""
+import concurrent.futures
+import concurrent.futures.process
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+from utils.constants import IMAGE_WORKERS, IMAGE_JOB_TIMEOUT
+from utils.utils import debug_log
+
+# Jobs submitted and not finished yet, per worker. More jobs wait in submit()
+JOBS_PER_WORKER = 2
+
+# Workers are less important than the main process (buttons, display)
+WORKER_NICENESS = 5
+
+# While a job waits for a free worker, check every XXX seconds if it has started
+JOB_START_POLL_INTERVAL = 1
+
+executor = None
+pending_jobs = None  # semaphore : one per job submitted and not finished yet
+free_slots = None    # slots of started_at not used by a pending job
+started_at = None    # shared with the workers : time.monotonic() at which the job of each slot started, 0 : not yet
+lock = threading.Lock()
+
+
+def _init_worker(shared_started_at):
+    global started_at
+    started_at = shared_started_at
+    if hasattr(os, 'nice'):
+        os.nice(WORKER_NICENESS)
+
+
+def _run_job(slot, function, args):
+    # in a worker process : the timeout of the job counts from now, see result()
+    started_at[slot] = time.monotonic()
+    return function(*args)
+
+
+def start_workers():
+    """
+    Start the worker processes now. To call at start of the app, before any thread is started and before
+    the photo library is opened : workers are forked, they must not inherit locks held by other threads.
+    Workers restarted later (see result()) are forked from the running app : the functions they run
+    must not use the photo library, the state store or the mailbox.
+    """
+    result(submit(os.getpid))
+
+
+def get_executor():
+    """
+    Start the worker processes, if not started yet
+
+    :return: concurrent.futures.ProcessPoolExecutor
+    """
+    global executor, pending_jobs, free_slots, started_at
+
+    with lock:
+        if executor is None:
+            # fork : workers inherit the already initialised modules (GPIO lines can't be requested twice).
+            # All the workers are forked at once, on the first submit()
+            context = multiprocessing.get_context('fork' if sys.platform != 'win32' else None)
+            started_at = context.RawArray('d', IMAGE_WORKERS * JOBS_PER_WORKER)
+            executor = concurrent.futures.ProcessPoolExecutor(max_workers=IMAGE_WORKERS, mp_context=context,
+                                                              initializer=_init_worker, initargs=(started_at,))
+            pending_jobs = threading.BoundedSemaphore(IMAGE_WORKERS * JOBS_PER_WORKER)
+            free_slots = list(range(IMAGE_WORKERS * JOBS_PER_WORKER))
+            debug_log(f"⚙️ {IMAGE_WORKERS} image worker(s) started", 'info')
+        return executor
+
+
+def submit(function, *args):
+    """
+    Run a function in a worker process. Blocks while the workers have too many jobs already.
+
+    :param function: module level function
+    :param args: picklable arguments
+    :return: concurrent.futures.Future
+    """
+    get_executor()
+    semaphore, slots, shared_started_at = pending_jobs, free_slots, started_at
+    semaphore.acquire()
+    with lock:
+        slot = slots.pop()
+    shared_started_at[slot] = 0
+
+    def release(_):
+        with lock:
+            slots.append(slot)
+        semaphore.release()
+
+    try:
+        job = executor.submit(_run_job, slot, function, args)
+    except BaseException:
+        release(None)
+        raise
+    job.add_done_callback(release)
+    # to know when it started, and to submit it again if the workers are restarted, see result()
+    job.started_at, job.slot, job.call = shared_started_at, slot, (function, *args)
+    return job
+
+
+def result(job, timeout=IMAGE_JOB_TIMEOUT):
+    """
+    Wait for the result of a job. If it runs for more than `timeout` seconds (counted from the moment
+    a worker started it, not from submit()), the workers are killed and restarted. The other jobs killed
+    with them are submitted again, once.
+
+    :param job: concurrent.futures.Future returned by submit()
+    :param timeout: seconds
+    :return: whatever the function returned (or raises what it raised)
+    """
+    if job.done() and not job.cancelled() and job.exception() is None:
+        # nothing to wait for (jobs that needed no worker too, see utils/ingest.py)
+        return job.result()
+    try:
+        return _wait(job, timeout)
+    except (concurrent.futures.process.BrokenProcessPool, concurrent.futures.CancelledError):
+        # killed while running, or cancelled while waiting for a worker
+        if getattr(job, 'retry', False):
+            raise
+        debug_log("Image job stopped with the workers, submitting it again", 'info')
+        job = submit(*job.call)
+        job.retry = True
+        return _wait(job, timeout)
+
+
+def _wait(job, timeout):
+    while True:
+        started = job.started_at[job.slot]
+        wait = started + timeout - time.monotonic() if started else JOB_START_POLL_INTERVAL
+        try:
+            return job.result(timeout=max(0.0, wait))
+        except concurrent.futures.TimeoutError:
+            if started and not job.done():
+                break
+    debug_log(f"❌ Image job still running after {timeout}s, restarting workers", 'critical')
+    stop_workers(kill=True)
+    raise TimeoutError(f"image job still running after {timeout}s")
+
+
+def stop_workers(kill=False):
+    """
+    Stop the worker processes (they are started again by the next submit())
+
+    :param kill: True to kill the workers now, instead of letting them finish their current job
+    """
+    global executor
+
+    with lock:
+        if executor is None:
+            return
+        old_executor, executor = executor, None
+
+    if kill:
+        # ProcessPoolExecutor can't kill a busy worker : terminate the processes ourselves
+        for process in list((old_executor._processes or {}).values()):
+            process.terminate()
+    old_executor.shutdown(wait=not kill, cancel_futures=True)